@@ -1,5 +1,22 @@
-from .scm import SimpleClimateModel, SCMError
+from .scm import (SimpleClimateModel, SCMError, SCMGraph, SCMResults, SCMState, SCMStepper, EmissionRec, EmissionSeries,
+                  diagnose_emissions, read_emissions, read_emissions_batch, run_concentrations, run_from_state,
+                  run_scenario_tree, run_scenarios, spin_up)
 
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
+
+def __getattr__(name):
+    # The version is resolved on first access rather than at import time. Built packages contain a static _version.py
+    # written by versioneer at build time, whose version is read directly. Only in a development checkout, which has no
+    # static version, does versioneer run git.
+    if name == '__version__':
+        global __version__
+        from . import _version
+        try:
+            version_json = _version.version_json
+        except AttributeError:
+            __version__ = _version.get_versions()['version']
+        else:
+            import json
+            __version__ = json.loads(version_json)['version']
+        return __version__
+
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,358 @@
+import numpy as np
+
+from . import scm
+
+"""
+Tangent-linear and adjoint models of the simple climate model. The tangent-linear model propagates a change of the
+emissions through the model linearised around a model run, e.g. to get the change in temperature caused by a small change of
+the emissions in all years at once. The adjoint model propagates weights on the temperature and sea level change backwards,
+giving the gradient of their weighted sum with respect to the emissions of all years and species at the cost of about one
+extra model run (instead of one run per year and species for finite differences).
+
+Both linearise the whole model as run by :func:`pySCM.run_scenarios` with co2_method='modes', including the carbonate
+chemistry of the ocean (:func:`pySCM.scm.delta_co2_from_ocean`), the |CO2| fertilisation of the biosphere and the
+logarithmic and square root radiative forcing of |CO2|, |CH4| and |N2O|. :func:`solve_emission_scale` uses the
+tangent-linear model to find emission pathways which meet a temperature target.
+"""
+
+# Step of the complex-step derivatives of the nonlinear functions. Complex-step derivatives have no cancellation error, so
+# the step can be far below the machine precision.
+_complex_step = 1e-30
+
+
+def tangent_linear_model(co2_emis, ch4_emis, n2o_emis, sox_emis, num_years, OceanMLDepth, directions, method='auto',
+                         climate_sensitivity=scm.default_climate_sensitivity,
+                         air_sea_gas_exchange_coeff=scm.default_air_sea_gas_exchange_coeff,
+                         biosphere_npp_0=scm.default_biosphere_npp_0, co2_fert_factor=scm.default_co2_fert_factor):
+    """
+    This function runs the model and its tangent-linear model, i.e. it also returns the first order change of the results
+    caused by a change of the emissions:
+
+    >>> results, tangent = pySCM.adjoint.tangent_linear_model(co2, ch4, n2o, sox, 800, 75.0, {'CO2': co2_change})
+    >>> tangent.delta_temperature
+
+    The arguments are those of :func:`pySCM.run_scenarios`. The changes of the emissions may have additional leading axes,
+    e.g. to evaluate several directions at once.
+
+    :param directions: dict of the changes of the emissions of 'CO2', 'CH4', 'N2O' and 'SOx' (species which are not given are
+        not changed)
+    :returns: the SCMResults of the run and an SCMResults holding the changes of its arrays
+    """
+    base = _Linearisation(co2_emis, ch4_emis, n2o_emis, sox_emis, num_years, OceanMLDepth, method, climate_sensitivity,
+                          air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor)
+    unknown = set(directions) - set(scm.EmissionSeries.species)
+    if unknown:
+        raise scm.SCMError('unknown species {}'.format(', '.join(sorted(unknown))))
+    changes = []
+    for name in scm.EmissionSeries.species:
+        change = np.asarray(directions.get(name, 0.0), dtype=float)
+        changes.append(np.broadcast_to(change, (base.num_years_run,)) if change.ndim == 0 else change)
+    co2_change, ch4_change, n2o_change, sox_change = changes
+
+    co2_concs = base.carbon_cycle_tangent(co2_change)
+    ch4_concs = scm.ch4_emis_to_concs(ch4_change)
+    n2o_concs = scm.n2o_emis_to_concs(n2o_change)
+    rf = base.rf_co2 * co2_concs + base.rf_ch4 * ch4_concs + base.rf_n2o * n2o_concs + base.rf_sox * sox_change
+    delta_temperature = scm.calc_delta_surf_temp(num_years, rf, method, climate_sensitivity)
+    slr = scm.calculate_slr(num_years, delta_temperature, method)
+
+    return base.results, scm.SCMResults(co2_concs, ch4_concs, n2o_concs, rf, delta_temperature, slr)
+
+
+def adjoint_model(co2_emis, ch4_emis, n2o_emis, sox_emis, num_years, OceanMLDepth, temperature_weights=0.0,
+                  slr_weights=0.0, method='auto', climate_sensitivity=scm.default_climate_sensitivity,
+                  air_sea_gas_exchange_coeff=scm.default_air_sea_gas_exchange_coeff,
+                  biosphere_npp_0=scm.default_biosphere_npp_0, co2_fert_factor=scm.default_co2_fert_factor):
+    """
+    This function runs the model and its adjoint model, which returns the gradient of
+
+        J = sum(temperature_weights * delta_temperature) + sum(slr_weights * slr)
+
+    (summed over the years of each scenario) with respect to the emissions of all species and years, e.g. the sensitivity of
+    the temperature change in 2100 to the emissions of every year:
+
+    >>> weights = np.zeros(351)
+    >>> weights[-1] = 1.0
+    >>> results, gradients = pySCM.adjoint.adjoint_model(co2, ch4, n2o, sox, 800, 75.0, temperature_weights=weights)
+    >>> gradients['CO2']
+
+    The arguments are those of :func:`pySCM.run_scenarios`. The weights may have additional leading axes, e.g. the rows of
+    an identity matrix give the Jacobian of the temperature change with respect to the emissions.
+
+    :param temperature_weights: weights of the temperature change of each year
+    :param slr_weights: weights of the sea level change of each year
+    :returns: the SCMResults of the run and a dict of the gradients with respect to the emissions of 'CO2', 'CH4', 'N2O'
+        and 'SOx' (each with the shape of the weighted results)
+    """
+    base = _Linearisation(co2_emis, ch4_emis, n2o_emis, sox_emis, num_years, OceanMLDepth, method, climate_sensitivity,
+                          air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor)
+    shape = np.broadcast_shapes(np.shape(temperature_weights), np.shape(slr_weights), base.results.slr.shape)
+
+    # the linear stages are convolutions with a causal response function, their transpose is the same convolution in
+    # reverse time
+    slr_weights = np.broadcast_to(np.asarray(slr_weights, dtype=float), shape)
+    temperature_weights = temperature_weights + _reversed(scm.calculate_slr(num_years, _reversed(slr_weights), method))
+    rf_weights = _reversed(scm.calc_delta_surf_temp(num_years, _reversed(temperature_weights), method,
+                                                    climate_sensitivity))
+
+    gradients = {'SOx': base.rf_sox * rf_weights}
+    for name, rf_derivative in (('CH4', base.rf_ch4), ('N2O', base.rf_n2o)):
+        gradients[name] = _reversed(scm.linear_decay_emis_to_concs(_reversed(rf_derivative * rf_weights),
+                                                                   *scm.decay_species[name]))
+    gradients['CO2'] = base.carbon_cycle_adjoint(base.rf_co2 * rf_weights)
+
+    return base.results, gradients
+
+
+def solve_emission_scale(co2_emis, ch4_emis, n2o_emis, sox_emis, num_years, OceanMLDepth, target, year=None,
+                         species=('CO2',), start=0, tolerance=1e-6, max_iterations=20, method='auto',
+                         climate_sensitivity=scm.default_climate_sensitivity,
+                         air_sea_gas_exchange_coeff=scm.default_air_sea_gas_exchange_coeff,
+                         biosphere_npp_0=scm.default_biosphere_npp_0, co2_fert_factor=scm.default_co2_fert_factor):
+    """
+    This function finds the factor by which the emissions of a reference pathway need to be scaled so that the peak
+    temperature change (or the temperature change in a given year) meets a target, e.g. the factor on the |CO2| emissions
+    from 2020 (year index 270) onwards which limits the peak warming to 1.5 degC:
+
+    >>> scale, results = pySCM.adjoint.solve_emission_scale(co2, ch4, n2o, sox, 800, 75.0, 1.5, start=270)
+
+    The factor is found with Newton's method, where the derivative of the temperature change with respect to the factor is
+    given by the tangent-linear model (see :func:`tangent_linear_model`), so only a few model runs are needed. The other
+    arguments are those of :func:`pySCM.run_scenarios`. All scenarios, ensemble members and targets are solved for at once;
+    the target may be a numpy.array which is broadcast against the scenario axes, e.g. to solve for several targets.
+
+    :param target: the temperature change to meet [degC]
+    :param year: index of the year of the target (default: the peak temperature change of the run)
+    :param species: the species whose emissions are scaled
+    :param start: index of the first year whose emissions are scaled
+    :param tolerance: the maximum difference between the temperature change and the target [degC]
+    :param max_iterations: the maximum number of Newton iterations
+    :returns: the scale factors (one for each scenario and target) and the SCMResults of the scaled emissions
+    """
+    emissions = dict(zip(scm.EmissionSeries.species, [np.asarray(series, dtype=float)
+                                                      for series in (co2_emis, ch4_emis, n2o_emis, sox_emis)]))
+    unknown = set(species) - set(emissions)
+    if unknown:
+        raise scm.SCMError('unknown species {}'.format(', '.join(sorted(unknown))))
+    scaled_years = np.arange(emissions['CO2'].shape[-1]) >= start
+    directions = {name: np.where(scaled_years, emissions[name], 0.0) for name in species}
+
+    scale = np.ones(np.shape(target))
+    step = np.zeros(np.shape(target))
+    # scale factors which are known to give a temperature change below and above the target
+    below = np.full(np.shape(target), np.nan)
+    above = np.full(np.shape(target), np.nan)
+    for iteration in range(max_iterations):
+        scaled = dict(emissions)
+        for name in species:
+            scaled[name] = emissions[name] + (scale[..., np.newaxis] - 1.0) * directions[name]
+        with np.errstate(invalid='ignore'):
+            results, tangent = tangent_linear_model(
+                *[scaled[name] for name in scm.EmissionSeries.species], num_years, OceanMLDepth, directions, method,
+                climate_sensitivity, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor)
+
+        # a step which overshoots to negative concentrations gives NaN, it is halved until the run is valid again
+        invalid = ~np.all(np.isfinite(results.delta_temperature), axis=-1)
+        if np.any(invalid):
+            step = np.where(invalid, step / 2, 0.0)
+            scale = scale - step
+            continue
+
+        if year is None:
+            # the derivative of the peak is that of the temperature change in the year of the peak
+            index = np.argmax(results.delta_temperature, axis=-1)[..., np.newaxis]
+            value = np.take_along_axis(results.delta_temperature, index, axis=-1)[..., 0]
+            derivative = np.take_along_axis(np.broadcast_to(tangent.delta_temperature, results.delta_temperature.shape),
+                                            index, axis=-1)[..., 0]
+        else:
+            value = results.delta_temperature[..., year]
+            derivative = np.broadcast_to(tangent.delta_temperature, results.delta_temperature.shape)[..., year]
+
+        residual = value - target
+        if np.all(np.abs(residual) <= tolerance):
+            return scale, results
+        below = np.where(residual < 0, scale, below)
+        above = np.where(residual > 0, scale, above)
+
+        # Newton steps which leave the bracket of the target (e.g. because the year of the peak changes) are replaced by
+        # bisection
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_scale = scale - residual / derivative
+        bracketed = ~np.isnan(below) & ~np.isnan(above)
+        inside = (new_scale > np.fmin(below, above)) & (new_scale < np.fmax(below, above))
+        if np.any(~bracketed & ~np.isfinite(new_scale)):
+            raise scm.SCMError('the temperature change does not depend on the scaled emissions')
+        new_scale = np.where(bracketed & ~inside, (below + above) / 2, new_scale)
+        step = new_scale - scale
+        scale = new_scale
+
+    raise scm.SCMError('the emission scale factor did not converge in {} iterations'.format(max_iterations))
+
+
+def _reversed(series):
+    return np.asarray(series)[..., ::-1]
+
+
+def _derivative(function, x):
+    """
+    This private function returns the derivative of an analytic function which is evaluated element-wise on arrays using the
+    complex-step method.
+    """
+    return np.imag(function(np.asarray(x, dtype=float) + 1j * _complex_step)) / _complex_step
+
+
+def _lagged_sum(signal, amplitudes, decay, first_lag, num_years):
+    """
+    This private function returns sum(amplitudes * decay ** lag * signal[..., t - lag]) over the modes (the first axis of
+    amplitudes and decay) and the lags first_lag <= lag < num_years for every year t, i.e. a convolution with the modes of a
+    response function which starts after first_lag years and is truncated after num_years years.
+    """
+    result = np.zeros(np.broadcast_shapes(signal.shape, amplitudes.shape[1:] + (1,)))
+    if num_years <= first_lag:
+        return result
+
+    state = np.zeros(decay.shape[:1] + result.shape[:-1])
+    for yr in range(first_lag, signal.shape[-1]):
+        state = decay * state + decay ** first_lag * signal[..., yr - first_lag]
+        if yr >= num_years:
+            state -= decay ** num_years * signal[..., yr - num_years]
+        result[..., yr] = np.sum(amplitudes * state, axis=0)
+
+    return result
+
+
+class _Linearisation:
+    """
+    This private class runs the model and holds the derivatives of its nonlinear functions along the run, which define the
+    tangent-linear and adjoint models.
+
+    The carbon cycle of :func:`pySCM.scm.co2_emis_to_concs_modes` is, written with the ocean and biosphere response
+    functions ro and rb which are truncated after num_years years,
+
+        S[t] = sum(ro[lag] * F[t - lag])                          surface ocean DIC, lag >= 1
+        F[t] = k * (C[t] - delta_co2_from_ocean(S[t]))            air-sea flux
+        X[t] = npp * fert * log(1 + C[t] / C0) / PgCperppm        CO2 taken up by stimulated plant growth
+        C[t + 1] = C[t] + E[t] / PgCperppm - F[t] - X[t] + sum(rb[lag] * X[t - lag])
+
+    The air-sea fluxes F of the run follow from the mass balance of the atmosphere (the last equation), so that the
+    derivatives are evaluated for the same run as the concentrations returned by :func:`pySCM.run_scenarios`.
+    """
+
+    def __init__(self, co2_emis, ch4_emis, n2o_emis, sox_emis, num_years, OceanMLDepth, method, climate_sensitivity,
+                 air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor):
+        co2_emis = np.asarray(co2_emis, dtype=float)
+        self.num_years = num_years
+        self.num_years_run = co2_emis.shape[-1]
+        self.parameters = (num_years, OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor)
+        # the parameters broadcast against the scenario axes, add the time axis
+        air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor = [
+            np.asarray(parameter, dtype=float)[..., np.newaxis]
+            for parameter in (air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor)]
+
+        # the concentrations of one more year give the air-sea flux of the last year
+        atmos_co2 = scm.co2_emis_to_concs_modes(scm._extend(co2_emis, 1), *self.parameters, scm.base_CO2)
+        co2_concs = atmos_co2[..., :-1]
+        ch4_concs = scm.ch4_emis_to_concs(ch4_emis)
+        n2o_concs = scm.n2o_emis_to_concs(n2o_emis)
+        rf = scm.calculate_rf(sox_emis, co2_concs, ch4_concs, n2o_concs)
+        delta_temperature = scm.calc_delta_surf_temp(num_years, rf, method, climate_sensitivity)
+        self.results = scm.SCMResults(co2_concs, ch4_concs, n2o_concs, rf, delta_temperature,
+                                      scm.calculate_slr(num_years, delta_temperature, method))
+
+        modes = self._modes(co2_concs.ndim - 1)
+        fertilisation = biosphere_npp_0 * co2_fert_factor / scm.PgCperppm
+        x_atmos_bio = fertilisation * np.log(1.0 + co2_concs / scm.base_CO2)
+        atmos_sea_flux = co2_concs - atmos_co2[..., 1:] + co2_emis / scm.PgCperppm - x_atmos_bio + \
+            _lagged_sum(x_atmos_bio, modes.bio_amplitudes, modes.bio_decay, 1, num_years)
+        surface_ocean_dic = _lagged_sum(atmos_sea_flux, modes.ocean_amplitudes, modes.ocean_decay, 2, num_years)
+        surface_ocean_dic[..., 1:] += np.asarray(modes.ocean_lag1)[..., np.newaxis] * atmos_sea_flux[..., :-1]
+
+        # derivatives of the air-sea flux, the biosphere uptake and the radiative forcing along the run
+        self.air_sea_gas_exchange_coeff = air_sea_gas_exchange_coeff
+        self.dic_derivative = _derivative(scm.delta_co2_from_ocean, surface_ocean_dic)
+        self.bio_derivative = fertilisation / (scm.base_CO2 + co2_concs)
+        self.rf_co2 = 5.35 / (scm.base_CO2 + co2_concs)
+        ch4_concs = scm.base_CH4 + ch4_concs
+        n2o_concs = scm.base_N20 + n2o_concs
+        self.rf_ch4 = 0.018 / np.sqrt(ch4_concs) - _derivative(lambda ch4: scm.ch4_n2o_overlap(ch4, scm.base_N20),
+                                                               ch4_concs)
+        self.rf_n2o = 0.06 / np.sqrt(n2o_concs) - _derivative(lambda n2o: scm.ch4_n2o_overlap(scm.base_CH4, n2o),
+                                                              n2o_concs)
+        self.rf_sox = scm.aerDirectFac + scm.aerIndirectFac
+
+    def _modes(self, batch_ndim):
+        return scm._CarbonCycleModes(*self.parameters, scm.base_CO2, batch_ndim)
+
+    def carbon_cycle_tangent(self, co2_change):
+        """
+        This function returns the changes of the |CO2| concentrations caused by changes of the |CO2| emissions.
+        """
+        num_years = self.num_years
+        batch_shape = np.broadcast_shapes(co2_change.shape[:-1], self.dic_derivative.shape[:-1])
+        modes = self._modes(len(batch_shape))
+        atmos_co2 = np.zeros(batch_shape + (self.num_years_run + 1,))
+        atmos_sea_flux = np.zeros(batch_shape + (self.num_years_run,))
+        x_atmos_bio = np.zeros(batch_shape + (self.num_years_run,))
+        ocean_state = np.zeros(modes.ocean_decay.shape[:1] + batch_shape)
+        bio_state = np.zeros(modes.bio_decay.shape[:1] + batch_shape)
+
+        for yr in range(self.num_years_run):
+            # the same recurrences of the modes as in the model, see _CarbonCycleModes.step
+            if yr >= 2 and num_years > 2:
+                ocean_state = modes.ocean_decay * ocean_state + modes.ocean_decay ** 2 * atmos_sea_flux[..., yr - 2]
+                if yr >= num_years:
+                    ocean_state -= modes.ocean_decay ** num_years * atmos_sea_flux[..., yr - num_years]
+            if yr >= 1 and num_years > 1:
+                bio_state = modes.bio_decay * bio_state + modes.bio_decay * x_atmos_bio[..., yr - 1]
+                if yr >= num_years:
+                    bio_state -= modes.bio_decay ** num_years * x_atmos_bio[..., yr - num_years]
+
+            surface_ocean_dic = modes.ocean_lag1 * atmos_sea_flux[..., yr - 1] + \
+                np.sum(modes.ocean_amplitudes * ocean_state, axis=0) if yr > 0 else 0.0
+            atmos_sea_flux[..., yr] = self.air_sea_gas_exchange_coeff[..., 0] * (
+                    atmos_co2[..., yr] - self.dic_derivative[..., yr] * surface_ocean_dic)
+            x_atmos_bio[..., yr] = self.bio_derivative[..., yr] * atmos_co2[..., yr]
+            atmos_co2[..., yr + 1] = atmos_co2[..., yr] + co2_change[..., yr] / scm.PgCperppm - \
+                atmos_sea_flux[..., yr] - x_atmos_bio[..., yr] + np.sum(modes.bio_amplitudes * bio_state, axis=0)
+
+        return atmos_co2[..., :-1]
+
+    def carbon_cycle_adjoint(self, co2_weights):
+        """
+        This function returns the gradient of sum(co2_weights * co2_concs) with respect to the |CO2| emissions.
+        """
+        num_years = self.num_years
+        n = self.num_years_run
+        batch_shape = np.broadcast_shapes(co2_weights.shape[:-1], self.dic_derivative.shape[:-1])
+        modes = self._modes(len(batch_shape))
+        # adjoints of the concentrations (including that of the year after the run) and of the surface ocean DIC
+        atmos_co2 = np.zeros(batch_shape + (n + 1,))
+        atmos_co2[..., :n] = co2_weights
+        surface_ocean_dic = np.zeros(batch_shape + (n,))
+        co2_emis = np.zeros(batch_shape + (n,))
+        # sum(decay ** lag * adjoint[yr + lag]) of the following years, the transpose of the states of the model
+        ocean_state = np.zeros(modes.ocean_decay.shape[:1] + batch_shape)
+        bio_state = np.zeros(modes.bio_decay.shape[:1] + batch_shape)
+
+        def later(adjoint, yr):
+            return adjoint[..., yr] if yr < adjoint.shape[-1] else 0.0
+
+        for yr in range(n - 1, -1, -1):
+            next_atmos_co2 = atmos_co2[..., yr + 1]
+            if num_years > 1:
+                bio_state = modes.bio_decay * bio_state + modes.bio_decay * later(atmos_co2, yr + 2) - \
+                    modes.bio_decay ** num_years * later(atmos_co2, yr + 1 + num_years)
+            if num_years > 2:
+                ocean_state = modes.ocean_decay * ocean_state + modes.ocean_decay ** 2 * later(surface_ocean_dic, yr + 2) \
+                    - modes.ocean_decay ** num_years * later(surface_ocean_dic, yr + num_years)
+
+            x_atmos_bio = np.sum(modes.bio_amplitudes * bio_state, axis=0) - next_atmos_co2
+            atmos_sea_flux = modes.ocean_lag1 * later(surface_ocean_dic, yr + 1) + \
+                np.sum(modes.ocean_amplitudes * ocean_state, axis=0) - next_atmos_co2
+            surface_ocean_dic[..., yr] = -self.air_sea_gas_exchange_coeff[..., 0] * self.dic_derivative[..., yr] * \
+                atmos_sea_flux
+            atmos_co2[..., yr] += next_atmos_co2 + self.bio_derivative[..., yr] * x_atmos_bio + \
+                self.air_sea_gas_exchange_coeff[..., 0] * atmos_sea_flux
+            co2_emis[..., yr] = next_atmos_co2 / scm.PgCperppm
+
+        return co2_emis
@@ -0,0 +1,369 @@
+import hashlib
+import numbers
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+"""
+Caching of numpy arrays for the simple climate model. MemoryCache keeps arrays (e.g. response functions) in memory, DiskCache
+stores them on disk (e.g. the interpolated emissions read from file) as .npy files so that they can be memory-mapped when
+loaded. The total size of both caches is bounded; when it is exceeded, the least recently used entries are deleted.
+ResultCache combines both to cache the results of whole model runs, keyed by a hash of their inputs (see content_key).
+"""
+
+
+class MemoryCache:
+    """
+    This class is an in-memory least recently used cache whose size is bounded by the total number of bytes of the cached
+    values rather than by their number:
+
+    >>> cache = pySCM.cache.MemoryCache(max_bytes=64 * 1024 ** 2)
+
+    The number of hits and misses are counted so that the cache can be sized.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: maximum total size of all entries in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        This function returns the value stored for key and marks it as recently used.
+
+        :param key: the key of the entry, any hashable object.
+        :returns: the value or None if there is no entry for key.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        """
+        This function stores a value for key and evicts the least recently used entries if the cache is too large. Values
+        larger than max_bytes are not stored.
+
+        :param key: the key of the entry, any hashable object.
+        :param value: the value, e.g. a numpy.array.
+        :param nbytes: the size of the value in bytes, by default value.nbytes.
+        """
+        if nbytes is None:
+            nbytes = value.nbytes
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes:
+                self._total_bytes -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        """
+        This function deletes all entries and resets the hit and miss counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def nbytes(self):
+        """
+        The total size of all entries in bytes.
+        """
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """
+    This class stores numpy arrays in a directory, one .npy file per key. It can be created by typing:
+
+    >>> cache = pySCM.cache.DiskCache('PathOfCacheDirectory', max_bytes=256 * 1024 ** 2)
+
+    Loading an entry marks it as recently used. After saving an entry, the least recently used entries are deleted until the
+    total size of all entries is at most max_bytes.
+    """
+
+    suffix = '.npy'
+
+    def __init__(self, directory, max_bytes=256 * 1024 ** 2, key_mode='mtime'):
+        """
+        :param directory: path of the cache directory, it will be created if it does not exist.
+        :param max_bytes: maximum total size of all entries in bytes.
+        :param key_mode: how :meth:`file_key` identifies a file: 'mtime' (default) uses the path, modification time and size of
+            the file, 'content' uses a hash of the file content so that identical files share entries.
+        """
+        if key_mode not in ('mtime', 'content'):
+            from .scm import SCMError
+            raise SCMError('{} is not a valid key mode'.format(key_mode))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.key_mode = key_mode
+        # total size of all entries, determined when the first entry is saved
+        self._total_bytes = None
+        os.makedirs(directory, exist_ok=True)
+
+    def file_key(self, filename, *args):
+        """
+        This function returns a key for data derived from the given file and any further arguments, e.g. the start and end
+        year of a simulation. The key changes if the file changes.
+
+        :param filename: path and filename of the file.
+        :returns: string -- the key
+        """
+        digest = hashlib.sha1()
+        if self.key_mode == 'content':
+            with open(filename, 'rb') as reader:
+                digest.update(reader.read())
+        else:
+            stat = os.stat(filename)
+            digest.update(repr((os.path.realpath(filename), stat.st_mtime_ns, stat.st_size)).encode())
+        digest.update(repr(args).encode())
+
+        return digest.hexdigest()
+
+    def load(self, key, mmap_mode='c'):
+        """
+        This function loads the array stored for key.
+
+        :param key: the key of the entry.
+        :param mmap_mode: passed to numpy.load, by default the file is memory-mapped copy-on-write.
+        :returns: numpy.array or None if there is no entry for key.
+        """
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode=mmap_mode)
+        except (OSError, ValueError):
+            # e.g. a missing entry or one written by another user that cannot be read
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return array
+
+    def save(self, key, array):
+        """
+        This function stores an array for key and evicts the least recently used entries if the cache is too large.
+
+        :param key: the key of the entry.
+        :param array: numpy.array
+        """
+        # write to a temporary file first so that concurrent readers never see a partially written entry; unlike
+        # tempfile.mkstemp, the file gets the default permissions from the umask so that the directory can be shared
+        # between users
+        tmp_path = os.path.join(self.directory, uuid.uuid4().hex + '.tmp')
+        handle = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+        try:
+            with os.fdopen(handle, 'wb') as writer:
+                np.save(writer, np.asarray(array))
+            size = os.path.getsize(tmp_path)
+            try:
+                # an existing entry for key is replaced, so its size no longer counts
+                size -= os.path.getsize(self._path(key))
+            except OSError:
+                pass
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+        # only scan the cache directory if the entries might exceed max_bytes
+        if self._total_bytes is None:
+            self._total_bytes = sum(entry[1] for entry in self._entries())
+        else:
+            self._total_bytes += size
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def clear(self):
+        """
+        This function deletes all entries.
+        """
+        for path, size, mtime in self._entries():
+            _remove(path)
+        self._total_bytes = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _entries(self):
+        """
+        This private function returns (path, size, last use) of all entries.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime_ns))
+
+        return entries
+
+    def _evict(self):
+        """
+        This private function deletes the least recently used entries until the cache is at most max_bytes large.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for path, size, mtime in entries)
+        for path, size, mtime in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+        self._total_bytes = total
+
+
+class ResultCache:
+    """
+    This class caches the results of model runs, e.g. of :func:`pySCM.run_scenarios` or
+    :meth:`pySCM.SimpleClimateModel.run_model`:
+
+    >>> cache = pySCM.cache.ResultCache(directory='PathOfCacheDirectory')
+    >>> results = pySCM.run_scenarios(co2, ch4, n2o, sox, 800, 75.0, cache=cache)
+
+    The results are keyed by a hash of the emissions and parameters of the run (see :func:`content_key`) and of the source
+    code of pySCM, so identical runs share an entry even if they are set up independently. Entries are kept in a
+    MemoryCache and, if a directory is given, in a DiskCache so that they can be shared between processes and jobs. Cached
+    arrays are read-only.
+
+    hits counts the runs served from either tier (disk_hits of which were loaded from disk) and misses the runs that had to
+    be evaluated.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 ** 2, directory=None, max_disk_bytes=256 * 1024 ** 2):
+        """
+        :param max_bytes: maximum total size of the entries kept in memory in bytes.
+        :param directory: path of the cache directory of the disk tier (default: no disk tier).
+        :param max_disk_bytes: maximum total size of the entries kept on disk in bytes.
+        """
+        self.memory = MemoryCache(max_bytes)
+        self.disk = DiskCache(directory, max_disk_bytes) if directory else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key, names):
+        """
+        This function returns the arrays stored for key.
+
+        :param key: the key of the entry, see :func:`content_key`.
+        :param names: names of the arrays of the entry.
+        :returns: dict of read-only numpy.arrays or None if there is no entry for key.
+        """
+        arrays = self.memory.get(key)
+        if arrays is None and self.disk is not None:
+            # each array is stored in its own file; the entry is only complete if none of them has been evicted
+            loaded = [self.disk.load('{}-{}'.format(key, name), mmap_mode=None) for name in names]
+            if all(array is not None for array in loaded):
+                arrays = dict(zip(names, loaded))
+                self._put_memory(key, arrays)
+                self.disk_hits += 1
+        if arrays is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        This function stores the arrays of a run for key. The arrays are made read-only.
+
+        :param key: the key of the entry, see :func:`content_key`.
+        :param arrays: dict of numpy.arrays.
+        """
+        self._put_memory(key, arrays)
+        if self.disk is not None:
+            for name, array in arrays.items():
+                self.disk.save('{}-{}'.format(key, name), array)
+
+    def clear(self):
+        """
+        This function deletes all entries of both tiers and resets the hit and miss counters.
+        """
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _put_memory(self, key, arrays):
+        for array in arrays.values():
+            array.flags.writeable = False
+        self.memory.put(key, arrays, nbytes=sum(array.nbytes for array in arrays.values()))
+
+
+def content_key(*values):
+    """
+    This function returns a stable hash of numpy arrays, numbers, strings and (nested) tuples, lists and dicts of them. It
+    only depends on the content of the values, e.g. on the data type, shape and values of the arrays but not on their
+    memory layout, so it can be used as a key for results across processes.
+
+    :returns: string -- the key
+    """
+    digest = hashlib.sha1()
+    _update_digest(digest, values)
+
+    return digest.hexdigest()
+
+
+def _update_digest(digest, value):
+    """
+    This private function adds a value to a hash. Every value is prefixed by its type (and containers by their length) so
+    that different values cannot give the same sequence of bytes.
+    """
+    if isinstance(value, numbers.Real) and not isinstance(value, (bool, np.bool_)):
+        # integer and float parameters (including numpy scalars) with the same value give the same results
+        digest.update('number{!r}'.format(float(value)).encode())
+    elif isinstance(value, (np.ndarray, np.generic)) and not np.asarray(value).dtype.hasobject:
+        value = np.asarray(value, order='C')
+        digest.update('array{}{}'.format(value.dtype.str, value.shape).encode())
+        digest.update(value.data)
+    elif isinstance(value, (tuple, list)):
+        digest.update('sequence{}'.format(len(value)).encode())
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, dict):
+        digest.update('dict{}'.format(len(value)).encode())
+        for key in sorted(value, key=repr):
+            _update_digest(digest, key)
+            _update_digest(digest, value[key])
+    elif value is None or isinstance(value, (bool, str)):
+        digest.update('{}{!r}'.format(type(value).__name__, value).encode())
+    else:
+        from .scm import SCMError
+        raise SCMError('{} cannot be used in a cache key'.format(type(value).__name__))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # e.g. an entry that has already been removed by another process or that belongs to another user
+        pass
@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from . import scm
+
+"""
+Checkpoints of in-progress model runs. A checkpoint holds everything needed to continue a run, e.g. an SCMStepper with its
+carbon cycle state, concentrations and the mode states and ring buffers of the temperature and sea level responses, or an
+SCMState from which scenarios are branched. It is a numpy .npz file containing the arrays of the object and a JSON
+description of its structure, so that it can be loaded without unpickling arbitrary objects. Restoring a checkpoint
+restores the arrays bit for bit, so a resumed run gives the same results as an uninterrupted one.
+"""
+
+# Version of the checkpoint format, it is increased when checkpoints written by older versions can no longer be read
+# (version 2: classes are stored under the names in _classes rather than their class names)
+checkpoint_version = 2
+
+_format_name = 'pySCM checkpoint'
+
+# Classes that can be stored in a checkpoint by the name they are stored under. The names are part of the checkpoint format,
+# so they must not change if a class is renamed, e.g. the private _CarbonCycleModes is stored as CarbonCycleModes
+_classes = {'SCMStepper': scm.SCMStepper, 'SCMState': scm.SCMState, 'SCMResults': scm.SCMResults,
+            'CarbonCycleState': scm.CarbonCycleState, 'CarbonCycleModes': scm._CarbonCycleModes}
+_class_names = {cls: name for name, cls in _classes.items()}
+
+
+def save_checkpoint(obj, filename):
+    """
+    This function writes a checkpoint of a model run to a file:
+
+    >>> pySCM.checkpoint.save_checkpoint(stepper, 'run.npz')
+
+    The file is replaced atomically, so a run that is interrupted while writing leaves the previous checkpoint intact.
+
+    :param obj: the object to store, e.g. an SCMStepper or an SCMState
+    :param filename: path and filename of the checkpoint
+    """
+    arrays = {}
+    manifest = {'format': _format_name, 'version': checkpoint_version, 'object': _encode(obj, arrays)}
+    arrays['manifest'] = np.array(json.dumps(manifest))
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as writer:
+            np.savez_compressed(writer, **arrays)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def load_checkpoint(filename):
+    """
+    This function reads a checkpoint written by :func:`save_checkpoint`:
+
+    >>> stepper = pySCM.checkpoint.load_checkpoint('run.npz')
+
+    :param filename: path and filename of the checkpoint
+    :returns: the stored object
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        if 'manifest' not in data.files:
+            raise scm.SCMError('{} is not a pySCM checkpoint'.format(filename))
+        manifest = json.loads(str(data['manifest']))
+        if manifest.get('format') != _format_name:
+            raise scm.SCMError('{} is not a pySCM checkpoint'.format(filename))
+        if manifest.get('version') != checkpoint_version:
+            raise scm.SCMError('{} has checkpoint format version {}, but version {} is required'.format(
+                filename, manifest.get('version'), checkpoint_version))
+        arrays = {name: data[name] for name in data.files}
+
+    return _decode(manifest['object'], arrays)
+
+
+def _encode(value, arrays):
+    """
+    This private function returns a JSON compatible description of value. numpy arrays (including numpy scalars) are added
+    to arrays and referenced by their key.
+    """
+    if isinstance(value, (np.ndarray, np.generic)):
+        key = 'array{}'.format(len(arrays))
+        arrays[key] = np.asarray(value)
+        return {'array': key, 'scalar': isinstance(value, np.generic)}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return {'value': value}
+    if isinstance(value, (list, tuple)):
+        return {'list': [_encode(item, arrays) for item in value], 'tuple': isinstance(value, tuple)}
+    if isinstance(value, dict):
+        return {'dict': {key: _encode(item, arrays) for key, item in value.items()}}
+    if type(value) in _class_names:
+        return {'class': _class_names[type(value)],
+                'attributes': {name: _encode(item, arrays) for name, item in vars(value).items()}}
+
+    raise scm.SCMError('{} cannot be stored in a checkpoint'.format(type(value).__name__))
+
+
+def _decode(description, arrays):
+    """
+    This private function recreates a value from its description, see :func:`_encode`.
+    """
+    if 'array' in description:
+        array = arrays[description['array']]
+        return array[()] if description['scalar'] else array
+    if 'value' in description:
+        return description['value']
+    if 'list' in description:
+        items = [_decode(item, arrays) for item in description['list']]
+        return tuple(items) if description['tuple'] else items
+    if 'dict' in description:
+        return {key: _decode(item, arrays) for key, item in description['dict'].items()}
+    if description.get('class') in _classes:
+        obj = object.__new__(_classes[description['class']])
+        obj.__dict__.update({name: _decode(item, arrays) for name, item in description['attributes'].items()})
+        return obj
+
+    raise scm.SCMError('invalid checkpoint entry {}'.format(description))
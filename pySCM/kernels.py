@@ -0,0 +1,90 @@
+import numba
+import numpy as np
+
+from .scm import delta_co2_from_ocean
+
+"""
+Compiled kernels of the simple climate model. This module requires numba and is only imported when the 'numba' kernel
+backend is used (see :func:`pySCM.scm.set_kernel_backend`). The kernels are cached on disk so that they are only compiled
+once per installation.
+"""
+
+_delta_co2_from_ocean = numba.njit(cache=True)(delta_co2_from_ocean)
+
+
+@numba.njit(parallel=True, cache=True)
+def co2_emis_to_concs_modes(co2_emis, ocean_lag1, ocean_amplitudes, ocean_decay, bio_amplitudes, bio_decay,
+                            air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor, num_years, co2ppm_0, pgc_per_ppm,
+                            start_year, atmos_co2, atmos_sea_flux, x_atmos_bio_hist, ocean_state, bio_state, x_atmos_bio):
+    """
+    This function is the compiled equivalent of the integration loop of :func:`pySCM.scm.co2_emis_to_concs_modes`. The
+    ensemble members are integrated in parallel; all arrays of member parameters have one row per member. The arrays from
+    atmos_co2 onwards hold the initial state and are updated in place.
+
+    :param co2_emis: numpy.array -- atmospheric |CO2| emissions [PgC/year] with shape (n_members, n_years)
+    :param ocean_lag1: numpy.array -- ocean response to the flux of the previous year for each member
+    :param ocean_amplitudes: numpy.array -- amplitudes of the ocean response modes with shape (n_members, n_modes)
+    :param ocean_decay: numpy.array -- annual decay factors of the ocean response modes
+    :param bio_amplitudes: numpy.array -- amplitudes of the biosphere response modes
+    :param bio_decay: numpy.array -- annual decay factors of the biosphere response modes
+    :param air_sea_gas_exchange_coeff: numpy.array -- air-sea gas exchange coefficient of each member
+    :param biosphere_npp_0: numpy.array -- pre-industrial net primary production of each member
+    :param co2_fert_factor: numpy.array -- |CO2| fertilisation factor of each member
+    :param num_years: number of years the response functions are evaluated for
+    :param co2ppm_0: pre-industrial |CO2| concentration [ppm]
+    :param pgc_per_ppm: conversion factor from PgC to ppm
+    :param start_year: number of years integrated before the first year of emissions
+    :param atmos_co2: numpy.array -- |CO2| concentrations [ppm] with shape (n_members, n_years + 1), the first column holds
+        the initial concentrations
+    :param atmos_sea_flux: numpy.array -- air-sea fluxes with shape (n_members, n_history + n_years), the first n_history
+        columns hold the fluxes before the first year of emissions
+    :param x_atmos_bio_hist: numpy.array -- x_atmos_bio with the same shape and history as atmos_sea_flux
+    :param ocean_state: numpy.array -- states of the ocean modes with shape (n_members, n_modes)
+    :param bio_state: numpy.array -- states of the biosphere modes with shape (n_members, n_modes)
+    :param x_atmos_bio: numpy.array -- x_atmos_bio of each member
+    """
+    num_members, n = co2_emis.shape
+    history = atmos_sea_flux.shape[1] - n
+    ocean_decay_2 = ocean_decay ** 2
+    ocean_decay_n = ocean_decay ** num_years
+    bio_decay_n = bio_decay ** num_years
+
+    for member in numba.prange(num_members):
+        for ind in range(n):
+            yr_ind = start_year + ind
+            hist_ind = history + ind
+            if yr_ind >= 2 and num_years > 2:
+                for mode in range(ocean_decay.shape[0]):
+                    ocean_state[member, mode] = ocean_decay[mode] * ocean_state[member, mode] + \
+                                                ocean_decay_2[mode] * atmos_sea_flux[member, hist_ind - 2]
+                    if yr_ind >= num_years:
+                        ocean_state[member, mode] -= ocean_decay_n[mode] * atmos_sea_flux[member, hist_ind - num_years]
+            if yr_ind >= 1 and num_years > 1:
+                for mode in range(bio_decay.shape[0]):
+                    bio_state[member, mode] = bio_decay[mode] * bio_state[member, mode] + \
+                                              bio_decay[mode] * x_atmos_bio_hist[member, hist_ind - 1]
+                    if yr_ind >= num_years:
+                        bio_state[member, mode] -= bio_decay_n[mode] * x_atmos_bio_hist[member, hist_ind - num_years]
+
+            if yr_ind > 0:
+                ocean_sum = 0.0
+                for mode in range(ocean_decay.shape[0]):
+                    ocean_sum += ocean_amplitudes[member, mode] * ocean_state[member, mode]
+                sea_water_pco2 = _delta_co2_from_ocean(ocean_lag1[member] * atmos_sea_flux[member, hist_ind - 1] +
+                                                       ocean_sum)
+            else:
+                sea_water_pco2 = 0.0
+
+            atmos_sea_flux[member, hist_ind] = air_sea_gas_exchange_coeff[member] * (atmos_co2[member, ind] -
+                                                                                     sea_water_pco2)
+            delta = biosphere_npp_0[member] * co2_fert_factor[member] * np.log(
+                1.0 + (atmos_co2[member, ind] / co2ppm_0)) / pgc_per_ppm - x_atmos_bio[member]
+            x_atmos_bio[member] += delta
+            x_atmos_bio_hist[member, hist_ind] = x_atmos_bio[member]
+            bio_sum = 0.0
+            for mode in range(bio_decay.shape[0]):
+                bio_sum += bio_amplitudes[mode] * bio_state[member, mode]
+            atmos_bio_flux = x_atmos_bio[member] - bio_sum
+
+            atmos_co2[member, ind + 1] = atmos_co2[member, ind] + (co2_emis[member, ind] / pgc_per_ppm) - \
+                                         atmos_sea_flux[member, hist_ind] - atmos_bio_flux
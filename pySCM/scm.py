@@ -1,8 +1,11 @@
 import math
+import os
+import warnings
 
-import matplotlib.pyplot as plt
 import numpy as np
 
+from .cache import MemoryCache
+
 """
 Set the constants that are used for running the simple climate model at the beginning of the class.
 (1) Carbon dioxide (CO2), methane (CH4), and nitrous oxide (N2O) concentrations at their pre-industrial level (e.g. 1750 values).
@@ -24,6 +27,51 @@ PgCperppm = 2.123
 aerDirectFac = -0.002265226
 aerIndirectFac = -0.013558119
 
+# Double exponential impulse response functions, given as (amplitude, timescale [years]) for each mode. The values were
+# determined by fitting a double exponential impulse response function model (see documentation) to values from a HadCM3
+# 4xCO2 simulation.
+temp_response_modes = ((0.59557 / 8.4007, 8.4007), (0.40443 / 409.54, 409.54))
+slr_response_modes = ((0.96677 / 1700.2, 1700.2), (0.03323 / 33.788, 33.788))
+
+# Carbon cycle response functions from Joos et al. 1996 as (amplitude, timescale [years]) for each mode. The HILDA ocean mixed
+# layer response function has a different fit for the first two years, a timescale of infinity denotes a constant term.
+ocean_response_modes_early = ((0.12935, np.inf), (0.21898, 0.034569), (0.17003, 0.26936), (0.24071, 0.96083),
+                              (0.24093, 4.9792))
+ocean_response_modes = ((0.022936, np.inf), (0.24278, 1.2679), (0.13963, 5.2528), (0.089318, 18.601), (0.037820, 68.736),
+                        (0.035549, 232.30))
+biosphere_response_modes = ((0.7021, 1.0 / 0.35), (0.01341, 20.0), (-0.7185, 1.0 / 0.4583), (0.002932, 100.0))
+
+# Gases whose concentrations decay with a single lifetime as (lifetime [years], scale [Tg per ppb]), see
+# register_decay_species. The CH4 and N2O values are from the IPCC TAR report, chapter 4.
+decay_species = {'CH4': (10.0, 2.78), 'N2O': (114.0, 4.8)}
+
+# Cache of the response functions which only depend on their length and (for the ocean) the ocean mixed layer depth
+response_function_cache = MemoryCache(max_bytes=64 * 1024 ** 2)
+
+# Backend of the compiled kernels (see set_kernel_backend): 'auto' uses numba if it is installed and the batch is large
+# enough, 'numba' requires it and 'numpy' always uses the pure numpy implementation
+kernel_backend = 'auto'
+
+# Minimum number of ensemble members and scenarios for which the 'auto' kernel backend loads the numba kernels. Loading
+# them takes about 0.2 s (and about 2 s for the first compilation), a single scenario takes about 5 ms with numpy.
+numba_member_threshold = 1000
+
+# Default values of the model parameters that can be given as keyword arguments (or arrays to evaluate an ensemble)
+default_climate_sensitivity = 1.1  # [K/(W m^-2)] (4.114/3.74)
+default_air_sea_gas_exchange_coeff = 0.1042  # [kg m^-2 year^-1]
+default_biosphere_npp_0 = 60.0  # [GtC/year]
+# 0.287 balances LUC emission of 1.1 PgC/yr in 1980s (Joos et al, 1996)
+default_co2_fert_factor = 0.287
+
+# The compiled kernels once they have been loaded by _kernels
+_loaded_kernels = None
+
+# Time series longer than this (in years) are convolved with response functions using FFTs rather than directly
+fft_convolution_threshold = 500
+
+# Hash of the source files of pySCM, see _source_key
+_source_digest = None
+
 
 # -------------------------------------------------------------------------------
 # Error handling.
@@ -59,6 +107,380 @@ class EmissionRec:
         self.N2O = None
 
 
+class EmissionSeries:
+    """
+    This class holds the atmospheric emissions of |CO2| [PgC/year], |CH4| [TgCH4/year], |N2O| [TgN2O/year] and |SOx|
+    [TgS/year] for all years of a simulation in columnar form, i.e. one contiguous numpy.array per species which can be
+    accessed as attributes:
+
+    >>> emissions = pySCM.EmissionSeries(co2, ch4, n2o, sox, start_year=1750)
+    >>> emissions.CO2
+
+    All model functions accept an EmissionSeries directly. Time is the last axis of the arrays; any leading axes hold
+    different scenarios. For compatibility with code written for lists of EmissionRec, indexing an EmissionSeries with a year
+    index returns a record whose attributes read from and write to the arrays, so that emissions[i].CO2 keeps working.
+    Indexing with a slice returns an EmissionSeries holding the selected years.
+    """
+
+    species = ('CO2', 'CH4', 'N2O', 'SOx')
+
+    def __init__(self, CO2, CH4, N2O, SOx, start_year=None):
+        """
+        :param CO2: |CO2| emissions [PgC/year]
+        :param CH4: |CH4| emissions [TgCH4/year]
+        :param N2O: |N2O| emissions [TgN2O/year]
+        :param SOx: |SOx| emissions [TgS/year]
+        :param start_year: the year of the first emissions (optional)
+        """
+        self.CO2 = np.ascontiguousarray(CO2, dtype=float)
+        self.CH4 = np.ascontiguousarray(CH4, dtype=float)
+        self.N2O = np.ascontiguousarray(N2O, dtype=float)
+        self.SOx = np.ascontiguousarray(SOx, dtype=float)
+        self.start_year = start_year
+
+        if len(set(getattr(self, name).shape for name in self.species)) != 1:
+            raise SCMError('The emissions of all species must have the same shape')
+
+    @classmethod
+    def from_records(cls, records, start_year=None):
+        """
+        This function converts a list of EmissionRec into an EmissionSeries.
+
+        :param records: list of EmissionRec, one per year.
+        :param start_year: the year of the first record (optional)
+        :returns: EmissionSeries
+        """
+        return cls(*[[getattr(rec, name) for rec in records] for name in cls.species], start_year=start_year)
+
+    @property
+    def shape(self):
+        """
+        The shape of the emission arrays, i.e. (num_years,) or (n_scenarios, num_years).
+        """
+        return self.CO2.shape
+
+    def __len__(self):
+        return self.CO2.shape[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            years = range(len(self))[index]
+            start_year = self.start_year
+            if start_year is not None and len(years):
+                start_year += years.start
+            return EmissionSeries(*[getattr(self, name)[..., index] for name in self.species], start_year=start_year)
+
+        if index < -len(self) or index >= len(self):
+            raise IndexError('year index out of range')
+        return _EmissionRecView(self, index % len(self))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield _EmissionRecView(self, index)
+
+
+class _EmissionRecView(EmissionRec):
+    """
+    This private class is an EmissionRec which reads and writes the emissions of one year of an EmissionSeries.
+    """
+
+    def __init__(self, series, index):
+        self._series = series
+        self._index = index
+
+    def _species_property(name):
+        def getter(self):
+            return getattr(self._series, name)[..., self._index]
+
+        def setter(self, value):
+            getattr(self._series, name)[..., self._index] = value
+
+        return property(getter, setter)
+
+    CO2 = _species_property('CO2')
+    CH4 = _species_property('CH4')
+    N2O = _species_property('N2O')
+    SOx = _species_property('SOx')
+    del _species_property
+
+
+def _get_species(emissions, species):
+    """
+    This private function returns the emissions of one species as a numpy.array. The emissions can either be given as an
+    EmissionSeries, a list of EmissionRec or directly as an array holding the emissions of that species (time being the last
+    axis).
+    """
+    if isinstance(emissions, EmissionSeries):
+        return getattr(emissions, species)
+    if not isinstance(emissions, np.ndarray) and len(emissions) and hasattr(emissions[0], species):
+        return np.array([getattr(rec, species) for rec in emissions])
+
+    return np.asarray(emissions, dtype=float)
+
+
+def _batch_shape(*arrays):
+    """
+    This private function returns the shape of the scenario/ensemble axes of a model run, i.e. the broadcast shape of the
+    emissions without their time axis and all array parameters.
+    """
+    return np.broadcast_shapes(np.shape(arrays[0])[:-1], *[np.shape(array) for array in arrays[1:]])
+
+
+# -------------------------------------------------------------------------------
+# Model results
+# -------------------------------------------------------------------------------
+class SCMResults:
+    """
+    This class holds the results of a model run, i.e. the changes in |CO2| [ppm], |CH4| [ppb] and |N2O| [ppb]
+    concentrations relative to their pre-industrial values, the radiative forcing [W/m^2], the temperature change [degC]
+    and the sea level change. For batched runs (see :func:`run_scenarios`) each array has one row per scenario.
+    """
+
+    def __init__(self, co2_concs, ch4_concs, n2o_concs, rf, delta_temperature, slr, start_year=None):
+        self.co2_concs = co2_concs
+        self.ch4_concs = ch4_concs
+        self.n2o_concs = n2o_concs
+        self.rf = rf
+        self.delta_temperature = delta_temperature
+        self.slr = slr
+        self.start_year = start_year
+
+
+# Names of the arrays of SCMResults
+_result_names = ('co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr')
+
+
+class CarbonCycleState:
+    """
+    This class holds the state of the carbon cycle of :func:`co2_emis_to_concs_modes` at the beginning of a year, i.e. after
+    integrating the emissions of all previous years. Its arrays have the scenario axes of the run that created it.
+
+    :param year: number of years integrated since pre-industrial
+    :param atmos_co2: change in atmospheric |CO2| concentration [ppm]
+    :param x_atmos_bio: |CO2| taken up by stimulated plant growth that has not yet decayed [ppm]
+    :param ocean_state: states of the exponential modes of the ocean response function (mode being the first axis)
+    :param bio_state: states of the exponential modes of the biosphere response function (mode being the first axis)
+    :param atmos_sea_flux: air-sea fluxes of the last years that still contribute to the ocean states (time being the last
+        axis)
+    :param x_atmos_bio_hist: x_atmos_bio of the last years that still contribute to the biosphere states
+    """
+
+    def __init__(self, year, atmos_co2, x_atmos_bio, ocean_state, bio_state, atmos_sea_flux, x_atmos_bio_hist):
+        self.year = year
+        self.atmos_co2 = atmos_co2
+        self.x_atmos_bio = x_atmos_bio
+        self.ocean_state = ocean_state
+        self.bio_state = bio_state
+        self.atmos_sea_flux = atmos_sea_flux
+        self.x_atmos_bio_hist = x_atmos_bio_hist
+
+    def take(self, indices):
+        """
+        This function returns the state of the given scenarios, i.e. it selects along the last scenario axis. A scenario may
+        be selected several times to continue it with different emissions.
+
+        :param indices: indices of the scenarios
+        :returns: CarbonCycleState
+        """
+        return CarbonCycleState(self.year, np.take(self.atmos_co2, indices, axis=-1),
+                                np.take(self.x_atmos_bio, indices, axis=-1), np.take(self.ocean_state, indices, axis=-1),
+                                np.take(self.bio_state, indices, axis=-1), np.take(self.atmos_sea_flux, indices, axis=-2),
+                                np.take(self.x_atmos_bio_hist, indices, axis=-2))
+
+
+class SCMState:
+    """
+    This class holds the state of a model run at a branch year, i.e. everything needed to continue the run with different
+    emissions from that year on (see :func:`spin_up` and :func:`run_from_state`). The temperature and sea level responses
+    are linear, so the history of the radiative forcing and temperature change is held as the temperature and sea level
+    change it causes in the following years.
+
+    :param year: number of years integrated since pre-industrial, i.e. the index of the branch year
+    :param carbon_cycle: CarbonCycleState at the branch year
+    :param ch4_concs: change in |CH4| concentration in the branch year [ppb]
+    :param n2o_concs: change in |N2O| concentration in the branch year [ppb]
+    :param temperature_commitment: temperature change caused by the forcing before the branch year in the branch year and
+        the following num_years - 1 years [degC]
+    :param slr_commitment: sea level change caused by the temperature change before the branch year in the same years
+    :param parameters: dict of the parameters of the run, the keyword arguments of :func:`spin_up`
+    :param results: SCMResults of the years before the branch year
+    """
+
+    def __init__(self, year, carbon_cycle, ch4_concs, n2o_concs, temperature_commitment, slr_commitment, parameters,
+                 results=None):
+        self.year = year
+        self.carbon_cycle = carbon_cycle
+        self.ch4_concs = ch4_concs
+        self.n2o_concs = n2o_concs
+        self.temperature_commitment = temperature_commitment
+        self.slr_commitment = slr_commitment
+        self.parameters = parameters
+        self.results = results
+
+
+class SCMStepper:
+    """
+    This class runs the simple climate model one year at a time, e.g. to couple it to a model that decides the emissions of
+    the next year from the temperature change of this year:
+
+    >>> stepper = pySCM.SCMStepper(800, 75.0)
+    >>> for year in range(1750, 2101):
+    ...     results = stepper.step(co2, ch4, n2o, sox)
+    ...     co2 = policy(year, results.delta_temperature)
+
+    Each step has a constant cost: the carbon cycle and the temperature and sea level responses are advanced by one year
+    using the exponential modes of their response functions (see :func:`co2_emis_to_concs_modes` and
+    :func:`exponential_mode_filter`), and the earlier values that are still needed to truncate the response functions
+    after num_years years are kept in ring buffers. The results are those of :func:`run_scenarios` with method='modes'.
+
+    The emissions and parameters may be numpy.arrays to step a batch of scenarios or an ensemble; their shapes must not
+    change between steps.
+    """
+
+    def __init__(self, num_years, OceanMLDepth, climate_sensitivity=default_climate_sensitivity,
+                 air_sea_gas_exchange_coeff=default_air_sea_gas_exchange_coeff, biosphere_npp_0=default_biosphere_npp_0,
+                 co2_fert_factor=default_co2_fert_factor):
+        """
+        :param num_years: number of years the response functions are evaluated for
+        :param OceanMLDepth: ocean mixed layer depth [m]
+        :param climate_sensitivity: climate sensitivity, see :func:`calc_delta_surf_temp`.
+        :param air_sea_gas_exchange_coeff: air-sea gas exchange coefficient, see :func:`co2_emis_to_concs`.
+        :param biosphere_npp_0: pre-industrial net primary production of the biosphere, see :func:`co2_emis_to_concs`.
+        :param co2_fert_factor: |CO2| fertilisation factor, see :func:`co2_emis_to_concs`.
+        """
+        self.num_years = num_years
+        self.OceanMLDepth = OceanMLDepth
+        self.climate_sensitivity = climate_sensitivity
+        self.air_sea_gas_exchange_coeff = air_sea_gas_exchange_coeff
+        self.biosphere_npp_0 = biosphere_npp_0
+        self.co2_fert_factor = co2_fert_factor
+        # the year of the next step, counted from pre-industrial
+        self.year = 0
+
+        self._start_year = 0
+        self._carbon_cycle = _pre_industrial_carbon_cycle()
+        self._ch4_concs = 0.0
+        self._n2o_concs = 0.0
+        self._temperature_commitment = np.zeros(num_years)
+        self._slr_commitment = np.zeros(num_years)
+        self._modes = None
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        This function creates a stepper that continues a model run from an SCMState (see :func:`spin_up`), using the
+        parameters of the run that created the state.
+
+        :param state: SCMState -- the state at the branch year
+        :returns: SCMStepper
+        """
+        parameters = state.parameters
+        stepper = cls(parameters['num_years'], parameters['OceanMLDepth'], parameters['climate_sensitivity'],
+                      parameters['air_sea_gas_exchange_coeff'], parameters['biosphere_npp_0'],
+                      parameters['co2_fert_factor'])
+        stepper.year = stepper._start_year = state.year
+        stepper._carbon_cycle = state.carbon_cycle
+        stepper._ch4_concs = state.ch4_concs
+        stepper._n2o_concs = state.n2o_concs
+        stepper._temperature_commitment = state.temperature_commitment
+        stepper._slr_commitment = state.slr_commitment
+
+        return stepper
+
+    def step(self, co2_emis, ch4_emis, n2o_emis, sox_emis):
+        """
+        This function advances the model by one year.
+
+        :param co2_emis: |CO2| emissions of the year [PgC/year]
+        :param ch4_emis: |CH4| emissions of the year [TgCH4/year]
+        :param n2o_emis: |N2O| emissions of the year [TgN2O/year]
+        :param sox_emis: |SOx| emissions of the year [TgS/year]
+        :returns: SCMResults -- containing the concentrations, radiative forcing, temperature and sea level change of the
+            year (without a time axis)
+        """
+        co2_emis, ch4_emis, n2o_emis, sox_emis = [np.asarray(emissions, dtype=float)
+                                                  for emissions in (co2_emis, ch4_emis, n2o_emis, sox_emis)]
+        if self._modes is None:
+            self._initialise(np.broadcast_shapes(co2_emis.shape, ch4_emis.shape, n2o_emis.shape, sox_emis.shape))
+
+        year = self.year
+        # the response functions are truncated after num_years years of the stepper's own forcing, the effect of the
+        # years before the start is held by the commitments
+        own_year = year - self._start_year
+        slot = own_year % self.num_years
+        truncate = own_year >= self.num_years
+        co2_concs, ch4_concs, n2o_concs = self._atmos_co2, self._ch4_concs, self._n2o_concs
+        rf = calculate_rf(sox_emis, co2_concs, ch4_concs, n2o_concs)
+
+        self._temp_state = self._temp_decay * self._temp_state + rf
+        if truncate:
+            self._temp_state -= self._temp_decay_truncated * self._rf_hist[..., slot]
+        self._rf_hist[..., slot] = rf
+        delta_temperature = np.sum(self._temp_amplitudes * self._temp_state, axis=0) * self.climate_sensitivity
+        if own_year < self.num_years:
+            delta_temperature = delta_temperature + self._temperature_commitment[..., own_year]
+
+        self._slr_state = self._slr_decay * self._slr_state + delta_temperature
+        if truncate:
+            self._slr_state -= self._slr_decay_truncated * self._temperature_hist[..., slot]
+        self._temperature_hist[..., slot] = delta_temperature
+        slr = np.sum(self._slr_amplitudes * self._slr_state, axis=0)
+        if own_year < self.num_years:
+            slr = slr + self._slr_commitment[..., own_year]
+
+        # advance the concentrations to the next year
+        self._atmos_co2, self._ocean_state, self._bio_state = self._modes.step(
+            year, year % self._flux_hist.shape[-1], co2_concs, co2_emis, self._x_atmos_bio, self._ocean_state,
+            self._bio_state, self._flux_hist, self._x_atmos_bio_hist)
+        self._ch4_concs = ch4_concs * self._ch4_decay + ch4_emis * self._ch4_accum
+        self._n2o_concs = n2o_concs * self._n2o_decay + n2o_emis * self._n2o_accum
+        self.year += 1
+
+        return SCMResults(co2_concs, ch4_concs, n2o_concs, rf, delta_temperature, slr)
+
+    def _initialise(self, emissions_shape):
+        """
+        This private function allocates the states and ring buffers once the shape of the emissions is known.
+        """
+        carbon_cycle = self._carbon_cycle
+        batch_shape = np.broadcast_shapes(emissions_shape, np.shape(self.OceanMLDepth),
+                                          np.shape(self.air_sea_gas_exchange_coeff), np.shape(self.biosphere_npp_0),
+                                          np.shape(self.co2_fert_factor), np.shape(self.climate_sensitivity),
+                                          np.shape(carbon_cycle.x_atmos_bio), np.shape(self._ch4_concs),
+                                          np.shape(self._temperature_commitment)[:-1])
+        self._modes = _CarbonCycleModes(self.num_years, self.OceanMLDepth, self.air_sea_gas_exchange_coeff,
+                                        self.biosphere_npp_0, self.co2_fert_factor, base_CO2, len(batch_shape))
+
+        self._atmos_co2 = np.array(np.broadcast_to(carbon_cycle.atmos_co2, batch_shape))
+        self._x_atmos_bio = np.array(np.broadcast_to(carbon_cycle.x_atmos_bio, batch_shape))
+        self._ocean_state = _broadcast_modes(carbon_cycle.ocean_state, batch_shape)
+        self._bio_state = _broadcast_modes(carbon_cycle.bio_state, batch_shape)
+        # the fluxes of year y are kept at index y % size of the ring buffers
+        size = max(self.num_years, 2)
+        history = carbon_cycle.atmos_sea_flux.shape[-1]
+        slots = np.arange(carbon_cycle.year - history, carbon_cycle.year) % size
+        self._flux_hist = np.zeros(batch_shape + (size,))
+        self._flux_hist[..., slots] = carbon_cycle.atmos_sea_flux
+        self._x_atmos_bio_hist = np.zeros(batch_shape + (size,))
+        self._x_atmos_bio_hist[..., slots] = carbon_cycle.x_atmos_bio_hist
+
+        self._ch4_concs = np.array(np.broadcast_to(self._ch4_concs, batch_shape))
+        self._n2o_concs = np.array(np.broadcast_to(self._n2o_concs, batch_shape))
+        self._ch4_decay, self._ch4_accum = _decay_coefficients(*decay_species['CH4'])
+        self._n2o_decay, self._n2o_accum = _decay_coefficients(*decay_species['N2O'])
+
+        # the temperature and sea level responses are advanced like in exponential_mode_filter
+        self.climate_sensitivity = np.asarray(self.climate_sensitivity, dtype=float)
+        self._temp_amplitudes, self._temp_decay = _exponential_modes(temp_response_modes, len(batch_shape))
+        self._temp_decay_truncated = self._temp_decay ** self.num_years
+        self._temp_state = np.zeros(self._temp_decay.shape[:1] + batch_shape)
+        self._slr_amplitudes, self._slr_decay = _exponential_modes(slr_response_modes, len(batch_shape))
+        self._slr_decay_truncated = self._slr_decay ** self.num_years
+        self._slr_state = np.zeros(self._slr_decay.shape[:1] + batch_shape)
+        self._rf_hist = np.zeros(batch_shape + (self.num_years,))
+        self._temperature_hist = np.zeros(batch_shape + (self.num_years,))
+
+
 # -------------------------------------------------------------------------------
 # Simple Climate Model Class
 # -------------------------------------------------------------------------------
@@ -75,21 +497,85 @@ class SimpleClimateModel:
     .. note::
         The file containing the emissions should be in a certain format.
         Please refer to the example file (*EmissionsForSCM.dat*) for details.
+
+    Alternatively, the model can be created without any files from a mapping of parameters and the emissions (see
+    from_parameters).
     """
 
+    # parameters which from_parameters uses if they are not given, the values are those of the example parameter file
+    default_parameters = {
+        'Ocean mixed layer depth [in meters]': 75.0,
+        'Years to evaluate response functions': 800,
+    }
+
     def __init__(self, filename):
         """
         This is the constructor of the class. By calling the constructor, the emissions will be read from file 
-        (filling the EmissionRec) and the parameters will be read from the parameter file.
+        (filling an EmissionSeries) and the parameters will be read from the parameter file.
         :param filename: path and filename of the parameter file.
         """
         self._read_parameters(filename)
+        self._set_up(None)
+
+    @classmethod
+    def from_parameters(cls, parameters, emissions=None):
+        """
+        This function creates the Simple Climate Model class from a mapping of parameters instead of a parameter file, e.g.
+
+        >>> SCM = pySCM.SimpleClimateModel.from_parameters({'Start year': 1750, 'End year': 2100}, emissions)
+        >>> results = SCM.run_model(in_memory=True)
+
+        The keys are the same as in the parameter file and the values can be strings or numbers. The ocean mixed layer depth
+        and the number of years to evaluate the response functions for default to the values of the example parameter file.
+        If no emissions are given, they are read from the 'File of emissions data'.
+
+        The emissions can be an EmissionSeries, a mapping of the species ('CO2', 'CH4', 'N2O' and 'SOx') to arrays or a
+        single array with one row per species in that order. Arrays can be any object supporting the buffer protocol; they
+        are not copied if they are contiguous and of type float64.
+
+        :param parameters: mapping of the parameters.
+        :param emissions: emissions for each year from the start year to the end year (optional).
+        :returns: SimpleClimateModel
+        """
+        scm = cls.__new__(cls)
+        scm._parameters = dict(cls.default_parameters)
+        scm._parameters.update(parameters)
+        scm._set_up(emissions)
+
+        return scm
+
+    def _set_up(self, emissions):
+        """
+        This private function sets the start and end year of the simulation and the emissions (which are read from file if
+        they are not given).
+        """
         # get start and end year of simulation
         self.start_year = int(self._get_parameter('Start year'))
         self.end_year = int(self._get_parameter('End year'))
-        self.emissions = self._read_emissions(self._get_parameter('File of emissions data'))
+        # the cache is kept with the model, so that repeated runs also share the entries kept in memory
+        self.result_cache = self._result_cache()
+        # the stages of the model, see run_model. Like the batched functions, the carbon cycle uses the O(n) modes rather than
+        # the O(n^2) convolution, which they match to rounding errors
+        self.graph = SCMGraph(None, None, co2_method='modes')
+
+        if emissions is None:
+            self.emissions = self._read_emissions(self._get_parameter('File of emissions data'))
+            return
+
+        if isinstance(emissions, EmissionSeries):
+            arrays = [getattr(emissions, name) for name in EmissionSeries.species]
+        elif hasattr(emissions, 'keys'):
+            arrays = [emissions[name] for name in EmissionSeries.species]
+        else:
+            arrays = np.asarray(emissions, dtype=float)
+            if len(arrays) != len(EmissionSeries.species):
+                raise SCMError('The emissions need one row for each of {}'.format(', '.join(EmissionSeries.species)))
+        self.emissions = EmissionSeries(*arrays, start_year=self.start_year)
+
+        if len(self.emissions) != self.end_year - self.start_year + 1:
+            raise SCMError('The emissions must be given for every year from {} to {}'.format(self.start_year, self.end_year))
 
-    def run_model(self, rf_flag=False):
+    def run_model(self, rf_flag=False, in_memory=False, cache=None):
         """ 
         This function runs the simple climate model. A number of private functions will be called but also a number of
         'independent' functions (detailed below). The model takes the atmosheric GHG emissions as input, converts them
@@ -104,19 +590,48 @@ class SimpleClimateModel:
         By default, the calculated temperature change and sea level change will be written to a textfile where the location and name
         of the textfile need to be specified in the parameter file. If the user wants to, a figure showing the temperature change and 
         sea level change, respectively, will be saved to file and again the path and filename have to be specified in the parameter file.   
+
+        In memory mode, nothing is written to file (and the output filenames do not need to be given in the parameter file). Instead
+        the results are returned:
+
+        >>> results = SCM.run_model(in_memory=True)
+        >>> results.delta_temperature
+
+        The output files can still be written afterwards by calling save_temp_and_slr and save_output.
+
+        Repeated runs only evaluate the stages of the model whose emissions or parameters changed (see :class:`SCMGraph`),
+        e.g. after changing the |SOx| emissions the concentrations are not calculated again. If a result cache is given (or a
+        result cache directory in the parameter file), runs with the same emissions and parameters as an earlier run are not
+        evaluated again but their results are taken from the cache, see :class:`pySCM.cache.ResultCache`.
         
         :param: rf_flag (bool) which is set to 'False' by default. If it is set to 'True' the function returns the calculated radiative forcing.
-        :returns: This function returns the radiative forcing (numpy.array) if the flag was set to true. Otherwise, nothing will be returned.
+        :param: in_memory (bool) which is set to 'False' by default. If it is set to 'True' no files are written and the results are returned.
+        :param: cache (pySCM.cache.ResultCache) which is optional. By default the cache given in the parameter file is used (if any).
+        :returns: This function returns a SCMResults in memory mode, otherwise the radiative forcing (numpy.array) if the flag was set
+            to true. Otherwise, nothing will be returned.
         """
         sim_years = int(self._get_parameter('Years to evaluate response functions'))
         ocean_ml_depth = float(self._get_parameter('Ocean mixed layer depth [in meters]'))
-        self.co2_concs = co2_emis_to_concs(self.emissions, sim_years, ocean_ml_depth)
-        self.ch4_concs = ch4_emis_to_concs(self.emissions)
-        self.n2o_concs = n2o_emis_to_concs(self.emissions)
-        self.rf = calculate_rf(self.emissions, self.co2_concs, self.ch4_concs, self.n2o_concs)
 
-        self.delta_temperature = calc_delta_surf_temp(sim_years, self.rf)
-        self.slr = calculate_slr(sim_years, self.delta_temperature)
+        def run():
+            # only the stages whose emissions or parameters changed since the last run are evaluated
+            return self.graph.run(self.emissions.CO2, self.emissions.CH4, self.emissions.N2O, self.emissions.SOx,
+                                  num_years=sim_years, OceanMLDepth=ocean_ml_depth)
+
+        if cache is None:
+            cache = self.result_cache
+        if cache is None:
+            results = run()
+        else:
+            results = _cached_run(cache, ('SimpleClimateModel.run_model', self.emissions.CO2, self.emissions.CH4,
+                                          self.emissions.N2O, self.emissions.SOx, sim_years, ocean_ml_depth), run)
+        # the graph and the cache keep their (read-only) arrays, the model gets writable copies
+        for name in _result_names:
+            setattr(self, name, np.array(getattr(results, name)))
+
+        if in_memory:
+            return SCMResults(self.co2_concs, self.ch4_concs, self.n2o_concs, self.rf, self.delta_temperature, self.slr,
+                              self.start_year)
 
         self._save_temp_and_slr()
 
@@ -193,58 +708,46 @@ class SimpleClimateModel:
 
         return result
 
+    def _result_cache(self):
+        """
+        This private function returns the result cache given in the parameter file or None if no cache directory is given.
+        """
+        cache_dir = self._get_parameter('Result cache directory')
+        if not cache_dir:
+            return None
+
+        from .cache import ResultCache
+
+        cache_size = self._get_parameter('Result cache size [in MB]')
+        if cache_size:
+            return ResultCache(directory=cache_dir, max_disk_bytes=int(float(cache_size) * 1024 ** 2))
+        return ResultCache(directory=cache_dir)
+
     def _read_emissions(self, emis_fname):
         """
         |CO2|, |CH4|, |N2O| and |SOx| emissions will be read from file. The input file (Filename) has to be in a certain format.
         Please refer to the example file: EmissionsForSCM.dat. If there are missing values, this function will interpolate the
         values so that the emissions are available for the whole time period from startYr to endYr of the simulation.
         
+        If a cache directory is given in the parameter file, the interpolated emissions are cached in binary form so that
+        the emissions file only needs to be parsed once (see :func:`read_emissions`).
+
         :param emis_fname: path and filename of the emissions file.
         :type: string
-        :returns: nothing
+        :returns: EmissionSeries
         """
+        cache = None
+        cache_dir = self._get_parameter('Emissions cache directory')
+        if cache_dir:
+            from .cache import DiskCache
 
-        # create empty list
-        returnval = []
-        # Set the length of the list. The length depends on the number of years.
-        for i in range(self.end_year - self.start_year + 1):
-            returnval.append(EmissionRec())
-
-        # read data
-        table = np.loadtxt(emis_fname, skiprows=3)
-
-        for col in range(1, table.shape[1]):
-            data = np.zeros((len(returnval)))
-            data.fill(float('NaN'))
-            for row in range(len(table)):
-                index = int(table[row][0] - self.start_year)
-                data[index] = table[row][col]
+            cache_size = self._get_parameter('Emissions cache size [in MB]')
+            if cache_size:
+                cache = DiskCache(cache_dir, int(float(cache_size) * 1024 ** 2))
+            else:
+                cache = DiskCache(cache_dir)
 
-            # now you should have all data for one species
-            # interpolate missing values
-            x = np.arange(0, len(returnval))
-
-            xp_hold = np.where(~np.isnan(data))[0]
-            xp = np.zeros(len(xp_hold) + 1)
-            xp[1:len(xp)] = xp_hold[0:len(xp_hold)]
-
-            fp_hold = data[np.where(~np.isnan(data))[0]]
-            fp = np.zeros(len(fp_hold) + 1)
-            fp[1:len(fp)] = fp_hold[0:len(fp_hold)]
-
-            interpolVal = np.interp(x, xp, fp)
-
-            for index in range(len(interpolVal)):
-                if col == 1:
-                    returnval[index].CO2 = interpolVal[index]
-                elif col == 2:
-                    returnval[index].CH4 = interpolVal[index]
-                elif col == 3:
-                    returnval[index].N2O = interpolVal[index]
-                elif col == 4:
-                    returnval[index].SOx = interpolVal[index]
-
-        return returnval
+        return read_emissions(emis_fname, self.start_year, self.end_year, cache)
 
     # ---------------------------------------------------------
     # write and plot GHG concentrations to file (if required)
@@ -294,6 +797,9 @@ class SimpleClimateModel:
         else:
             raise SCMError('{} is not a valid species'.format(species))
 
+        # matplotlib is only imported when plotting as it is slow to import
+        import matplotlib.pyplot as plt
+
         fig = plt.figure(1)
         plt.plot(x, concs2plot)
         # title and axes labels
@@ -307,6 +813,15 @@ class SimpleClimateModel:
         plt.savefig(output_filename)
         plt.clf()
 
+    def save_temp_and_slr(self):
+        """
+        This function saves the calculated temperature change and sea level change to file (and the figures if required), see
+        run_model. It only needs to be called after running the model in memory mode:
+
+        >>> SCM.save_temp_and_slr()
+        """
+        self._save_temp_and_slr()
+
     def _save_temp_and_slr(self):
         """
         This private function saves the calculated temperature change and resulting sea level change to file. The path and filenames
@@ -328,6 +843,8 @@ class SimpleClimateModel:
             # Plot temperature change and save figure to file if required
             plot_file = self._get_parameter('Plot temperature change')
             if plot_file:
+                import matplotlib.pyplot as plt
+
                 x = np.arange(self.start_year, self.end_year + 1)
                 fig = plt.figure(1)
                 plt.plot(x, self.delta_temperature)
@@ -356,6 +873,8 @@ class SimpleClimateModel:
             # Plot temperature change and save figure to file if required
             plot_file = self._get_parameter('Plot sea level change')
             if plot_file:
+                import matplotlib.pyplot as plt
+
                 x = np.arange(self.start_year, self.end_year + 1)
                 fig = plt.figure(1)
                 plt.plot(x, self.slr)
@@ -378,33 +897,553 @@ class SimpleClimateModel:
 # -----------------------------------------------------------------------------
 
 
+def read_emissions(emis_fname, start_year, end_year, cache=None):
+    """
+    This function reads |CO2|, |CH4|, |N2O| and |SOx| emissions from file. The file has to be in the format of the example
+    file EmissionsForSCM.dat, i.e. three header lines followed by one row per year with the columns year, |CO2|, |CH4|, |N2O|
+    and |SOx|. The emissions of years that are not in the file are linearly interpolated. If the file does not contain the
+    start year, the emissions are interpolated from zero emissions in the start year to the first year in the file and a
+    warning is issued. Rows outside of start_year to end_year are ignored.
+
+    If a cache (see :class:`pySCM.cache.DiskCache`) is given, the interpolated emissions are stored in it and later calls for
+    the same (unchanged) file, start year and end year load them from the cache instead of parsing the file.
+
+    :param emis_fname: path and filename of the emissions file.
+    :param start_year: first year of the simulation.
+    :param end_year: last year of the simulation.
+    :param cache: DiskCache to store the interpolated emissions in (optional).
+    :returns: EmissionSeries
+    """
+    if cache is not None:
+        key = cache.file_key(emis_fname, 'emissions', start_year, end_year)
+        columns = cache.load(key)
+        if columns is not None:
+            return EmissionSeries(*columns, start_year=start_year)
+
+    table = np.loadtxt(emis_fname, skiprows=3, ndmin=2)
+    emissions = _interpolate_emissions(table, start_year, end_year, emis_fname)
+
+    if cache is not None:
+        cache.save(key, np.array([getattr(emissions, name) for name in EmissionSeries.species]))
+
+    return emissions
+
+
+def read_emissions_batch(emis_fnames, start_year, end_year, cache=None):
+    """
+    This function reads many emissions files (see :func:`read_emissions`) into one EmissionSeries holding one scenario per
+    file, i.e. its arrays have the shape (len(emis_fnames), end_year - start_year + 1). The result can be passed directly to
+    the model functions or its arrays to :func:`run_scenarios`.
+
+    :param emis_fnames: list of paths and filenames of the emissions files.
+    :param start_year: first year of the simulation.
+    :param end_year: last year of the simulation.
+    :param cache: DiskCache to store the interpolated emissions in (optional), see :func:`read_emissions`.
+    :returns: EmissionSeries
+    """
+    num_years = end_year - start_year + 1
+    scenarios = [read_emissions(emis_fname, start_year, end_year, cache) for emis_fname in emis_fnames]
+    return EmissionSeries(*[np.reshape([getattr(scenario, name) for scenario in scenarios], (-1, num_years))
+                            for name in EmissionSeries.species], start_year=start_year)
+
+
+def _interpolate_emissions(table, start_year, end_year, source='the emissions table'):
+    """
+    This private function scatters the rows of an emissions table (year, |CO2|, |CH4|, |N2O|, |SOx|) onto the years of the
+    simulation and interpolates the missing years, see :func:`read_emissions`. source names the table in errors and
+    warnings.
+    """
+    missing = EmissionSeries.species[max(table.shape[1] - 1, 0):]
+    if missing:
+        raise SCMError('{} has no {} column{}'.format(source, ', '.join(missing), 's' if len(missing) > 1 else ''))
+    num_years = end_year - start_year + 1
+    index = table[:, 0].astype(int) - start_year
+    in_range = (index >= 0) & (index < num_years)
+
+    data = np.full((num_years, table.shape[1] - 1), np.nan)
+    data[index[in_range]] = table[in_range, 1:]
+
+    x = np.arange(num_years)
+    columns = []
+    anchored = []
+    # the columns are CO2, CH4, N2O and SOx
+    for name, values in zip(EmissionSeries.species, data.T):
+        known = ~np.isnan(values)
+        xp = x[known]
+        fp = values[known]
+        if not known[0]:
+            # anchor the interpolation to zero emissions in the start year
+            xp = np.concatenate(([0], xp))
+            fp = np.concatenate(([0.0], fp))
+            anchored.append(name)
+        columns.append(np.interp(x, xp, fp))
+    if anchored:
+        warnings.warn('{} has no {} emissions for the start year {}, they are interpolated from zero emissions in that '
+                      'year'.format(source, ', '.join(anchored), start_year))
+
+    return EmissionSeries(*columns, start_year=start_year)
+
+
+def run_scenarios(co2_emis, ch4_emis, n2o_emis, sox_emis, num_years, OceanMLDepth, co2_method='modes', method='auto',
+                  climate_sensitivity=default_climate_sensitivity,
+                  air_sea_gas_exchange_coeff=default_air_sea_gas_exchange_coeff,
+                  biosphere_npp_0=default_biosphere_npp_0, co2_fert_factor=default_co2_fert_factor, cache=None):
+    """
+    This function runs the simple climate model for a whole batch of emission scenarios at once. Instead of looping over the
+    scenarios in Python, every stage of the model (:func:`co2_emis_to_concs`, :func:`ch4_emis_to_concs`,
+    :func:`n2o_emis_to_concs`, :func:`calculate_rf`, :func:`calc_delta_surf_temp` and :func:`calculate_slr`) operates on
+    arrays of shape (n_scenarios, n_years):
+
+    >>> results = pySCM.run_scenarios(co2, ch4, n2o, sox, 800, 75.0)
+    >>> results.delta_temperature[:, -1]
+
+    OceanMLDepth, climate_sensitivity and the carbon cycle parameters may also be numpy.arrays to evaluate a parameter
+    ensemble. They are broadcast against the scenario axis, e.g. parameters of shape (n_members, 1) together with emissions of
+    shape (n_scenarios, n_years) give results of shape (n_members, n_scenarios, n_years).
+
+    :param co2_emis: numpy.array -- |CO2| emissions [PgC/year] with shape (n_scenarios, n_years)
+    :param ch4_emis: numpy.array -- |CH4| emissions [TgCH4/year] with shape (n_scenarios, n_years)
+    :param n2o_emis: numpy.array -- |N2O| emissions [TgN2O/year] with shape (n_scenarios, n_years)
+    :param sox_emis: numpy.array -- |SOx| emissions [TgS/year] with shape (n_scenarios, n_years)
+    :param num_years: number of years the response functions are evaluated for
+    :param OceanMLDepth: ocean mixed layer depth [m]
+    :param co2_method: carbon cycle method, see :func:`co2_emis_to_concs`. Defaults to 'modes' which is O(n) per scenario.
+    :param method: method for the temperature and sea level responses, see :func:`calc_delta_surf_temp`.
+    :param climate_sensitivity: climate sensitivity, see :func:`calc_delta_surf_temp`.
+    :param air_sea_gas_exchange_coeff: air-sea gas exchange coefficient, see :func:`co2_emis_to_concs`.
+    :param biosphere_npp_0: pre-industrial net primary production of the biosphere, see :func:`co2_emis_to_concs`.
+    :param co2_fert_factor: |CO2| fertilisation factor, see :func:`co2_emis_to_concs`.
+    :param cache: pySCM.cache.ResultCache (optional) -- if given, the results of runs with the same emissions and
+        parameters are only evaluated once. The arrays of cached results are read-only.
+    :returns: SCMResults -- containing arrays of shape (n_scenarios, n_years)
+    """
+    if cache is not None:
+        emissions = [np.asarray(emis, dtype=float) for emis in (co2_emis, ch4_emis, n2o_emis, sox_emis)]
+        return _cached_run(cache, ('run_scenarios', emissions, num_years, OceanMLDepth, co2_method, method,
+                                   climate_sensitivity, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor),
+                           lambda: run_scenarios(*emissions, num_years, OceanMLDepth, co2_method, method,
+                                                 climate_sensitivity, air_sea_gas_exchange_coeff, biosphere_npp_0,
+                                                 co2_fert_factor))
+
+    co2_concs = co2_emis_to_concs(np.asarray(co2_emis, dtype=float), num_years, OceanMLDepth, co2_method,
+                                  air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor)
+    concs = species_emis_to_concs({'CH4': ch4_emis, 'N2O': n2o_emis})
+    ch4_concs, n2o_concs = concs['CH4'], concs['N2O']
+    rf = calculate_rf(np.asarray(sox_emis, dtype=float), co2_concs, ch4_concs, n2o_concs)
+    delta_temperature = calc_delta_surf_temp(num_years, rf, method, climate_sensitivity)
+    slr = calculate_slr(num_years, delta_temperature, method)
+
+    return SCMResults(co2_concs, ch4_concs, n2o_concs, rf, delta_temperature, slr)
+
+
+def _cached_run(cache, inputs, run):
+    """
+    This private function returns the results of a model run from cache if it holds the results of a run with the same
+    inputs. Otherwise the run is evaluated by calling run() and its results are stored in the cache. The inputs are hashed
+    together with the source code of pySCM (see :func:`_source_key`) so that results of other versions of the model are
+    not reused.
+    """
+    from .cache import content_key
+
+    key = content_key(_source_key(), inputs)
+    arrays = cache.get(key, _result_names)
+    if arrays is not None:
+        return SCMResults(**arrays)
+
+    results = run()
+    cache.put(key, {name: getattr(results, name) for name in _result_names})
+    return results
+
+
+def _source_key():
+    """
+    This private function returns a hash of the source files of pySCM. Unlike the version, it changes with every change of
+    the code, also in a development checkout or an editable install, and determining it does not need git. It is only
+    computed once per process.
+    """
+    global _source_digest
+    if _source_digest is None:
+        from .cache import content_key
+
+        directory = os.path.dirname(os.path.abspath(__file__))
+        sources = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.py'):
+                with open(os.path.join(directory, name), 'rb') as reader:
+                    sources.append((name, reader.read().decode('utf-8')))
+        _source_digest = content_key(sources)
+
+    return _source_digest
+
+
+def run_concentrations(co2_concs, ch4_concs, n2o_concs, sox_emis, num_years, method='auto',
+                       climate_sensitivity=default_climate_sensitivity):
+    """
+    This function runs the simple climate model driven by concentrations instead of emissions, i.e. the given |CO2|, |CH4|
+    and |N2O| concentrations are used directly in :func:`calculate_rf` and the emissions-to-concentrations stages are
+    skipped:
+
+    >>> results = pySCM.run_concentrations(co2_concs, ch4_concs, n2o_concs, sox, 800)
+
+    Like the results of the model, the concentrations are changes relative to the pre-industrial concentrations base_CO2,
+    base_CH4 and base_N20. Time is the last axis; any leading axes hold different scenarios, and climate_sensitivity may be
+    a numpy.array which is broadcast against them, see :func:`run_scenarios`. Emissions which give the same concentrations
+    in the emission-driven model are returned by :func:`diagnose_emissions`.
+
+    :param co2_concs: numpy.array -- changes of the |CO2| concentrations [ppm]
+    :param ch4_concs: numpy.array -- changes of the |CH4| concentrations [ppb]
+    :param n2o_concs: numpy.array -- changes of the |N2O| concentrations [ppb]
+    :param sox_emis: numpy.array -- |SOx| emissions [TgS/year]
+    :param num_years: number of years the response functions are evaluated for
+    :param method: method for the temperature and sea level responses, see :func:`calc_delta_surf_temp`.
+    :param climate_sensitivity: climate sensitivity, see :func:`calc_delta_surf_temp`.
+    :returns: SCMResults -- containing the given concentrations and the results computed from them
+    """
+    concs = [np.asarray(concs, dtype=float) for concs in (co2_concs, ch4_concs, n2o_concs)]
+    rf = calculate_rf(np.asarray(sox_emis, dtype=float), *concs)
+    delta_temperature = calc_delta_surf_temp(num_years, rf, method, climate_sensitivity)
+    slr = calculate_slr(num_years, delta_temperature, method)
+
+    return SCMResults(*concs, rf, delta_temperature, slr)
+
+
+def diagnose_emissions(co2_concs, ch4_concs, n2o_concs, num_years, OceanMLDepth, sox_emis=0.0,
+                       air_sea_gas_exchange_coeff=default_air_sea_gas_exchange_coeff,
+                       biosphere_npp_0=default_biosphere_npp_0, co2_fert_factor=default_co2_fert_factor):
+    """
+    This function is the inverse of the emissions-to-concentrations stages: it returns the emissions for which
+    :func:`run_scenarios` (with co2_method='modes') gives the given changes of the |CO2|, |CH4| and |N2O| concentrations:
+
+    >>> emissions = pySCM.diagnose_emissions(co2_concs, ch4_concs, n2o_concs, 800, 75.0)
+    >>> emissions.CO2
+
+    The concentrations of a year only depend on the emissions of the years before, so the emissions of each year follow
+    from the concentrations of the next year in a single pass over the years: for |CH4| and |N2O| by inverting the first
+    order recurrence of :func:`linear_decay_emis_to_concs`, for |CO2| by running the carbon cycle of
+    :func:`co2_emis_to_concs_modes` along the given concentrations and closing its mass balance. The model starts from
+    pre-industrial concentrations, so the concentrations of the first year are not used. The emissions of the last year do
+    not affect the concentrations of the run; those of the year before are repeated.
+
+    The concentrations may hold a batch of scenarios and the carbon cycle parameters may be numpy.arrays, see
+    :func:`run_scenarios`.
+
+    :param co2_concs: numpy.array -- changes of the |CO2| concentrations [ppm]
+    :param ch4_concs: numpy.array -- changes of the |CH4| concentrations [ppb]
+    :param n2o_concs: numpy.array -- changes of the |N2O| concentrations [ppb]
+    :param num_years: number of years the response functions are evaluated for
+    :param OceanMLDepth: ocean mixed layer depth [m]
+    :param sox_emis: |SOx| emissions [TgS/year] which are added to the EmissionSeries (default 0)
+    :param air_sea_gas_exchange_coeff: air-sea gas exchange coefficient, see :func:`co2_emis_to_concs`.
+    :param biosphere_npp_0: pre-industrial net primary production of the biosphere, see :func:`co2_emis_to_concs`.
+    :param co2_fert_factor: |CO2| fertilisation factor, see :func:`co2_emis_to_concs`.
+    :returns: EmissionSeries -- the emissions of all species, broadcast to a common shape
+    """
+    co2_concs = np.asarray(co2_concs, dtype=float)
+    n = co2_concs.shape[-1]
+    if n < 2:
+        raise SCMError('at least two years of concentrations are needed to diagnose emissions')
+
+    batch_shape = _batch_shape(co2_concs, OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor)
+    modes = _CarbonCycleModes(num_years, OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor,
+                              base_CO2, len(batch_shape))
+    ocean_state = np.zeros((len(ocean_response_modes),) + batch_shape)
+    bio_state = np.zeros((len(biosphere_response_modes),) + batch_shape)
+    x_atmos_bio = np.zeros(batch_shape)
+    atmos_sea_flux = np.zeros(batch_shape + (n,))
+    x_atmos_bio_hist = np.zeros(batch_shape + (n,))
+    atmos_co2 = np.broadcast_to(co2_concs, batch_shape + (n,))
+    atmos_co2 = np.concatenate([np.zeros(batch_shape + (1,)), atmos_co2[..., 1:]], axis=-1)
+
+    co2_emis = np.zeros(batch_shape + (n,))
+    for ind in range(n - 1):
+        # the concentration of the next year without emissions, the emissions make up the difference
+        next_atmos_co2, ocean_state, bio_state = modes.step(ind, ind, atmos_co2[..., ind], 0.0, x_atmos_bio, ocean_state,
+                                                            bio_state, atmos_sea_flux, x_atmos_bio_hist)
+        co2_emis[..., ind] = (atmos_co2[..., ind + 1] - next_atmos_co2) * PgCperppm
+    co2_emis[..., -1] = co2_emis[..., -2]
+
+    emissions = {'CO2': co2_emis}
+    for name, concs in (('CH4', ch4_concs), ('N2O', n2o_concs)):
+        concs = np.asarray(concs, dtype=float)
+        decay, accum = _decay_coefficients(*decay_species[name])
+        emis = np.zeros(concs.shape)
+        emis[..., 1:-1] = (concs[..., 2:] - concs[..., 1:-1] * decay) / accum
+        emis[..., 0] = concs[..., 1] / accum
+        emis[..., -1] = emis[..., -2]
+        emissions[name] = emis
+    emissions['SOx'] = np.asarray(sox_emis, dtype=float)
+
+    shape = np.broadcast_shapes(*[array.shape for array in emissions.values()])
+    return EmissionSeries(*[np.broadcast_to(emissions[name], shape) for name in EmissionSeries.species])
+
+
+def run_scenario_tree(co2_emis, ch4_emis, n2o_emis, sox_emis, num_years, OceanMLDepth, method='auto',
+                      climate_sensitivity=default_climate_sensitivity,
+                      air_sea_gas_exchange_coeff=default_air_sea_gas_exchange_coeff,
+                      biosphere_npp_0=default_biosphere_npp_0, co2_fert_factor=default_co2_fert_factor):
+    """
+    This function runs a batch of emission scenarios like :func:`run_scenarios` (with co2_method='modes') but integrates
+    the emissions that scenarios have in common only once. Scenarios which are identical up to some year, e.g. variants of
+    a policy that start in different years, form a tree of shared segments (a trie over the years). The carbon cycle and
+    the |CH4| and |N2O| concentrations, which depend on the whole history of the emissions, are integrated for one
+    representative of each branch of the tree at a time and their state is copied to the branches when they diverge. The
+    radiative forcing, temperature and sea level change are then evaluated for all scenarios at once.
+
+    The arguments are the same as for :func:`run_scenarios`. Parameter arrays may hold an ensemble (e.g. shape
+    (n_members, 1)) but must not vary along the scenario axis.
+
+    :returns: SCMResults -- containing arrays of the same shapes as those of :func:`run_scenarios`
+    """
+    for parameter in (OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor):
+        if np.ndim(parameter) and np.shape(parameter)[-1] != 1:
+            raise SCMError('the carbon cycle parameters must not vary along the scenario axis')
+    co2_emis, ch4_emis, n2o_emis = np.broadcast_arrays(*[np.atleast_2d(np.asarray(emissions, dtype=float))
+                                                         for emissions in (co2_emis, ch4_emis, n2o_emis)])
+    if co2_emis.ndim != 2:
+        raise SCMError('the emissions need to have the shape (n_scenarios, n_years)')
+
+    def run_carbon_cycle(state, emissions):
+        co2_concs, state = co2_emis_to_concs_modes(emissions[..., 0], num_years, OceanMLDepth, air_sea_gas_exchange_coeff,
+                                                   biosphere_npp_0, co2_fert_factor, base_CO2, state, return_state=True)
+        if co2_emis.shape[-1] <= num_years:
+            # the response functions are not truncated within the run, so only the fluxes of the last two years are needed
+            state.atmos_sea_flux = state.atmos_sea_flux[..., -2:]
+            state.x_atmos_bio_hist = state.x_atmos_bio_hist[..., -2:]
+        return co2_concs, state
+
+    def run_species(state, emissions):
+        # one more year gives the concentrations in the first year of the next segment
+        concs = species_emis_to_concs({'CH4': _extend(emissions[..., 0], 1), 'N2O': _extend(emissions[..., 1], 1)},
+                                      initial=state)
+        result = np.stack([concs['CH4'][..., :-1], concs['N2O'][..., :-1]])
+        return result, {name: concs[name][..., -1] for name in concs}
+
+    def take_species(state, indices):
+        return {name: np.take(concs, indices, axis=-1) for name, concs in state.items()}
+
+    co2_concs = _run_prefix_tree(co2_emis[..., np.newaxis], run_carbon_cycle, CarbonCycleState.take)
+    ch4_concs, n2o_concs = _run_prefix_tree(np.stack([ch4_emis, n2o_emis], axis=-1), run_species, take_species)
+    rf = calculate_rf(np.asarray(sox_emis, dtype=float), co2_concs, ch4_concs, n2o_concs)
+    delta_temperature = calc_delta_surf_temp(num_years, rf, method, climate_sensitivity)
+    slr = calculate_slr(num_years, delta_temperature, method)
+
+    return SCMResults(co2_concs, ch4_concs, n2o_concs, rf, delta_temperature, slr)
+
+
+def _run_prefix_tree(emissions, run_segment, take):
+    """
+    This private function integrates a batch of emission pathways of shape (n_scenarios, n_years, n_species) segment by
+    segment. Sorting the pathways lexicographically, the trie of their common prefixes is given by the number of leading
+    years that neighbouring pathways have in common. The years in which any pathway diverges split the run into segments;
+    within a segment the partition of the scenarios into branches does not change and run_segment(state, emissions)
+    integrates one representative per branch, starting from the state of its parent branch which is
+    selected with take(state, indices). The results of run_segment have the branches as second to last axis and are
+    copied to all scenarios of each branch.
+    """
+    num_scenarios, n = emissions.shape[:2]
+    order = np.lexsort(emissions.reshape(num_scenarios, -1).T[::-1])
+    ordered = emissions[order]
+    differs = np.any(ordered[1:] != ordered[:-1], axis=-1)
+    # number of leading years that neighbouring pathways have in common
+    common = np.where(differs.any(axis=-1), differs.argmax(axis=-1), n)
+    starts = [0] + [int(year) for year in np.unique(common[common < n]) if year > 0] + [n]
+
+    result = None
+    state = None
+    branches = None
+    for start, end in zip(starts[:-1], starts[1:]):
+        # neighbours are in different branches if they differ in any year up to the start of the segment
+        parent_branches = branches
+        branches = np.concatenate([[0], np.cumsum(common <= start)])
+        first = np.flatnonzero(np.diff(branches, prepend=-1))
+        if parent_branches is not None:
+            state = take(state, parent_branches[first])
+        segment, state = run_segment(state, ordered[first, start:end])
+
+        if result is None:
+            result = np.empty(segment.shape[:-2] + (num_scenarios, n))
+        result[..., order, start:end] = np.take(segment, branches, axis=-2)
+
+    return result
+
+
+def spin_up(co2_emis, ch4_emis, n2o_emis, sox_emis, num_years, OceanMLDepth, method='auto',
+            climate_sensitivity=default_climate_sensitivity,
+            air_sea_gas_exchange_coeff=default_air_sea_gas_exchange_coeff, biosphere_npp_0=default_biosphere_npp_0,
+            co2_fert_factor=default_co2_fert_factor):
+    """
+    This function runs the simple climate model for the historical emissions that a set of scenarios have in common and
+    returns the state at the end of them (the branch year), from which :func:`run_from_state` continues with the emissions
+    of each scenario:
+
+    >>> state = pySCM.spin_up(co2[:265], ch4[:265], n2o[:265], sox[:265], 800, 75.0)
+    >>> results = pySCM.run_from_state(state, future_co2, future_ch4, future_n2o, future_sox)
+
+    gives the same results as running :func:`run_scenarios` for the historical emissions followed by the future emissions
+    and dropping the historical years, without integrating the historical years again. The carbon cycle always uses the
+    'modes' method. The arguments are the same as for :func:`run_scenarios`.
+
+    :returns: SCMState -- the state at the branch year, its results attribute holds the SCMResults of the historical years
+    """
+    parameters = dict(num_years=num_years, OceanMLDepth=OceanMLDepth, method=method, climate_sensitivity=climate_sensitivity,
+                      air_sea_gas_exchange_coeff=air_sea_gas_exchange_coeff, biosphere_npp_0=biosphere_npp_0,
+                      co2_fert_factor=co2_fert_factor)
+    co2_concs, carbon_cycle = co2_emis_to_concs_modes(co2_emis, num_years, OceanMLDepth, air_sea_gas_exchange_coeff,
+                                                      biosphere_npp_0, co2_fert_factor, base_CO2, return_state=True)
+    # one more year gives the concentrations in the branch year
+    concs = species_emis_to_concs({'CH4': _extend(ch4_emis, 1), 'N2O': _extend(n2o_emis, 1)})
+    ch4_concs, n2o_concs = concs['CH4'][..., :-1], concs['N2O'][..., :-1]
+    year = co2_concs.shape[-1]
+
+    rf = calculate_rf(np.asarray(sox_emis, dtype=float), co2_concs, ch4_concs, n2o_concs)
+    # the responses to the historical years continue for num_years years after the branch year
+    delta_temperature = calc_delta_surf_temp(num_years, _extend(rf, num_years), method, climate_sensitivity)
+    slr = calculate_slr(num_years, _extend(delta_temperature[..., :year], num_years), method)
+
+    results = SCMResults(co2_concs, ch4_concs, n2o_concs, rf, delta_temperature[..., :year], slr[..., :year])
+    return SCMState(year, carbon_cycle, concs['CH4'][..., -1], concs['N2O'][..., -1], delta_temperature[..., year:],
+                    slr[..., year:], parameters, results)
+
+
+def run_from_state(state, co2_emis, ch4_emis, n2o_emis, sox_emis):
+    """
+    This function continues a model run from an SCMState (see :func:`spin_up`) for one or a batch of scenarios. The
+    emissions start in the branch year and may have scenario axes like those of :func:`run_scenarios`; they are broadcast
+    against the scenario axes of the state.
+
+    :param state: SCMState -- the state at the branch year
+    :param co2_emis: numpy.array -- |CO2| emissions [PgC/year] from the branch year on
+    :param ch4_emis: numpy.array -- |CH4| emissions [TgCH4/year] from the branch year on
+    :param n2o_emis: numpy.array -- |N2O| emissions [TgN2O/year] from the branch year on
+    :param sox_emis: numpy.array -- |SOx| emissions [TgS/year] from the branch year on
+    :returns: SCMResults -- containing the results from the branch year on
+    """
+    parameters = state.parameters
+    num_years = parameters['num_years']
+    co2_concs = co2_emis_to_concs_modes(co2_emis, num_years, parameters['OceanMLDepth'],
+                                        parameters['air_sea_gas_exchange_coeff'], parameters['biosphere_npp_0'],
+                                        parameters['co2_fert_factor'], base_CO2, state=state.carbon_cycle)
+    concs = species_emis_to_concs({'CH4': ch4_emis, 'N2O': n2o_emis},
+                                  initial={'CH4': state.ch4_concs, 'N2O': state.n2o_concs})
+    ch4_concs, n2o_concs = concs['CH4'], concs['N2O']
+    rf = calculate_rf(np.asarray(sox_emis, dtype=float), co2_concs, ch4_concs, n2o_concs)
+
+    n = rf.shape[-1]
+    delta_temperature = calc_delta_surf_temp(num_years, rf, parameters['method'], parameters['climate_sensitivity']) + \
+                        _extend(state.temperature_commitment, n - num_years)[..., :n]
+    slr = calculate_slr(num_years, delta_temperature, parameters['method']) + \
+          _extend(state.slr_commitment, n - num_years)[..., :n]
+
+    return SCMResults(co2_concs, ch4_concs, n2o_concs, rf, delta_temperature, slr)
+
+
+def _extend(series, num_years):
+    """
+    This private function appends num_years years of zeros to a time series (time being the last axis).
+    """
+    series = np.asarray(series, dtype=float)
+    return np.pad(series, [(0, 0)] * (series.ndim - 1) + [(0, max(num_years, 0))])
+
+
 def generate_biosphere_response(num_years):
     """
-    This function calculates the decay response function for the biosphere.
+    This function calculates the decay response function for the biosphere. The response function is cached (see
+    :func:`_cached_response`) and returned as a read-only numpy.array.
 
     :param num_years: number of years to calculate the response function for.
     :returns: numpy.array -- contains the biosphere-atmospheric flux after initial carbon input per year
     """
-    return_val = np.zeros(num_years)
-    for yr in range(num_years):
-        # Biosphere decay response function from Joos et al. 1996, pg. 416
-        return_val[yr] = 0.7021 * np.exp(-0.35 * yr) + 0.01341 * np.exp(-yr / 20.0) - 0.7185 * np.exp(
-            -0.4583 * yr) + 0.002932 * np.exp(-0.01 * yr)
-
-    return return_val
+    # Biosphere decay response function from Joos et al. 1996, pg. 416
+    return _cached_response(('biosphere',), num_years,
+                            lambda numYrs: _sum_of_exponentials(biosphere_response_modes, np.arange(numYrs)))
 
 
 def generate_ocean_response(num_years, OceanMLDepth):
     """
     This function calculates the ocean mixed layer response function (HILDA model) as described in Joos et al., 1996.
     This function returns the amount of carbon remaining in the surface layer of the ocean after an input (pulse) from the atmosphere
-    scaled to units of micromol/kg.
+    scaled to units of micromol/kg. The response function is cached (see :func:`_cached_response`) and returned as a
+    read-only numpy.array.
 
     :param num_years: The number of years to calculate the response function for.
-    :param OceanMLDepth: Ocean mixed layer depth in meters.
+    :param OceanMLDepth: Ocean mixed layer depth in meters. If this is a numpy.array, one response function is returned for
+        each depth (time being the last axis).
     :returns:  numpy.array -- contains the remaining carbon per year.
     """
 
+    def generate_unscaled(numYrs):
+        years = np.arange(numYrs)
+        return np.where(years < 2, _sum_of_exponentials(ocean_response_modes_early, years),
+                        _sum_of_exponentials(ocean_response_modes, years))
+
+    if np.ndim(OceanMLDepth) == 0:
+        OceanMLDepth = float(OceanMLDepth)
+        # scale values to micromole per kg
+        return _cached_response(('ocean', OceanMLDepth), num_years,
+                                lambda numYrs: _cached_response(('ocean',), numYrs, generate_unscaled) *
+                                _ocean_response_scale(OceanMLDepth))
+
+    # for an ensemble of depths, the cached unscaled response function is scaled for each member
+    scale = _ocean_response_scale(np.asarray(OceanMLDepth, dtype=float))
+    return_val = _cached_response(('ocean',), num_years, generate_unscaled) * scale[..., np.newaxis]
+    return_val.flags.writeable = False
+
+    return return_val
+
+
+def generate_temp_response_function(num_years):
+    """
+    This function calculates the temperature response function that is used to calculate the change in global mean surface
+    temperature as a result of changes in radiative forcing. The response function is cached (see :func:`_cached_response`)
+    and returned as a read-only numpy.array.
+
+    :param num_years: number of years the response function will be evaluates for.
+    :returns: numpy.array -- containing climate response function
+    """
+    return _cached_response(('temperature',), num_years,
+                            lambda numYrs: _sum_of_exponentials(temp_response_modes, np.arange(numYrs)))
+
+
+def generate_slr_response(num_years):
+    """
+    This function calculates the sea level response function that is used to calculate the change in sea level as a result of changes in in global mean surface temperature.
+    This equation only accounts for changes in sea level resulting from thermal expansion of the ocean, it does not include the effects of melting glaciers and melting grounded
+    ice sheets. The response function is cached (see :func:`_cached_response`) and returned as a read-only numpy.array.
+
+    :param num_years: number of years the response function will be evaluates for.
+    :returns: numpy.array -- containing climate response function
+    """
+    return _cached_response(('sea level',), num_years,
+                            lambda numYrs: _sum_of_exponentials(slr_response_modes, np.arange(numYrs)))
+
+
+def _sum_of_exponentials(modes, years):
+    """
+    This private function evaluates sum(amplitude * exp(-years / timescale)) over the given (amplitude, timescale) modes.
+    """
+    return sum(amplitude * np.exp(-years / timescale) for amplitude, timescale in modes)
+
+
+def _cached_response(key, num_years, generate):
+    """
+    This private function returns a response function from response_function_cache, calling generate(num_years) if it is not
+    cached yet. Only the longest response function generated for a key is kept; shorter ones are slices of it. The returned
+    arrays are read-only as they are shared between all callers.
+    """
+    response = response_function_cache.get(key)
+    if response is None or len(response) < num_years:
+        response = np.array(generate(num_years), dtype=float)
+        response.flags.writeable = False
+        response_function_cache.put(key, response)
+
+    return response[:num_years]
+
+
+def _ocean_response_scale(OceanMLDepth):
+    """
+    This private function returns the factor which scales the ocean mixed layer response function to units of micromol/kg.
+    """
+
     # ---------------------------------------------------------------------
     # The following constants were taken from Joos et al., 1996, pg 400.
     # ---------------------------------------------------------------------
@@ -413,20 +1452,55 @@ def generate_ocean_response(num_years, OceanMLDepth):
     g_cper_mole = 12.0113  # molar mass of carbon.
     sea_water_dens = 1.0265E3  # sea water density in kg/m^3.
 
-    return_val = np.zeros(num_years)
+    return (1E21 * PgCperppm / g_cper_mole) / (sea_water_dens * OceanMLDepth * ocean_area)
 
-    for yr in range(num_years):
-        if yr < 2.0:
-            value = 0.12935 + 0.21898 * np.exp(-yr / 0.034569) + 0.17003 * np.exp(-yr / 0.26936) + 0.24071 * np.exp(
-                -yr / 0.96083) + 0.24093 * np.exp(-yr / 4.9792)
-        else:
-            value = 0.022936 + 0.24278 * np.exp(-yr / 1.2679) + 0.13963 * np.exp(-yr / 5.2528) + 0.089318 * np.exp(
-                -yr / 18.601) + 0.037820 * np.exp(-yr / 68.736) + 0.035549 * np.exp(-yr / 232.30)
 
-        # scale values to micromole per kg
-        return_val[yr] = value * (1E21 * PgCperppm / g_cper_mole) / (sea_water_dens * OceanMLDepth * ocean_area)
+def set_kernel_backend(backend):
+    """
+    This function selects the implementation of the carbon cycle recurrence used by :func:`co2_emis_to_concs_modes`:
 
-    return return_val
+    >>> pySCM.scm.set_kernel_backend('numpy')
+
+    'numba' uses a compiled kernel which integrates the ensemble members in parallel threads. It is compiled on first use
+    (which takes a few seconds) and cached on disk, so later processes load it without recompiling, but loading it still
+    takes about 0.2 s per process. That is far longer than a run of a few scenarios with numpy (about 5 ms), so numba only
+    pays off for large batches or many runs per process. 'numpy' uses the pure numpy implementation and 'auto' (the
+    default) uses numba if it is installed and a batch has at least numba_member_threshold members (scenarios times
+    ensemble members), or if the kernels have already been loaded by the process.
+
+    :param backend: 'auto', 'numba' or 'numpy'
+    """
+    global kernel_backend
+    if backend not in ('auto', 'numba', 'numpy'):
+        raise SCMError('{} is not a valid kernel backend'.format(backend))
+    if backend == 'numba':
+        try:
+            import numba  # noqa: F401
+        except ImportError:
+            raise SCMError('the numba kernel backend requires numba to be installed')
+    kernel_backend = backend
+
+
+def _kernels(num_members):
+    """
+    This private function returns the module of compiled kernels or None if the numpy backend is used for a batch of
+    num_members members.
+    """
+    if kernel_backend == 'numpy':
+        return None
+    global _loaded_kernels
+    if kernel_backend == 'auto' and num_members < numba_member_threshold and _loaded_kernels is None:
+        # not worth loading the kernels
+        return None
+    try:
+        from . import kernels
+    except ImportError:
+        if kernel_backend == 'numba':
+            raise
+        return None
+    _loaded_kernels = kernels
+
+    return kernels
 
 
 def delta_co2_from_ocean(ocean_surf_dic):
@@ -450,212 +1524,810 @@ def delta_co2_from_ocean(ocean_surf_dic):
     return return_val
 
 
-def co2_emis_to_concs(co2_emis, num_years, OceanMLDepth):
+def co2_emis_to_concs(co2_emis, num_years, OceanMLDepth, method='convolution',
+                      air_sea_gas_exchange_coeff=default_air_sea_gas_exchange_coeff,
+                      biosphere_npp_0=default_biosphere_npp_0, co2_fert_factor=default_co2_fert_factor):
     """
     This function converts atmospheric |CO2| emissions to concentrations as described in Joos et al. 1996.
+
+    By default ('convolution') the air-sea flux and the biosphere flux of each year are committed to all future years using
+    the ocean and biosphere response functions, which is O(n^2) in the number of years. With method='modes' the same
+    response functions are represented by one reservoir state per exponential mode (see :func:`co2_emis_to_concs_modes`),
+    which is O(n) in the number of years and gives the same concentrations to floating point precision.
+
+    OceanMLDepth and the carbon cycle parameters can be numpy.arrays to evaluate a whole parameter ensemble at once. They are
+    broadcast against the scenario axes of the emissions (i.e. all axes but the last), e.g. emissions for a single scenario
+    and an array of 1000 ocean mixed layer depths give 1000 rows of concentrations. The ocean response function is generated
+    for each member.
     
-    :param co2_emis: atmospheric |CO2| emissions [PgC/year]
+    :param co2_emis: atmospheric |CO2| emissions [PgC/year], either a list of EmissionRec or a numpy.array where time is the
+        last axis and any leading axes hold different scenarios
     :param num_years: number of years the response function is going to be calculated for
     :param OceanMLDepth: ocean mixed layer depth [m]
+    :param method: 'convolution' (default) or 'modes'
+    :param air_sea_gas_exchange_coeff: air-sea gas exchange coefficient [kg m^-2 year^-1] (default 0.1042)
+    :param biosphere_npp_0: pre-industrial net primary production of the biosphere [GtC/year] (default 60.0)
+    :param co2_fert_factor: |CO2| fertilisation factor. The default of 0.287 balances LUC emission of 1.1 PgC/yr in 1980s
+        (Joos et al, 1996), 0.380 balances LUC emission of 1.6 PgC/yr in 1980s (IPCC 1994).
     :returns: numpy array -- containing the atmospheric |CO2| concentrations for each year [ppm]
     """
-    # XAtmosBio is the amount of CO2 returned to the atmosphere as a result
-    # of decay of the enhanced plant growth resulting from higher CO2.
-    x_atmos_bio = 0.0
-    air_sea_gas_exchange_coeff = 0.1042  # kg m^-2 year^-1
-    biosphere_npp_0 = 60.0  # GtC/year.
-    # 0.287 balances LUC emission of 1.1 PgC/yr in 1980s (Joos et al, 1996)
-    # 0.380  balances LUC emission of 1.6 PgC/yr in 1980s (IPCC 1994)
-    co2_fert_factor = 0.287
     co2ppm_0 = 278.305
-    atmos_co2 = np.zeros(len(co2_emis))
-    atmos_bio_flux = np.zeros(len(co2_emis))
-    surface_ocean_dic = np.zeros(len(co2_emis))
-    sea_water_pco2 = np.zeros(len(co2_emis))
-    atmos_sea_flux = np.zeros(len(co2_emis))
 
+    co2_emis = _get_species(co2_emis, 'CO2')
+
+    if method == 'modes':
+        return co2_emis_to_concs_modes(co2_emis, num_years, OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0,
+                                       co2_fert_factor, co2ppm_0)
+    elif method != 'convolution':
+        raise SCMError('{} is not a valid carbon cycle method'.format(method))
+
+    # time is the last axis, any leading axes hold different scenarios and/or ensemble members
+    n = co2_emis.shape[-1]
+    shape = _batch_shape(co2_emis, OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor) + (n,)
+    # XAtmosBio is the amount of CO2 returned to the atmosphere as a result
+    # of decay of the enhanced plant growth resulting from higher CO2.
+    x_atmos_bio = np.zeros(shape[:-1])
+    atmos_co2 = np.zeros(shape)
+    atmos_bio_flux = np.zeros(shape)
+    surface_ocean_dic = np.zeros(shape)
+    sea_water_pco2 = np.zeros(shape)
+    atmos_sea_flux = np.zeros(shape)
+
+    # the response functions are zero after num_years years
     ocean_response = generate_ocean_response(num_years, OceanMLDepth)
-    bio_response = generate_biosphere_response(num_years)
+    ocean_response = np.pad(ocean_response, [(0, 0)] * (ocean_response.ndim - 1) + [(0, max(n - num_years, 0))])
+    bio_response = np.pad(generate_biosphere_response(num_years), (0, max(n - num_years, 0)))
 
-    for yr_ind in range(len(co2_emis) - 1):
+    for yr_ind in range(n - 1):
         if yr_ind > 0:
-            sea_water_pco2[yr_ind] = delta_co2_from_ocean(surface_ocean_dic[yr_ind])
+            sea_water_pco2[..., yr_ind] = delta_co2_from_ocean(surface_ocean_dic[..., yr_ind])
 
-        atmos_sea_flux[yr_ind] = air_sea_gas_exchange_coeff * (atmos_co2[yr_ind] - sea_water_pco2[yr_ind])
+        atmos_sea_flux[..., yr_ind] = air_sea_gas_exchange_coeff * (atmos_co2[..., yr_ind] - sea_water_pco2[..., yr_ind])
         # delta is the amount of CO2 taken out of the atmosphere due to stimulated plant growth minus the amount of CO2 returned
         # to the atmosphere due to the decay of organic material.
         delta = biosphere_npp_0 * co2_fert_factor * np.log(
-            1.0 + (atmos_co2[yr_ind] / co2ppm_0)) / PgCperppm - x_atmos_bio
+            1.0 + (atmos_co2[..., yr_ind] / co2ppm_0)) / PgCperppm - x_atmos_bio
         x_atmos_bio += delta
-        atmos_bio_flux[yr_ind] += x_atmos_bio
+        atmos_bio_flux[..., yr_ind] += x_atmos_bio
         # Accumulate committments of these fluxes to all future times for SurfaceOceanDIC and AtmosBioFlux.
-        for j in range(yr_ind + 1, len(surface_ocean_dic)):
-            surface_ocean_dic[j] = surface_ocean_dic[j] + atmos_sea_flux[yr_ind] * ocean_response[j - yr_ind]
-
-        for j in range(yr_ind + 1, len(atmos_bio_flux)):
-            atmos_bio_flux[j] = atmos_bio_flux[j] - x_atmos_bio * bio_response[j - yr_ind]
+        surface_ocean_dic[..., yr_ind + 1:] += atmos_sea_flux[..., yr_ind, np.newaxis] * ocean_response[..., 1:n - yr_ind]
+        atmos_bio_flux[..., yr_ind + 1:] -= x_atmos_bio[..., np.newaxis] * bio_response[1:n - yr_ind]
 
-        atmos_co2[yr_ind + 1] = atmos_co2[yr_ind] + (co2_emis[yr_ind].CO2 / PgCperppm) - atmos_sea_flux[yr_ind] - \
-                                atmos_bio_flux[yr_ind]
+        atmos_co2[..., yr_ind + 1] = atmos_co2[..., yr_ind] + (co2_emis[..., yr_ind] / PgCperppm) - \
+                                     atmos_sea_flux[..., yr_ind] - atmos_bio_flux[..., yr_ind]
 
     return atmos_co2
 
 
+class _CarbonCycleModes:
+    """
+    This private class holds the exponential modes of the ocean and biosphere response functions for a set of carbon cycle
+    parameters (shaped to broadcast against batch_ndim scenario axes) and advances the carbon cycle of
+    :func:`co2_emis_to_concs_modes` by one year.
+    """
+
+    def __init__(self, num_years, OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor, co2ppm_0,
+                 batch_ndim):
+        self.num_years = num_years
+        self.air_sea_gas_exchange_coeff = air_sea_gas_exchange_coeff
+        self.biosphere_npp_0 = biosphere_npp_0
+        self.co2_fert_factor = co2_fert_factor
+        self.co2ppm_0 = co2ppm_0
+        self.ocean_scale = _ocean_response_scale(np.asarray(OceanMLDepth, dtype=float))
+        # ocean response to the flux of the previous year from the fit for years < 2
+        self.ocean_lag1 = sum(amplitude * np.exp(-1.0 / timescale) for amplitude, timescale in ocean_response_modes_early) \
+            * self.ocean_scale if num_years > 1 else 0.0
+        # the mode parameters are shaped so that they broadcast against the scenario axes
+        ocean_amplitudes, self.ocean_decay = _exponential_modes(ocean_response_modes, batch_ndim)
+        self.ocean_unscaled_amplitudes = ocean_amplitudes.reshape(-1)
+        self.ocean_amplitudes = ocean_amplitudes * self.ocean_scale
+        self.bio_amplitudes, self.bio_decay = _exponential_modes(biosphere_response_modes, batch_ndim)
+
+    def step(self, yr_ind, hist_ind, atmos_co2, co2_emis, x_atmos_bio, ocean_state, bio_state, atmos_sea_flux,
+             x_atmos_bio_hist):
+        """
+        This function advances the carbon cycle from year yr_ind to the next year. The air-sea flux and x_atmos_bio of the
+        year are stored at hist_ind of the histories (time being the last axis) and the values of earlier years are read at
+        hist_ind - lag; as negative indices wrap around, the histories can also be ring buffers of at least
+        max(num_years, 2) years. x_atmos_bio is updated in place.
+
+        :returns: the |CO2| concentration of the next year and the new ocean and biosphere states
+        """
+        num_years = self.num_years
+        ocean_decay = self.ocean_decay
+        bio_decay = self.bio_decay
+        if yr_ind >= 2 and num_years > 2:
+            ocean_state = ocean_decay * ocean_state + ocean_decay ** 2 * atmos_sea_flux[..., hist_ind - 2]
+            if yr_ind >= num_years:
+                ocean_state -= ocean_decay ** num_years * atmos_sea_flux[..., hist_ind - num_years]
+        if yr_ind >= 1 and num_years > 1:
+            bio_state = bio_decay * bio_state + bio_decay * x_atmos_bio_hist[..., hist_ind - 1]
+            if yr_ind >= num_years:
+                bio_state -= bio_decay ** num_years * x_atmos_bio_hist[..., hist_ind - num_years]
+
+        if yr_ind > 0:
+            surface_ocean_dic = self.ocean_lag1 * atmos_sea_flux[..., hist_ind - 1] + \
+                                np.sum(self.ocean_amplitudes * ocean_state, axis=0)
+            sea_water_pco2 = delta_co2_from_ocean(surface_ocean_dic)
+        else:
+            sea_water_pco2 = 0.0
+
+        atmos_sea_flux[..., hist_ind] = self.air_sea_gas_exchange_coeff * (atmos_co2 - sea_water_pco2)
+        delta = self.biosphere_npp_0 * self.co2_fert_factor * np.log(
+            1.0 + (atmos_co2 / self.co2ppm_0)) / PgCperppm - x_atmos_bio
+        x_atmos_bio += delta
+        x_atmos_bio_hist[..., hist_ind] = x_atmos_bio
+        atmos_bio_flux = x_atmos_bio - np.sum(self.bio_amplitudes * bio_state, axis=0)
+
+        next_atmos_co2 = atmos_co2 + (co2_emis / PgCperppm) - atmos_sea_flux[..., hist_ind] - atmos_bio_flux
+
+        return next_atmos_co2, ocean_state, bio_state
+
+
+def co2_emis_to_concs_modes(co2_emis, num_years, OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0,
+                            co2_fert_factor, co2ppm_0, state=None, return_state=False):
+    """
+    This function converts atmospheric |CO2| emissions to concentrations like :func:`co2_emis_to_concs` but represents the
+    ocean and biosphere response functions as sums of exponentials (ocean_response_modes and biosphere_response_modes).
+    Instead of committing each year's fluxes to all future years, one reservoir state per exponential mode is advanced
+    every year, so the cost is O(n * modes) instead of O(n^2).
+
+    The ocean response function uses a different fit for years < 2. As fluxes are only committed to the following years,
+    the only value taken from that fit is the one at a lag of one year, which is added directly; the modes cover lags of two
+    years and more. Fluxes older than num_years (the length of the response functions) are removed from the states so that
+    the response functions are truncated exactly like in the convolution.
+
+    The ocean mixed layer depth and the carbon cycle parameters may be numpy.arrays which are broadcast against the scenario
+    axes of the emissions, see :func:`co2_emis_to_concs`.
+
+    The integration can be continued from a CarbonCycleState returned by an earlier call with return_state=True, e.g. to run
+    several future scenarios from the state at the end of the historical period. The emissions then start in the year of
+    the state and the run has to use the same parameters.
+
+    :param co2_emis: numpy.array -- atmospheric |CO2| emissions [PgC/year]. Time is the last axis; any leading axes hold
+        different scenarios.
+    :param num_years: number of years the response functions are evaluated for
+    :param OceanMLDepth: ocean mixed layer depth [m]
+    :param air_sea_gas_exchange_coeff: air-sea gas exchange coefficient [kg m^-2 year^-1]
+    :param biosphere_npp_0: pre-industrial net primary production of the biosphere [GtC/year]
+    :param co2_fert_factor: |CO2| fertilisation factor
+    :param co2ppm_0: pre-industrial |CO2| concentration [ppm]
+    :param state: CarbonCycleState to start from (default: pre-industrial equilibrium)
+    :param return_state: whether to also return the CarbonCycleState after the last year of emissions
+    :returns: numpy array -- containing the atmospheric |CO2| concentrations for each year [ppm], and the CarbonCycleState if
+        return_state is True
+    """
+    co2_emis = np.asarray(co2_emis, dtype=float)
+    n = co2_emis.shape[-1]
+    if state is None:
+        state = _pre_industrial_carbon_cycle()
+    batch_shape = _batch_shape(co2_emis, OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor,
+                               state.x_atmos_bio)
+    modes = _CarbonCycleModes(num_years, OceanMLDepth, air_sea_gas_exchange_coeff, biosphere_npp_0, co2_fert_factor,
+                              co2ppm_0, len(batch_shape))
+
+    # ocean_state holds sum(atmos_sea_flux[yr - lag] * ocean_decay ** lag) for lags 2 .. num_years - 1 and bio_state holds
+    # sum(x_atmos_bio[yr - lag] * bio_decay ** lag) for lags 1 .. num_years - 1
+    ocean_state = _broadcast_modes(state.ocean_state, batch_shape)
+    bio_state = _broadcast_modes(state.bio_state, batch_shape)
+    x_atmos_bio = np.array(np.broadcast_to(state.x_atmos_bio, batch_shape))
+
+    # the histories of the fluxes start with the years before the state that still contribute to the states
+    history = state.atmos_sea_flux.shape[-1]
+    atmos_co2 = np.zeros(batch_shape + (n + 1,))
+    atmos_co2[..., 0] = state.atmos_co2
+    atmos_sea_flux = np.zeros(batch_shape + (history + n,))
+    atmos_sea_flux[..., :history] = state.atmos_sea_flux
+    x_atmos_bio_hist = np.zeros(batch_shape + (history + n,))
+    x_atmos_bio_hist[..., :history] = state.x_atmos_bio_hist
+
+    kernels = _kernels(int(np.prod(batch_shape)))
+    if kernels is not None:
+        # the compiled kernel integrates each ensemble member separately, so flatten the scenario axes into one member axis
+        def members(value):
+            return np.ascontiguousarray(np.broadcast_to(value, batch_shape), dtype=float).reshape(-1)
+
+        def member_modes(modes_state):
+            return np.ascontiguousarray(np.moveaxis(modes_state, 0, -1)).reshape(-1, modes_state.shape[0])
+
+        ocean_members, bio_members, x_atmos_bio_members = member_modes(ocean_state), member_modes(bio_state), \
+            x_atmos_bio.reshape(-1)
+        kernels.co2_emis_to_concs_modes(
+            np.ascontiguousarray(np.broadcast_to(co2_emis, batch_shape + (n,))).reshape(-1, n),
+            members(modes.ocean_lag1), np.outer(members(modes.ocean_scale), modes.ocean_unscaled_amplitudes),
+            modes.ocean_decay.reshape(-1), modes.bio_amplitudes.reshape(-1), modes.bio_decay.reshape(-1),
+            members(air_sea_gas_exchange_coeff), members(biosphere_npp_0), members(co2_fert_factor), num_years,
+            float(co2ppm_0), PgCperppm, state.year, atmos_co2.reshape(-1, n + 1), atmos_sea_flux.reshape(-1, history + n),
+            x_atmos_bio_hist.reshape(-1, history + n), ocean_members, bio_members, x_atmos_bio_members)
+        ocean_state = np.moveaxis(ocean_members.reshape(batch_shape + ocean_state.shape[:1]), -1, 0)
+        bio_state = np.moveaxis(bio_members.reshape(batch_shape + bio_state.shape[:1]), -1, 0)
+        x_atmos_bio = x_atmos_bio_members.reshape(batch_shape)
+    else:
+        for ind in range(n):
+            # the year since the start of the integration and the index of the year in the flux histories
+            atmos_co2[..., ind + 1], ocean_state, bio_state = modes.step(
+                state.year + ind, history + ind, atmos_co2[..., ind], co2_emis[..., ind], x_atmos_bio, ocean_state,
+                bio_state, atmos_sea_flux, x_atmos_bio_hist)
+
+    if not return_state:
+        return atmos_co2[..., :n]
+
+    # only the fluxes of the last num_years years (and at least of the last two) affect the following years
+    keep = min(history + n, max(num_years, 2))
+    new_state = CarbonCycleState(state.year + n, atmos_co2[..., n].copy(), x_atmos_bio, ocean_state, bio_state,
+                                 atmos_sea_flux[..., history + n - keep:].copy(),
+                                 x_atmos_bio_hist[..., history + n - keep:].copy())
+
+    return atmos_co2[..., :n], new_state
+
+
+def _pre_industrial_carbon_cycle():
+    """
+    This private function returns the CarbonCycleState of the pre-industrial equilibrium, from which the carbon cycle
+    starts by default.
+    """
+    return CarbonCycleState(0, 0.0, 0.0, np.zeros(len(ocean_response_modes)), np.zeros(len(biosphere_response_modes)),
+                            np.zeros(0), np.zeros(0))
+
+
+def _broadcast_modes(modes_state, batch_shape):
+    """
+    This private function returns a writable copy of the states of the carbon cycle modes (the modes being the first axis)
+    broadcast to the scenario axes batch_shape. The missing scenario axes are inserted after the mode axis.
+    """
+    modes_state = np.asarray(modes_state, dtype=float)
+    missing_axes = (1,) * (len(batch_shape) + 1 - modes_state.ndim)
+    modes_state = modes_state.reshape(modes_state.shape[:1] + missing_axes + modes_state.shape[1:])
+
+    return np.array(np.broadcast_to(modes_state, modes_state.shape[:1] + batch_shape))
+
+
 def ch4_emis_to_concs(emissions):
     """
-    This function converts methane (|CH4|) emissions into concentrations.
+    This function converts methane (|CH4|) emissions into concentrations, see :func:`linear_decay_emis_to_concs`. The
+    concentrations are linear in the emissions, their Green's function is given by :func:`impulse_response`.
     
-    :param emissions: |CH4| emissions [TgCH4/year]
+    :param emissions: |CH4| emissions [TgCH4/year], either a list of EmissionRec or a numpy.array where time is the last axis
     :returns: numpy.array -- containing the |CH4| concentrations for each year [ppb]
     """
-    tau_ch4 = 10.0  # Lifetime of CH4
-    lam_ch4 = 1.0 / tau_ch4  # inverse lifetime in years-1
-    scale_ch4 = 2.78  # TgCH4 per ppb (IPCC TAR report value, chapter 4)
-
-    result = np.zeros(len(emissions))
-    decay = np.exp(-lam_ch4)
-    accum = (1.0 - decay) / (lam_ch4 * scale_ch4)
-    for i in range(1, len(emissions)):
-        result[i] = result[i - 1] * decay + emissions[i - 1].CH4 * accum
-
-    return result
+    return linear_decay_emis_to_concs(_get_species(emissions, 'CH4'), *decay_species['CH4'])
 
 
 def n2o_emis_to_concs(emissions):
     """
-    This function converts nitrous oxide (|N2O|) emissions into concentrations.
+    This function converts nitrous oxide (|N2O|) emissions into concentrations, see :func:`linear_decay_emis_to_concs`.
+    The concentrations are linear in the emissions, their Green's function is given by :func:`impulse_response`.
     
-    :param emissions: |N2O| emissions [TgN2O/year]
+    :param emissions: |N2O| emissions [TgN2O/year], either a list of EmissionRec or a numpy.array where time is the last axis
     :returns: numpy.array -- containing the |N2O| concentrations for each year [ppb]
     """
-    tau_n2o = 114.0  # Lifetime of N2O
-    lam_n2o = 1.0 / tau_n2o  # inverse lifetime in years-1
-    scale_n2o = 4.8  # TgN2O per ppb (IPCC TAR report value, chapter 4)
+    return linear_decay_emis_to_concs(_get_species(emissions, 'N2O'), *decay_species['N2O'])
 
-    result = np.zeros(len(emissions))
-    decay = np.exp(-lam_n2o)
-    accum = (1.0 - decay) / (lam_n2o * scale_n2o)
-    for i in range(1, len(emissions)):
-        result[i] = result[i - 1] * decay + emissions[i - 1].N2O * accum
 
-    return result
+def register_decay_species(name, lifetime, scale):
+    """
+    This function adds a gas with a single atmospheric lifetime to :data:`decay_species` (or replaces it) so that its
+    concentrations can be calculated with :func:`species_emis_to_concs`, e.g. for a HFC:
+
+    >>> pySCM.scm.register_decay_species('HFC-134a', 14.0, 17.8)
+
+    :param name: name of the gas
+    :param lifetime: atmospheric lifetime [years]
+    :param scale: emissions per unit concentration, e.g. [Tg per ppb] for emissions in Tg/year and concentrations in ppb
+    """
+    if not lifetime > 0.0 or not scale > 0.0:
+        raise SCMError('the lifetime and scale of {} need to be positive'.format(name))
+    decay_species[name] = (float(lifetime), float(scale))
+
+
+def linear_decay_emis_to_concs(emissions, lifetime, scale, initial=0.0):
+    """
+    This function converts the emissions of gases which decay with a single lifetime into concentrations by solving the
+    first order recurrence (IIR filter)
+
+        c[i] = c[i - 1] * exp(-1 / lifetime) + e[i - 1] * (1 - exp(-1 / lifetime)) * lifetime / scale
+
+    with c[0] = initial. The lifetime, scale and initial concentration may be numpy.arrays which are broadcast against the emissions without their time
+    axis, so that any number of gases and scenarios is solved in a single pass over the years.
+
+    :param emissions: numpy.array -- emissions where time is the last axis
+    :param lifetime: atmospheric lifetime [years]
+    :param scale: emissions per unit concentration, e.g. [Tg per ppb]
+    :param initial: concentration in the first year (default 0)
+    :returns: numpy.array -- containing the concentrations for each year
+    """
+    emissions = np.asarray(emissions, dtype=float)
+    decay, accum = _decay_coefficients(lifetime, scale)
+
+    num_years = emissions.shape[-1]
+    batch_shape = _batch_shape(emissions, decay, accum, initial)
+    # iterate over the leading axis of a time-major copy so that each step operates on contiguous memory
+    sources = np.moveaxis(np.broadcast_to(emissions, batch_shape + (num_years,)), -1, 0) * accum
+    if num_years == 0:
+        return np.zeros(batch_shape + (0,))
+    result = np.zeros((num_years,) + batch_shape)
+    result[0] = initial
+    for i in range(1, num_years):
+        result[i] = result[i - 1] * decay + sources[i - 1]
+
+    return np.ascontiguousarray(np.moveaxis(result, 0, -1))
+
+
+def _decay_coefficients(lifetime, scale):
+    """
+    This private function returns the factors by which the concentration of a gas with a single lifetime decays each year
+    and by which the emissions of a year add to the concentration of the next year.
+    """
+    lam = 1.0 / np.asarray(lifetime, dtype=float)  # inverse lifetime in years-1
+    decay = np.exp(-lam)
+    accum = (1.0 - decay) / (lam * np.asarray(scale, dtype=float))
+
+    return decay, accum
+
+
+def species_emis_to_concs(emissions, species=None, initial=None):
+    """
+    This function converts the emissions of several gases from :data:`decay_species` into concentrations at once, e.g.
+
+    >>> concs = pySCM.scm.species_emis_to_concs({'CH4': ch4_emis, 'N2O': n2o_emis, 'HFC-134a': hfc_emis})
+    >>> concs['HFC-134a']
+
+    The emissions of all gases are stacked and solved in a single call of :func:`linear_decay_emis_to_concs`.
+
+    :param emissions: a dict of numpy.arrays (time being the last axis, the other axes are broadcast), an EmissionSeries or a
+        list of EmissionRec
+    :param species: names of the gases, by default all keys of a dict of emissions and the registered gases of an
+        EmissionSeries or a list of EmissionRec (i.e. |CH4| and |N2O|)
+    :param initial: dict of the concentrations of the gases in the first year (default 0)
+    :returns: dict -- containing the concentrations of each gas
+    """
+    if species is None:
+        if isinstance(emissions, dict):
+            species = list(emissions)
+        else:
+            species = [name for name in EmissionSeries.species if name in decay_species]
+    for name in species:
+        if name not in decay_species:
+            raise SCMError('{} is not a registered species'.format(name))
+    if isinstance(emissions, dict):
+        arrays = [np.asarray(emissions[name], dtype=float) for name in species]
+    else:
+        arrays = [_get_species(emissions, name) for name in species]
+    initial = [np.asarray(initial.get(name, 0.0), dtype=float) for name in species] if initial is not None else []
+    batch_shape = np.broadcast_shapes(*[array.shape[:-1] for array in arrays], *[value.shape for value in initial])
+    num_years = np.broadcast_shapes(*[array.shape[-1:] for array in arrays])
+    stacked = np.stack([np.broadcast_to(array, batch_shape + num_years) for array in arrays])
+    initial = np.stack([np.broadcast_to(value, batch_shape) for value in initial]) if initial else 0.0
+    lifetime, scale = np.array([decay_species[name] for name in species]).T.reshape((2, -1) + (1,) * len(batch_shape))
+    concs = linear_decay_emis_to_concs(stacked, lifetime, scale, initial)
+
+    return dict(zip(species, concs))
+
+
+def ch4_n2o_overlap(ch4_concs, n2o_concs):
+    """
+    This function calculates the overlap term of the |CH4| and |N2O| radiative forcing (IPCC TAR Chapter 6). It accounts for
+    the fact that methane and nitrous oxide have overlapping absorption bands so that higher concentrations of one gas will
+    reduce the effective absorption by the other and vice versa. It works element-wise on arrays of any shape.
+
+    :param ch4_concs: absolute |CH4| concentrations [ppb]
+    :param n2o_concs: absolute |N2O| concentrations [ppb]
+    :returns: numpy.array -- the overlap term [W/m^2]
+    """
+    product = ch4_concs * n2o_concs
+    return 0.47 * np.log(1 + 2.01e-5 * (product ** 0.75) + 5.31e-15 * ch4_concs * (product ** 1.52))
 
 
-def calculate_rf(emissions, co2_concs, ch4_concs, n2o_concs):
+def calculate_rf(emissions, co2_concs, ch4_concs, n2o_concs, return_components=False):
     """
     This function calculates the total radiative forcing (formula given in IPCC TAR Chapter 6). The total change in radiative forcing 
     is the sum of the changes in radiative forcing resulting from changes in |CO2|, |CH4|, and |N2O| concentrations and sulfate 
     emissions.
+
+    All terms are evaluated on whole arrays, so the concentrations and emissions can also hold a batch of scenarios (time being
+    the last axis). The pre-industrial terms are only evaluated once.
     
-    :param emissions: |SOx| emissions [TgS/year]
+    :param emissions: |SOx| emissions [TgS/year], either a list of EmissionRec or a numpy.array where time is the last axis
     :param co2_concs: |CO2| concentrations [ppm]
     :param ch4_concs: |CH4| concentrations [ppb]
     :param n2o_concs: |N2O| concentrations [ppb]
-    :returns: numpy.array -- containing the change in radiative forcing per year.
+    :param return_components: if True, the radiative forcing of each agent is returned as well.
+    :returns: numpy.array -- containing the change in radiative forcing per year. If return_components is True, a tuple of the
+        total and a dictionary of the changes in radiative forcing due to 'CO2', 'CH4', 'N2O' and 'SOx'.
     """
-    rad_forcing_ch4 = np.zeros(len(emissions))
-    rad_forcing_n2o = np.zeros(len(emissions))
+    sox_emis = _get_species(emissions, 'SOx')
+    ch4_concs = base_CH4 + np.asarray(ch4_concs, dtype=float)
+    n2o_concs = base_N20 + np.asarray(n2o_concs, dtype=float)
+
+    # pre-industrial overlap term
+    overlap_base = ch4_n2o_overlap(base_CH4, base_N20)
 
     # changes in radiative forcing due to changes in CO2 concentrations
-    rad_forcing_co2 = 5.35 * np.log(1 + (co2_concs / base_CO2))
+    rad_forcing_co2 = 5.35 * np.log(1 + (np.asarray(co2_concs, dtype=float) / base_CO2))
 
     # changes in radiative forcing due to changes in CH4 concentrations
-    for i in range(len(emissions)):
-        # the two functions below (fnow/fthen) account for the fact that methane and nitrous oxide have overlapping absoption bands so that higher concentrations of one gas will reduce the
-        # effective absoption by the other and vice versa.
-        fnow = 0.47 * np.log(
-            1 + 2.01e-5 * (((base_CH4 + ch4_concs[i]) * base_N20) ** 0.75) + 5.31e-15 * (base_CH4 + ch4_concs[i]) * (
-                    ((base_CH4 + ch4_concs[i]) * base_N20) ** 1.52))
-        fthen = 0.47 * np.log(
-            1 + 2.01e-5 * ((base_CH4 * base_N20) ** 0.75) + 5.31e-15 * base_CH4 * ((base_CH4 * base_N20) ** 1.52))
-        rad_forcing_ch4[i] = 0.036 * (math.sqrt(base_CH4 + ch4_concs[i]) - math.sqrt(base_CH4)) - (fnow - fthen)
+    rad_forcing_ch4 = 0.036 * (np.sqrt(ch4_concs) - math.sqrt(base_CH4)) - (
+            ch4_n2o_overlap(ch4_concs, base_N20) - overlap_base)
 
     # changes in radiative forcing due to changes in N2O concentrations
-    for i in range(len(emissions)):
-        fnow = 0.47 * np.log(1 + 2.01e-5 * ((base_CH4 * (base_N20 + n2o_concs[i])) ** 0.75) + 5.31e-15 * base_CH4 * (
-                (base_CH4 * (base_N20 + n2o_concs[i])) ** 1.52))
-        fthen = 0.47 * np.log(
-            1 + 2.01e-5 * ((base_CH4 * base_N20) ** 0.75) + 5.31e-15 * base_CH4 * ((base_CH4 * base_N20) ** 1.52))
-        rad_forcing_n2o[i] = 0.12 * (math.sqrt(base_N20 + n2o_concs[i]) - math.sqrt(base_N20)) - (fnow - fthen)
+    rad_forcing_n2o = 0.12 * (np.sqrt(n2o_concs) - math.sqrt(base_N20)) - (
+            ch4_n2o_overlap(base_CH4, n2o_concs) - overlap_base)
 
     # changes in radiative forcing due to changes in SOx emissions
-    rad_forcing_sox = np.array([(aerDirectFac + aerIndirectFac) * emissions[i].SOx for i in range(len(emissions))])
+    rad_forcing_sox = (aerDirectFac + aerIndirectFac) * sox_emis
 
     # sum 
     totalRadForcing = rad_forcing_co2 + rad_forcing_ch4 + rad_forcing_n2o + rad_forcing_sox
 
+    if return_components:
+        return totalRadForcing, {'CO2': rad_forcing_co2, 'CH4': rad_forcing_ch4, 'N2O': rad_forcing_n2o,
+                                 'SOx': rad_forcing_sox}
+
     return totalRadForcing
 
 
-def calc_delta_surf_temp(num_years, radForcing):
+def convolve_response(signal, response, method='auto'):
+    """
+    This function convolves a time series with an impulse response function, i.e. the value in year j is the sum over all
+    years i <= j of signal[i] * response[j - i]. It is used to derive the temperature change from the radiative forcing and
+    the sea level change from the temperature change, but works for any response function. Values of the response function
+    beyond its last element are taken to be zero.
+
+    For short time series the convolution is evaluated directly, for long time series (more than
+    fft_convolution_threshold years) and batches of time series it is evaluated using fast Fourier transforms, which scales
+    as O(n log n) instead of O(n^2).
+
+    :param signal: numpy.array -- the time series to convolve. Time is the last axis; any leading axes are treated as a batch.
+    :param response: numpy.array -- the response function. Time is the last axis; leading axes are broadcast against signal.
+    :param method: 'direct', 'fft' or 'auto' (default) which picks one of the two depending on the length of the time series.
+    :returns: numpy.array -- the convolved time series which has the same length as signal.
+    """
+    signal = np.asarray(signal, dtype=float)
+    response = np.asarray(response, dtype=float)
+    num_years = signal.shape[-1]
+
+    # only the first num_years values of the response function can contribute
+    if response.shape[-1] > num_years:
+        response = response[..., :num_years]
+    elif response.shape[-1] < num_years:
+        padding = [(0, 0)] * (response.ndim - 1) + [(0, num_years - response.shape[-1])]
+        response = np.pad(response, padding)
+
+    if method == 'auto':
+        # the direct convolution of a batch of time series loops over the years in python, so batches always use FFTs
+        batch = signal.ndim > 1 or response.ndim > 1
+        method = 'fft' if batch or num_years > fft_convolution_threshold else 'direct'
+
+    if method == 'direct':
+        if signal.ndim == 1 and response.ndim == 1:
+            return np.convolve(signal, response)[:num_years]
+        shape = np.broadcast(signal, response).shape
+        result = np.zeros(shape)
+        for lag in range(num_years):
+            result[..., lag:] += signal[..., :num_years - lag] * response[..., lag:lag + 1]
+        return result
+    elif method == 'fft':
+        # zero pad to avoid wrap around, a power of two keeps the transforms fast
+        fft_len = 1 << max(2 * num_years - 1, 1).bit_length()
+        spectrum = np.fft.rfft(signal, fft_len) * np.fft.rfft(response, fft_len)
+        return np.fft.irfft(spectrum, fft_len)[..., :num_years]
+    else:
+        raise SCMError('{} is not a valid convolution method'.format(method))
+
+
+def exponential_mode_filter(signal, modes, num_years=None):
+    """
+    This function convolves a time series with a response function which is a sum of exponentials, i.e.
+    response[k] = sum(amplitude * exp(-k / timescale)). Instead of evaluating the convolution, one running state per mode
+    ("exponential box") is advanced each year:
+
+        state[j] = exp(-1 / timescale) * state[j - 1] + signal[j]
+
+    and the result is the sum of the states weighted by their amplitudes. This makes the cost O(n) in the length of the time
+    series. If num_years is given, the response function is truncated after num_years years (as done by the response
+    functions passed to :func:`convolve_response`) by removing the input from num_years years ago from each state.
+
+    :param signal: numpy.array -- the time series to filter. Time is the last axis; any leading axes are treated as a batch.
+    :param modes: sequence of (amplitude, timescale [years]) pairs, e.g. temp_response_modes.
+    :param num_years: number of years after which the response function is truncated (default: no truncation).
+    :returns: numpy.array -- the filtered time series which has the same shape as signal.
+    """
+    signal = np.asarray(signal, dtype=float)
+    amplitudes, decay = _exponential_modes(modes, signal.ndim - 1)
+    if num_years is not None:
+        decay_truncated = decay ** num_years
+
+    state = np.zeros(decay.shape[:1] + signal.shape[:-1])
+    result = np.zeros(signal.shape)
+    for yr in range(signal.shape[-1]):
+        state = decay * state + signal[..., yr]
+        if num_years is not None and yr >= num_years:
+            state -= decay_truncated * signal[..., yr - num_years]
+        result[..., yr] = np.sum(amplitudes * state, axis=0)
+
+    return result
+
+
+def _exponential_modes(modes, batch_ndim):
     """
-    This function calculates the temperature change due to changes in radiative forcing.
+    This private function returns the amplitudes and annual decay factors of a response function given as (amplitude,
+    timescale) pairs, with the modes on the first axis, shaped to broadcast against batch_ndim batch axes.
+    """
+    mode_shape = (len(modes),) + (1,) * batch_ndim
+    amplitudes = np.array([amplitude for amplitude, timescale in modes]).reshape(mode_shape)
+    decay = np.exp(-1.0 / np.array([timescale for amplitude, timescale in modes])).reshape(mode_shape)
+
+    return amplitudes, decay
+
+
+def calc_delta_surf_temp(num_years, radForcing, method='auto', climate_sensitivity=default_climate_sensitivity):
+    """
+    This function calculates the temperature change due to changes in radiative forcing. The temperature change is linear
+    in the radiative forcing, its Green's function is given by :func:`impulse_response`.
     
     :param num_years: number of years the temperature response function will be evaluated for.
     :param radForcing: changes in radiative forcing due to changes in |CO2|, |CH4|, |N2O| concentrations and |SOx| emissions.
+    :param method: 'modes' to use :func:`exponential_mode_filter`, otherwise the convolution method, see :func:`convolve_response`.
+    :param climate_sensitivity: the equilibrium change in global mean surface temperature following a doubling of the
+        atmospheric equivalent CO2 concentration, default 1.1 (4.114/3.74). If this is a numpy.array, it is broadcast against
+        the scenario axes of radForcing (all axes but the last) to evaluate an ensemble.
     :return: numpy.array --containing the temperature change for every year.
     """
+    # add the time axis so that an ensemble of climate sensitivities broadcasts against the scenario axes
+    climate_sensitivity = np.asarray(climate_sensitivity, dtype=float)[..., np.newaxis]
 
-    # climate sensitivity := the equilibrium change in global mean surface temperature following a doubling of the atmospheric equivalent CO2 concentration
-    climate_sensitivity = 1.1  # (4.114/3.74)
-    result = np.zeros(len(radForcing))
-
-    def generate_temp_response_function(numYrs):
-        """
-        This function calculates the temperature response function that is used to calculate the change in global mean surface
-        temperature as a result of changes in radiative forcing.
-
-        :param numYrs: number of years the response function will be evaluates for.
-        :returns: numpy.array -- containing climate response function
-        """
-        # The values below were determined by fitting a double exponentional impulse response function model (see documentation) to values from a HadCM3 4xCO2 simulation.
-        result = np.array(
-            [(0.59557 / 8.4007) * np.exp(-i / 8.4007) + (0.40443 / 409.54) * np.exp(-i / 409.54) for i in
-             range(numYrs)])
-
-        return result
+    if method == 'modes':
+        return exponential_mode_filter(radForcing, temp_response_modes, num_years) * climate_sensitivity
 
     tempResFunc = generate_temp_response_function(num_years)
 
-    for i in range(len(radForcing)):
-        for j in range(i, len(radForcing)):
-            result[j] = result[j] + radForcing[i] * tempResFunc[j - i]
-
-    result = result * climate_sensitivity
+    result = convolve_response(radForcing, tempResFunc, method) * climate_sensitivity
 
     return result
 
 
-def calculate_slr(num_years, tempChange):
+def calculate_slr(num_years, tempChange, method='auto'):
     """
-    This function calculated the changes in sea level due to changes in global mean surface temperatures.
+    This function calculated the changes in sea level due to changes in global mean surface temperatures. The sea level
+    change is linear in the temperature change, its Green's function is given by :func:`impulse_response`.
     
     :param num_years: number of years the sea level response function will be evaluated for.
     :param tempChange: changes in global mean surface temperature due to changes in |CO2|, |CH4|, |N2O| concentrations and |SOx| emissions.
+    :param method: 'modes' to use :func:`exponential_mode_filter`, otherwise the convolution method, see :func:`convolve_response`.
     :return: numpy.array -- containing the sea level change for every year.
     """
-    result = np.zeros(len(tempChange))
 
-    def generate_slr_response(numYrs):
-        """
-        This function calculates the sea level response function that is used to calculate the change in sea level as a result of changes in in global mean surface temperature.
-        This equation only accounts for changes in sea level resulting from thermal expansion of the ocean, it does not include the effects of melting glaciers and melting grounded
-        ice sheets.
+    if method == 'modes':
+        return exponential_mode_filter(tempChange, slr_response_modes, num_years)
 
-        :param numYrs: number of years the response function will be evaluates for.
-        :returns: numpy.array -- containing climate response function
-        """
-        # The values below were determined by fitting a double exponentional impulse response function model (see documentation) to values from a HadCM3 4xCO2 simulation.
-        result = (
-            [(0.96677 / 1700.2) * np.exp(-i / 1700.2) + (0.03323 / 33.788) * np.exp(-i / 33.788) for i in
-             range(numYrs)])
+    seaLevelResFunc = generate_slr_response(num_years)
 
-        return np.array(result)
+    return convolve_response(tempChange, seaLevelResFunc, method)
 
-    seaLevelResFunc = generate_slr_response(num_years)
 
-    for i in range(len(tempChange)):
-        for j in range(i, len(tempChange)):
-            result[j] = result[j] + tempChange[i] * seaLevelResFunc[j - i]
+# -------------------------------------------------------------------------------
+# Impulse responses of the linear stages
+# -------------------------------------------------------------------------------
+def impulse_response(stage, length, num_years=None, method='auto'):
+    """
+    This function returns the Green's function of one of the linear stages of the model, i.e. its response to a unit input
+    in the first year:
+
+    - a gas of :data:`decay_species`, e.g. 'CH4': the change in concentration [ppb] per Tg of emissions, see
+      :func:`ch4_emis_to_concs` and :func:`n2o_emis_to_concs`
+    - 'temperature': the temperature change [degC] per W/m^2 of radiative forcing with a climate sensitivity of 1, see
+      :func:`calc_delta_surf_temp`
+    - 'sea level': the sea level change per degC of temperature change, see :func:`calculate_slr`
+
+    The stages are linear and time invariant, so their response to an input in year i is the Green's function shifted by i
+    years, see :func:`superpose_impulses`. The Green's functions are derived from the stages themselves and cached like the
+    response functions (see :func:`_cached_response`), so they are read-only.
+
+    :param stage: the name of the stage
+    :param length: number of years
+    :param num_years: number of years the response functions are evaluated for ('temperature' and 'sea level' only)
+    :param method: method of the temperature and sea level responses, see :func:`calc_delta_surf_temp`
+    :returns: numpy.array -- the Green's function
+    """
+    if stage in decay_species:
+        lifetime, scale = decay_species[stage]
+        return _cached_response(('impulse', stage, lifetime, scale), length,
+                                lambda numYrs: linear_decay_emis_to_concs(_unit_impulse(numYrs), lifetime, scale))
+    if stage == 'temperature':
+        return _cached_response(('impulse', stage, num_years, method), length,
+                                lambda numYrs: calc_delta_surf_temp(num_years, _unit_impulse(numYrs), method, 1.0))
+    if stage == 'sea level':
+        return _cached_response(('impulse', stage, num_years, method), length,
+                                lambda numYrs: calculate_slr(num_years, _unit_impulse(numYrs), method))
 
-    return result
+    raise SCMError('{} is not a linear stage of the model'.format(stage))
+
+
+def _unit_impulse(num_years):
+    """
+    This private function returns a time series of num_years years that is one in the first year and zero in all later
+    years, i.e. the input whose response is a Green's function (see :func:`impulse_response`). It is empty for zero years.
+    """
+    impulse = np.zeros(num_years)
+    impulse[:1] = 1.0
+    return impulse
+
+
+def superpose_impulses(base, kernel, years, amounts=1.0):
+    """
+    This function adds a Green's function (see :func:`impulse_response`), shifted to start in a given year and scaled, to a
+    time series. It is evaluated for many years at once, e.g. the concentrations after adding 1 Tg of |CH4| emissions in
+    each of the years 2000 to 2009 are given by
+
+    >>> superpose_impulses(ch4_concs, impulse_response('CH4', len(ch4_concs)), np.arange(250, 260))
+
+    :param base: numpy.array -- the time series, time being the last axis and any leading axes holding scenarios
+    :param kernel: numpy.array -- the Green's function. Leading axes are broadcast against those of base.
+    :param years: indices of the years the inputs are added in
+    :param amounts: sizes of the inputs, a number or one number for each year
+    :returns: numpy.array -- the time series with the responses added, with a leading axis with one entry for each year
+    """
+    base = np.asarray(base, dtype=float)
+    kernel = np.asarray(kernel, dtype=float)
+    years = np.asarray(years, dtype=int).reshape(-1)
+    batch_ndim = len(np.broadcast_shapes(base.shape[:-1], kernel.shape[:-1]))
+
+    # gather the Green's function at the lag of every year after each input
+    lags = np.arange(base.shape[-1]) - years[:, np.newaxis]
+    valid = (lags >= 0) & (lags < kernel.shape[-1])
+    shifted = np.moveaxis(np.take(kernel, np.clip(lags, 0, kernel.shape[-1] - 1), axis=-1), -2, 0)
+    shifted = shifted.reshape((len(years),) + (1,) * (batch_ndim + 1 - kernel.ndim) + shifted.shape[1:])
+    valid = valid.reshape((len(years),) + (1,) * batch_ndim + valid.shape[1:])
+    amounts = np.asarray(amounts, dtype=float)
+    if amounts.ndim:
+        amounts = amounts.reshape((-1,) + (1,) * (batch_ndim + 1))
+
+    return base + amounts * np.where(valid, shifted, 0.0)
+
+
+def perturb_emissions(results, species, years, amounts, num_years, method='auto',
+                      climate_sensitivity=default_climate_sensitivity):
+    """
+    This function evaluates the results of a model run after adding emissions in a single year, for many years at once, e.g.
+    to calculate the marginal damages of emissions in each year:
+
+    >>> results = pySCM.run_scenarios(co2, ch4, n2o, sox, 800, 75.0)
+    >>> perturbed = pySCM.scm.perturb_emissions(results, 'SOx', np.arange(351), 1.0, 800)
+    >>> marginal_temperature = perturbed.delta_temperature - results.delta_temperature
+
+    Instead of running the model again for every perturbation, the responses of the linear stages are superposed (see
+    :func:`superpose_impulses`). For |SOx| the radiative forcing is linear in the emissions, so the temperature and sea
+    level change are updated by adding their Green's functions. The radiative forcing of |CH4| and |N2O| is not linear in
+    their concentrations, so it is evaluated for the perturbed concentrations and the temperature and sea level change
+    caused by the change in forcing are added; the carbon cycle is not evaluated again. |CO2| emissions cannot be perturbed
+    this way because the carbon cycle is not linear.
+
+    :param results: SCMResults of the unperturbed run
+    :param species: 'CH4', 'N2O' or 'SOx'
+    :param years: indices of the years of the perturbations
+    :param amounts: emissions added in each year, a number or one number for each year
+    :param num_years: number of years the response functions are evaluated for
+    :param method: method of the temperature and sea level responses, see :func:`calc_delta_surf_temp`
+    :param climate_sensitivity: climate sensitivity of the run, see :func:`calc_delta_surf_temp`
+    :returns: SCMResults -- containing arrays with a leading axis with one entry for each perturbation
+    """
+    length = results.rf.shape[-1]
+    years = np.asarray(years, dtype=int).reshape(-1)
+    climate_sensitivity = np.asarray(climate_sensitivity, dtype=float)[..., np.newaxis]
+    co2_concs, ch4_concs, n2o_concs = [np.broadcast_to(concs, (len(years),) + np.shape(concs))
+                                       for concs in (results.co2_concs, results.ch4_concs, results.n2o_concs)]
+
+    if species == 'SOx':
+        # the forcing per Tg of SOx only acts in the year of the emissions
+        rf_per_tg = aerDirectFac + aerIndirectFac
+        rf = superpose_impulses(results.rf, rf_per_tg * _unit_impulse(length), years, amounts)
+        temperature_kernel = impulse_response('temperature', length, num_years, method) * climate_sensitivity * rf_per_tg
+        delta_temperature = superpose_impulses(results.delta_temperature, temperature_kernel, years, amounts)
+        slr_kernel = calculate_slr(num_years, temperature_kernel, method)
+        slr = superpose_impulses(results.slr, slr_kernel, years, amounts)
+    elif species in ('CH4', 'N2O'):
+        kernel = impulse_response(species, length)
+        if species == 'CH4':
+            ch4_concs = superpose_impulses(results.ch4_concs, kernel, years, amounts)
+        else:
+            n2o_concs = superpose_impulses(results.n2o_concs, kernel, years, amounts)
+        # the forcing of CO2 and SOx is not changed, so only that of CH4 and N2O (including their overlap) is evaluated
+        zeros = np.zeros(length)
+        rf_change = calculate_rf(zeros, zeros, ch4_concs, n2o_concs) - calculate_rf(zeros, zeros, results.ch4_concs,
+                                                                                     results.n2o_concs)
+        rf = results.rf + rf_change
+        # the temperature change may have more leading axes than the concentrations, e.g. for an ensemble of climate
+        # sensitivities, they are inserted after the axis of the perturbations
+        missing = np.ndim(results.delta_temperature) + 1 - rf_change.ndim
+        rf_change = rf_change.reshape(rf_change.shape[:1] + (1,) * max(missing, 0) + rf_change.shape[1:])
+        temperature_change = calc_delta_surf_temp(num_years, rf_change, method, climate_sensitivity[..., 0])
+        delta_temperature = results.delta_temperature + temperature_change
+        slr = results.slr + calculate_slr(num_years, temperature_change, method)
+    else:
+        raise SCMError('the emissions of {} cannot be perturbed, only those of CH4, N2O and SOx'.format(species))
+
+    return SCMResults(co2_concs, ch4_concs, n2o_concs, rf, delta_temperature, slr, results.start_year)
+
+
+# -------------------------------------------------------------------------------
+# Incremental model runs
+# -------------------------------------------------------------------------------
+# Stages of the model as (name, function, inputs) in the order they are evaluated. The inputs are the names of the
+# emissions and parameters of SCMGraph.run or of earlier stages that are passed to the function.
+model_stages = (
+    ('co2_concs', co2_emis_to_concs, ('co2_emis', 'num_years', 'OceanMLDepth', 'co2_method', 'air_sea_gas_exchange_coeff',
+                                      'biosphere_npp_0', 'co2_fert_factor')),
+    ('ch4_concs', ch4_emis_to_concs, ('ch4_emis',)),
+    ('n2o_concs', n2o_emis_to_concs, ('n2o_emis',)),
+    ('rf', calculate_rf, ('sox_emis', 'co2_concs', 'ch4_concs', 'n2o_concs')),
+    ('delta_temperature', calc_delta_surf_temp, ('num_years', 'rf', 'method', 'climate_sensitivity')),
+    ('slr', calculate_slr, ('num_years', 'delta_temperature', 'method')),
+)
+
+
+class SCMGraph:
+    """
+    This class runs the simple climate model as a graph of stages (see :data:`model_stages`) and keeps the result of every
+    stage, so that a run only evaluates the stages whose inputs changed since the previous run:
+
+    >>> graph = pySCM.SCMGraph(800, 75.0)
+    >>> results = graph.run(co2, ch4, n2o, sox)
+    >>> results = graph.run(co2, ch4, n2o, 1.1 * sox)
+    >>> graph.evaluated
+    ['rf', 'delta_temperature', 'slr']
+
+    E.g. changing the |N2O| emissions evaluates the |N2O| concentrations and the stages that depend on them but not the
+    carbon cycle. Changes are detected by the content of the emissions and parameters (see :func:`pySCM.cache.content_key`),
+    so arrays may also be modified in place between runs. The arrays of the results are read-only because they are reused
+    by later runs.
+    """
+
+    def __init__(self, num_years, OceanMLDepth, co2_method='modes', method='auto',
+                 climate_sensitivity=default_climate_sensitivity,
+                 air_sea_gas_exchange_coeff=default_air_sea_gas_exchange_coeff, biosphere_npp_0=default_biosphere_npp_0,
+                 co2_fert_factor=default_co2_fert_factor):
+        """
+        The parameters are those of :func:`run_scenarios`.
+        """
+        self.parameters = {'num_years': num_years, 'OceanMLDepth': OceanMLDepth, 'co2_method': co2_method,
+                           'method': method, 'climate_sensitivity': climate_sensitivity,
+                           'air_sea_gas_exchange_coeff': air_sea_gas_exchange_coeff, 'biosphere_npp_0': biosphere_npp_0,
+                           'co2_fert_factor': co2_fert_factor}
+        # names of the stages evaluated by the last run
+        self.evaluated = []
+        # key of the inputs and result of each stage of the last run
+        self._keys = {}
+        self._results = {}
+
+    def run(self, co2_emis, ch4_emis, n2o_emis, sox_emis, **parameters):
+        """
+        This function runs the model for the given emissions, see :func:`run_scenarios`.
+
+        :param parameters: parameters of __init__ to change for this and later runs, e.g. climate_sensitivity=1.2
+        :returns: SCMResults
+        """
+        from .cache import content_key
+
+        unknown = set(parameters) - set(self.parameters)
+        if unknown:
+            raise SCMError('unknown parameters {}'.format(', '.join(sorted(unknown))))
+        self.parameters.update(parameters)
+
+        values = dict(self.parameters, co2_emis=co2_emis, ch4_emis=ch4_emis, n2o_emis=n2o_emis, sox_emis=sox_emis)
+        for name in ('co2_emis', 'ch4_emis', 'n2o_emis', 'sox_emis'):
+            values[name] = np.asarray(values[name], dtype=float)
+        keys = {name: content_key(value) for name, value in values.items()}
+
+        self.evaluated = []
+        for name, function, inputs in model_stages:
+            # the key of a stage only depends on the keys of its inputs, so it changes if any earlier input changed
+            keys[name] = content_key(name, [keys[input_name] for input_name in inputs])
+            if self._keys.get(name) != keys[name]:
+                result = np.asarray(function(*[values[input_name] for input_name in inputs]))
+                result.flags.writeable = False
+                self._results[name] = result
+                self._keys[name] = keys[name]
+                self.evaluated.append(name)
+            values[name] = self._results[name]
+
+        return SCMResults(*[values[name] for name in _result_names])
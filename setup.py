@@ -25,12 +25,15 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Intended Audience :: Science/Research",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
     ],
+    python_requires=">=3.7",
     install_requires=[
         "matplotlib",
-        "numpy"
+        "numpy>=1.20"
     ],
     project_urls={
         "Bug Reports": "https://github.com/bodekerscientific/pyscm/issues",
@@ -39,6 +42,7 @@ setup(
     tests_require=["pytest", "pytest-cov", "codecov"],
     setup_requires=["pytest-runner"],
     extras_require={
+        "numba": ["numba"],
         "docs": ["sphinx >= 1.4", "sphinx_rtd_theme", "sphinx-autodoc-typehints"],
         "dev": [
             "setuptools>=38.6.0",
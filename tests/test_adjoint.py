@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from pySCM.adjoint import adjoint_model, solve_emission_scale, tangent_linear_model
+from pySCM.scm import SCMError, run_scenarios
+from .test_scm import make_scenarios
+
+SPECIES = ['CO2', 'CH4', 'N2O', 'SOx']
+
+
+@pytest.mark.parametrize('num_years', [2, 30, 800])
+@pytest.mark.parametrize('species', SPECIES)
+def test_tangent_linear_matches_finite_differences(species, num_years):
+    scenarios = make_scenarios(2, 100)
+    climate_sensitivity = np.array([[1.1], [0.8]])
+    direction = np.random.RandomState(1).normal(size=(2, 100))
+
+    results, tangent = tangent_linear_model(*scenarios, num_years, 75.0, {species: direction},
+                                            climate_sensitivity=climate_sensitivity)
+
+    np.testing.assert_array_equal(results.delta_temperature,
+                                  run_scenarios(*scenarios, num_years, 75.0,
+                                                climate_sensitivity=climate_sensitivity).delta_temperature)
+    step = 1e-5
+    index = SPECIES.index(species)
+    runs = []
+    for sign in (1, -1):
+        emissions = [series.copy() for series in scenarios]
+        emissions[index] += sign * step * direction
+        runs.append(run_scenarios(*emissions, num_years, 75.0, climate_sensitivity=climate_sensitivity))
+    for name in ('co2_concs', 'rf', 'delta_temperature', 'slr'):
+        difference = (getattr(runs[0], name) - getattr(runs[1], name)) / (2 * step)
+        np.testing.assert_allclose(getattr(tangent, name), difference, rtol=1e-6,
+                                   atol=1e-6 * np.max(np.abs(difference)))
+
+
+@pytest.mark.parametrize('num_years', [2, 30, 800])
+def test_adjoint_is_transpose_of_tangent_linear(num_years):
+    scenarios = make_scenarios(2, 100)
+    depth = np.array([[60.0], [90.0]])
+    rng = np.random.RandomState(2)
+    directions = {name: rng.normal(size=(2, 100)) for name in SPECIES}
+    temperature_weights, slr_weights = rng.normal(size=(2, 2, 100)), rng.normal(size=(2, 2, 100))
+
+    results, tangent = tangent_linear_model(*scenarios, num_years, depth, directions)
+    adjoint_results, gradients = adjoint_model(*scenarios, num_years, depth, temperature_weights, slr_weights)
+
+    np.testing.assert_array_equal(adjoint_results.slr, results.slr)
+    expected = np.sum(temperature_weights * tangent.delta_temperature + slr_weights * tangent.slr, axis=-1)
+    np.testing.assert_allclose(sum(np.sum(gradients[name] * directions[name], axis=-1) for name in SPECIES), expected,
+                               rtol=1e-10)
+
+
+def test_adjoint_jacobian():
+    co2, ch4, n2o, sox = [series[0] for series in make_scenarios(1, 60)]
+
+    # one row of weights for each year gives the Jacobian of the temperature change
+    results, gradients = adjoint_model(co2, ch4, n2o, sox, 800, 75.0, temperature_weights=np.eye(60))
+
+    for year in (0, 30, 59):
+        direction = np.zeros(60)
+        direction[year] = 1.0
+        results, tangent = tangent_linear_model(co2, ch4, n2o, sox, 800, 75.0, {'CO2': direction})
+        np.testing.assert_allclose(gradients['CO2'][:, year], tangent.delta_temperature, rtol=1e-10, atol=1e-18)
+    # emissions do not affect the temperature change of earlier years
+    np.testing.assert_allclose(np.triu(gradients['SOx'], 1), 0.0, atol=1e-15)
+
+    with pytest.raises(SCMError):
+        tangent_linear_model(co2, ch4, n2o, sox, 800, 75.0, {'HFC': co2})
+
+
+@pytest.mark.parametrize('year', [None, -1])
+def test_solve_emission_scale(year):
+    scenarios = make_scenarios(2, 100)
+    targets = np.array([[0.5], [1.0]])
+    scaled_years = np.arange(100) >= 40
+
+    scale, results = solve_emission_scale(*scenarios, 800, 75.0, targets, year, species=('CO2', 'CH4'), start=40,
+                                          tolerance=1e-8)
+
+    assert scale.shape == (2, 2)
+    emissions = [np.where(scaled_years, scale[..., np.newaxis] * series, series) if index < 2 else series
+                 for index, series in enumerate(scenarios)]
+    delta_temperature = run_scenarios(*emissions, 800, 75.0).delta_temperature
+    np.testing.assert_allclose(delta_temperature, results.delta_temperature, atol=1e-12)
+    value = np.max(delta_temperature, axis=-1) if year is None else delta_temperature[..., year]
+    np.testing.assert_allclose(value, np.broadcast_to(targets, (2, 2)), atol=1e-8)
+
+    # aerosols cool, so their emissions are scaled up to lower the temperature change
+    scale, results = solve_emission_scale(*scenarios, 800, 75.0, 0.9 * results.delta_temperature[..., -1], -1,
+                                          species=('SOx',), tolerance=1e-8)
+    assert np.all(scale > 1.0)
+
+    with pytest.raises(SCMError):
+        solve_emission_scale(*scenarios, 800, 75.0, 1.0, species=('CO2',), start=100)
+    with pytest.raises(SCMError):
+        solve_emission_scale(*scenarios, 800, 75.0, 1.0, species=('HFC',))
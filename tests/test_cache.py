@@ -0,0 +1,234 @@
+import os
+
+import numpy as np
+import pytest
+
+from pySCM import SCMError, SimpleClimateModel, read_emissions, run_scenarios, scm
+from pySCM.cache import DiskCache, MemoryCache, ResultCache, content_key
+
+from .test_interface import CONFIG_DIR, write_parameter_file
+from .test_scm import make_scenarios
+
+
+def test_disk_cache_round_trip(tmpdir):
+    cache = DiskCache(str(tmpdir.join('cache')))
+
+    assert cache.load('missing') is None
+    cache.save('entry', np.arange(6.0).reshape(2, 3))
+    np.testing.assert_array_equal(cache.load('entry'), [[0, 1, 2], [3, 4, 5]])
+
+
+def test_disk_cache_shared_between_users(tmpdir, monkeypatch):
+    directory = str(tmpdir.join('cache'))
+    cache = DiskCache(directory)
+
+    # entries get the default permissions, not the private ones of temporary files
+    umask = os.umask(0o022)
+    try:
+        cache.save('entry', np.zeros(3))
+    finally:
+        os.umask(umask)
+    assert os.stat(os.path.join(directory, 'entry.npy')).st_mode & 0o777 == 0o644
+
+    # entries that cannot be read (e.g. written by another user) are misses
+    def load(*args, **kwargs):
+        raise PermissionError('permission denied')
+
+    monkeypatch.setattr(np, 'load', load)
+    assert cache.load('entry') is None
+
+
+def test_disk_cache_size_of_replaced_entries(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    cache = DiskCache(directory, max_bytes=2000)
+
+    cache.save('a', np.zeros(100))
+    cache.save('a', np.zeros(100))
+    # replacing an entry does not count its old size
+    assert cache._total_bytes == os.path.getsize(os.path.join(directory, 'a.npy'))
+    cache.save('a', np.zeros(100))
+    cache.save('b', np.zeros(100))
+    assert cache.load('a') is not None
+
+
+def test_disk_cache_evicts_least_recently_used(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    # room for two entries of 100 doubles
+    cache = DiskCache(directory, max_bytes=2000)
+
+    cache.save('a', np.zeros(100))
+    cache.save('b', np.zeros(100))
+    os.utime(os.path.join(directory, 'a.npy'), ns=(1, 1))
+    os.utime(os.path.join(directory, 'b.npy'), ns=(2, 2))
+    cache.load('a')
+    cache.save('c', np.zeros(100))
+
+    assert cache.load('b') is None
+    assert cache.load('a') is not None
+    assert cache.load('c') is not None
+
+
+def test_disk_cache_file_key(tmpdir):
+    first = tmpdir.join('first.dat')
+    first.write('1 2 3')
+    second = tmpdir.join('second.dat')
+    second.write('1 2 3')
+
+    cache = DiskCache(str(tmpdir.join('cache')), key_mode='content')
+    assert cache.file_key(str(first), 1750, 2100) == cache.file_key(str(second), 1750, 2100)
+    assert cache.file_key(str(first), 1750, 2100) != cache.file_key(str(first), 1750, 2000)
+
+    cache = DiskCache(str(tmpdir.join('cache')))
+    key = cache.file_key(str(first))
+    first.write('1 2 3 4')
+    assert cache.file_key(str(first)) != key
+
+    with pytest.raises(SCMError):
+        DiskCache(str(tmpdir.join('cache')), key_mode='bogus')
+
+
+def test_read_emissions_cached(tmpdir, monkeypatch):
+    cache = DiskCache(str(tmpdir.join('cache')))
+    filename = os.path.join(CONFIG_DIR, 'EmissionsForSCM.dat')
+    expected = read_emissions(filename, 1750, 2100)
+
+    read_emissions(filename, 1750, 2100, cache)
+    # the second read must not parse the file
+    monkeypatch.setattr(np, 'loadtxt', None)
+    emissions = read_emissions(filename, 1750, 2100, cache)
+
+    for name in emissions.species:
+        np.testing.assert_array_equal(getattr(emissions, name), getattr(expected, name))
+    assert emissions.start_year == 1750
+
+
+def test_model_emissions_cache(tmpdir):
+    filename = write_parameter_file(tmpdir, **{'Emissions cache directory': str(tmpdir.join('cache'))})
+
+    first = SimpleClimateModel(filename)
+    second = SimpleClimateModel(filename)
+
+    assert len(tmpdir.join('cache').listdir()) == 1
+    np.testing.assert_array_equal(first.emissions.CO2, second.emissions.CO2)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_bytes=2000)
+
+    cache.put('a', np.zeros(100))
+    cache.put('b', np.zeros(100))
+    assert cache.get('a') is not None
+    cache.put('c', np.zeros(100))
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert len(cache) == 2
+    assert cache.nbytes == 1600
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # values larger than the cache are not stored
+    cache.put('d', np.zeros(1000))
+    assert cache.get('d') is None
+    assert len(cache) == 2
+
+    cache.clear()
+    assert (len(cache), cache.nbytes, cache.hits, cache.misses) == (0, 0, 0, 0)
+
+
+def test_content_key():
+    emissions = np.arange(12.0).reshape(3, 4)
+
+    assert content_key(emissions, 800, 75.0) == content_key(emissions.copy(), 800.0, np.float64(75.0))
+    # the key does not depend on the memory layout but on the shape, data type and values
+    assert content_key(np.asfortranarray(emissions)) == content_key(emissions)
+    assert content_key(emissions) != content_key(emissions.reshape(4, 3))
+    assert content_key(emissions) != content_key(emissions.astype(np.float32))
+    assert content_key(np.array(1.0)) != content_key(np.array([1.0]))
+    assert content_key(emissions, 'modes') != content_key(emissions, 'convolution')
+    assert content_key(('a', 'b'), 'c') != content_key('a', ('b', 'c'))
+    assert content_key({'CH4': 1.0, 'N2O': 2.0}) == content_key({'N2O': 2.0, 'CH4': 1.0})
+
+    with pytest.raises(SCMError):
+        content_key(object())
+
+
+def test_result_cache_tiers(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    arrays = {'co2_concs': np.arange(3.0), 'rf': np.ones(3)}
+
+    cache = ResultCache(directory=directory)
+    assert cache.get('key', ('co2_concs', 'rf')) is None
+    cache.put('key', arrays)
+    assert cache.get('key', ('co2_concs', 'rf'))['co2_concs'] is arrays['co2_concs']
+    assert not arrays['rf'].flags.writeable
+    assert (cache.hits, cache.disk_hits, cache.misses) == (1, 0, 1)
+
+    # another cache sharing the directory loads the entry from disk, then keeps it in memory
+    other = ResultCache(directory=directory)
+    for _ in range(2):
+        loaded = other.get('key', ('co2_concs', 'rf'))
+        np.testing.assert_array_equal(loaded['co2_concs'], arrays['co2_concs'])
+        assert not loaded['co2_concs'].flags.writeable
+    assert (other.hits, other.disk_hits, other.misses) == (2, 1, 0)
+
+    # entries of which an array has been evicted are misses
+    os.remove(os.path.join(directory, 'key-rf.npy'))
+    assert ResultCache(directory=directory).get('key', ('co2_concs', 'rf')) is None
+
+    cache.clear()
+    assert (len(cache.memory), cache.hits, cache.misses) == (0, 0, 0)
+    assert not os.listdir(directory)
+
+
+def test_run_scenarios_cached():
+    co2, ch4, n2o, sox = make_scenarios(3, 200)
+    expected = run_scenarios(co2, ch4, n2o, sox, 800, 75.0)
+
+    cache = ResultCache()
+    first = run_scenarios(co2, ch4, n2o, sox, 800, 75.0, cache=cache)
+    second = run_scenarios(co2.copy(), ch4, n2o, sox, 800.0, 75.0, cache=cache)
+    assert second.delta_temperature is first.delta_temperature
+    np.testing.assert_array_equal(first.delta_temperature, expected.delta_temperature)
+    np.testing.assert_array_equal(second.co2_concs, expected.co2_concs)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # any change of the emissions or parameters is a new entry
+    run_scenarios(co2, ch4, n2o, sox * 1.01, 800, 75.0, cache=cache)
+    run_scenarios(co2, ch4, n2o, sox, 800, 75.0, climate_sensitivity=1.2, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_result_cache_keyed_on_source(monkeypatch):
+    co2, ch4, n2o, sox = make_scenarios(2, 50)
+    assert scm._source_key() == scm._source_key()
+
+    cache = ResultCache()
+    run_scenarios(co2, ch4, n2o, sox, 800, 75.0, cache=cache)
+    # results of a different version of the code are not reused
+    monkeypatch.setattr(scm, '_source_digest', 'changed')
+    run_scenarios(co2, ch4, n2o, sox, 800, 75.0, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_model_result_cache(tmpdir):
+    expected = SimpleClimateModel(write_parameter_file(tmpdir)).run_model(in_memory=True)
+
+    filename = write_parameter_file(tmpdir, **{'Result cache directory': str(tmpdir.join('cache'))})
+    first = SimpleClimateModel(filename)
+    first.run_model(in_memory=True)
+    first.run_model(in_memory=True)
+    assert (first.result_cache.hits, first.result_cache.misses) == (1, 1)
+
+    # a second model evaluated with the same emissions and parameters, e.g. in another job, loads the results from disk
+    second = SimpleClimateModel(filename)
+    results = second.run_model(in_memory=True)
+    assert second.result_cache.disk_hits == 1
+    assert results.start_year == 1750
+    for name in ('co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr'):
+        np.testing.assert_array_equal(getattr(results, name), getattr(expected, name))
+
+    # an explicitly given cache takes precedence
+    cache = ResultCache()
+    second.run_model(in_memory=True, cache=cache)
+    assert cache.misses == 1
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from pySCM import scm
+from pySCM.checkpoint import checkpoint_version, load_checkpoint, save_checkpoint
+from pySCM.scm import SCMError, SCMStepper, run_from_state, spin_up
+from .test_scm import make_scenarios
+
+RESULTS = ['co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr']
+
+
+def run_steps(stepper, scenarios, years):
+    steps = [stepper.step(*[series[:, year] for series in scenarios]) for year in years]
+    return {name: np.stack([getattr(results, name) for results in steps], axis=-1) for name in RESULTS}
+
+
+@pytest.mark.parametrize('num_years', [30, 800])
+def test_resumed_stepper_is_bit_identical(tmpdir, num_years):
+    scenarios = make_scenarios(3, 90)
+    uninterrupted = run_steps(SCMStepper(num_years, np.array([[60.0], [75.0]]), climate_sensitivity=0.9), scenarios,
+                              range(90))
+
+    stepper = SCMStepper(num_years, np.array([[60.0], [75.0]]), climate_sensitivity=0.9)
+    first = run_steps(stepper, scenarios, range(45))
+    filename = str(tmpdir.join('run.npz'))
+    save_checkpoint(stepper, filename)
+    del stepper
+    resumed = load_checkpoint(filename)
+    assert isinstance(resumed, SCMStepper)
+    assert resumed.year == 45
+    second = run_steps(resumed, scenarios, range(45, 90))
+
+    for name in RESULTS:
+        np.testing.assert_array_equal(np.concatenate([first[name], second[name]], axis=-1), uninterrupted[name])
+
+
+def test_checkpoint_class_names(tmpdir):
+    stepper = SCMStepper(30, 75.0)
+    run_steps(stepper, make_scenarios(1, 2), range(2))
+    filename = str(tmpdir.join('run.npz'))
+
+    # private classes are stored under stable names, so that renaming them does not change the checkpoint format
+    scm._CarbonCycleModes.__name__ = 'RenamedModes'
+    try:
+        save_checkpoint(stepper, filename)
+    finally:
+        scm._CarbonCycleModes.__name__ = '_CarbonCycleModes'
+    with np.load(filename) as data:
+        manifest = str(data['manifest'])
+
+    assert '"class": "CarbonCycleModes"' in manifest
+    assert 'RenamedModes' not in manifest
+    assert isinstance(load_checkpoint(filename)._modes, scm._CarbonCycleModes)
+
+
+def test_state_checkpoint(tmpdir):
+    co2, ch4, n2o, sox = make_scenarios(2, 80)
+    state = spin_up(co2[0, :50], ch4[0, :50], n2o[0, :50], sox[0, :50], 40, 75.0, climate_sensitivity=np.array([1.1, 0.8]))
+    filename = str(tmpdir.join('state.npz'))
+    save_checkpoint(state, filename)
+    restored = load_checkpoint(filename)
+
+    assert restored.parameters['method'] == 'auto'
+    expected = run_from_state(state, co2[:, np.newaxis, 50:], ch4[:, np.newaxis, 50:], n2o[:, np.newaxis, 50:],
+                              sox[:, np.newaxis, 50:])
+    actual = run_from_state(restored, co2[:, np.newaxis, 50:], ch4[:, np.newaxis, 50:], n2o[:, np.newaxis, 50:],
+                            sox[:, np.newaxis, 50:])
+    for name in RESULTS:
+        np.testing.assert_array_equal(getattr(actual, name), getattr(expected, name))
+        np.testing.assert_array_equal(getattr(restored.results, name), getattr(state.results, name))
+
+
+def test_invalid_checkpoints(tmpdir):
+    filename = str(tmpdir.join('other.npz'))
+    np.savez(filename, values=np.zeros(3))
+    with pytest.raises(SCMError):
+        load_checkpoint(filename)
+
+    save_checkpoint(SCMStepper(30, 75.0), filename)
+    with np.load(filename) as data:
+        arrays = dict(data)
+    arrays['manifest'] = np.array(str(arrays['manifest']).replace('"version": {}'.format(checkpoint_version),
+                                                                  '"version": {}'.format(checkpoint_version + 1)))
+    np.savez(filename, **arrays)
+    with pytest.raises(SCMError):
+        load_checkpoint(filename)
+
+    with pytest.raises(SCMError):
+        save_checkpoint(object(), filename)
@@ -0,0 +1,88 @@
+import json
+import os
+import subprocess
+import sys
+
+# Importing pySCM must stay cheap as workers are often short-lived. Rather than an absolute limit on the import time, which
+# is unreliable on shared machines, check that it loads none of the heavy optional dependencies and does not spawn processes
+# (e.g. git), and compare the time spent in pySCM's own modules with the time of importing numpy in the same process.
+SCRIPT = '''
+import json, subprocess, sys
+
+spawned = []
+original_popen = subprocess.Popen.__init__
+
+
+def popen(self, *args, **kwargs):
+    spawned.append(args[0] if args else kwargs.get('args'))
+    original_popen(self, *args, **kwargs)
+
+
+subprocess.Popen.__init__ = popen
+import pySCM
+print(json.dumps({'spawned': spawned,
+                  'modules': sorted(name for name in sys.modules if name.split('.')[0] in ('matplotlib', 'numba', 'scipy'))}))
+'''
+
+
+def run_import():
+    root = os.path.join(os.path.dirname(__file__), '..')
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=root)
+    return json.loads(output.decode())
+
+
+def test_import_does_not_load_plotting_or_numba_or_spawn_processes():
+    result = run_import()
+
+    assert result['modules'] == []
+    assert result['spawned'] == []
+
+
+def import_times():
+    """
+    This function returns the self times [us] of all modules imported by pySCM and the cumulative time [us] of numpy as
+    reported by python -X importtime.
+    """
+    root = os.path.join(os.path.dirname(__file__), '..')
+    # import once so that the timed import does not include writing the bytecode cache
+    subprocess.check_call([sys.executable, '-c', 'import pySCM'], cwd=root)
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import pySCM'], cwd=root, check=True,
+                            stderr=subprocess.PIPE).stderr.decode()
+
+    self_times = {}
+    numpy_time = None
+    for line in output.splitlines():
+        fields = [field.strip() for field in line.split(':', 1)[-1].split('|')]
+        if len(fields) != 3 or not fields[0].isdigit():
+            continue
+        if fields[2].split('.')[0] == 'pySCM':
+            self_times[fields[2]] = int(fields[0])
+        elif fields[2] == 'numpy':
+            numpy_time = int(fields[1])
+
+    return self_times, numpy_time
+
+
+def test_import_time():
+    self_times, numpy_time = import_times()
+
+    assert 'pySCM.scm' in self_times
+    # pySCM's own modules only define functions and classes; this is a small fraction of importing numpy
+    assert sum(self_times.values()) < numpy_time / 2
+
+
+def test_static_version(monkeypatch):
+    import pySCM
+    from pySCM import _version
+
+    def get_versions():
+        raise AssertionError('the static version must be read without versioneer')
+
+    # a built package contains the version_json written by versioneer
+    # (setting the attribute first makes monkeypatch restore the state from before the test afterwards)
+    monkeypatch.setattr(pySCM, '__version__', None, raising=False)
+    monkeypatch.delattr(pySCM, '__version__')
+    monkeypatch.setattr(_version, 'version_json', '{"version": "1.2.3"}', raising=False)
+    monkeypatch.setattr(_version, 'get_versions', get_versions)
+
+    assert pySCM.__version__ == '1.2.3'
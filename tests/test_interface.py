@@ -1,2 +1,170 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from pySCM import EmissionSeries, SCMError, SimpleClimateModel, read_emissions, read_emissions_batch
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), '..', 'config')
+
+
+def write_parameter_file(tmpdir, **overrides):
+    parameters = {
+        'Start year': '1750',
+        'End year': '2100',
+        'File of emissions data': os.path.join(CONFIG_DIR, 'EmissionsForSCM.dat'),
+        'Ocean mixed layer depth [in meters]': '75.0',
+        'Years to evaluate response functions': '800',
+        'Filename for temperature change': str(tmpdir.join('TempChange.dat')),
+        'Plot temperature change': '',
+        'Filename for sea level change': str(tmpdir.join('SeaLevelChange.dat')),
+        'Plot sea level change': '',
+    }
+    parameters.update(overrides)
+    filename = tmpdir.join('SimpleClimateModelParameterFile.txt')
+    filename.write(''.join('{}={}\n'.format(key, value) for key, value in parameters.items()))
+    return str(filename)
+
+
 def test_basic():
-    pass
\ No newline at end of file
+    pass
+
+
+def test_read_emissions(tmpdir):
+    scm = SimpleClimateModel(write_parameter_file(tmpdir))
+
+    assert isinstance(scm.emissions, EmissionSeries)
+    assert len(scm.emissions) == 351
+    assert scm.emissions.start_year == 1750
+    # 1890 is given in the emissions file, 1895 is interpolated
+    assert scm.emissions[140].CO2 == 0.689
+    np.testing.assert_allclose(scm.emissions[145].CO2, (0.689 + 0.921) / 2)
+
+
+def test_read_emissions_example_without_warning(tmpdir):
+    # the example emissions file covers the start year, so the default model is not anchored to zero with a warning
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        SimpleClimateModel(write_parameter_file(tmpdir))
+
+    assert not caught
+
+
+def write_emissions_file(tmpdir, name, rows):
+    filename = tmpdir.join(name)
+    filename.write('5 45\n\'header\n\'Year CO2 CH4 N2O SOx\n' + ''.join(' '.join(map(str, row)) + '\n' for row in rows))
+    return str(filename)
+
+
+def test_read_emissions_interpolation(tmpdir):
+    # no value for the start year: interpolate from zero
+    with pytest.warns(UserWarning, match='start year 2000'):
+        emissions = read_emissions(write_emissions_file(tmpdir, 'a.dat', [(2004, 4, 8, 12, 16)]), 2000, 2006)
+    np.testing.assert_allclose(emissions.CO2, [0, 1, 2, 3, 4, 4, 4])
+    np.testing.assert_allclose(emissions.SOx, [0, 4, 8, 12, 16, 16, 16])
+
+    # value for the start year and rows outside of the simulation period
+    rows = [(1990, 9, 9, 9, 9), (2000, 1, 2, 3, 4), (2002, 3, 4, 5, 6), (2010, 9, 9, 9, 9)]
+    emissions = read_emissions(write_emissions_file(tmpdir, 'b.dat', rows), 2000, 2003)
+    np.testing.assert_allclose(emissions.CO2, [1, 2, 3, 3])
+    np.testing.assert_allclose(emissions.N2O, [3, 4, 5, 5])
+
+
+def test_read_emissions_missing_columns(tmpdir):
+    filename = tmpdir.join('short.dat')
+    filename.write('5 45\n\'header\n\'Year CO2 CH4\n2000 1 2\n2001 3 4\n')
+
+    with pytest.raises(SCMError, match='N2O, SOx columns'):
+        read_emissions(str(filename), 2000, 2001)
+
+
+def test_read_emissions_batch(tmpdir):
+    filenames = [write_emissions_file(tmpdir, 'a.dat', [(2002, 2, 2, 2, 2)]),
+                 write_emissions_file(tmpdir, 'b.dat', [(2000, 1, 1, 1, 1), (2003, 4, 4, 4, 4)])]
+
+    emissions = read_emissions_batch(filenames, 2000, 2003)
+    assert emissions.shape == (2, 4)
+    np.testing.assert_allclose(emissions.CH4, [[0, 1, 2, 2], [1, 2, 3, 4]])
+
+
+def test_run_model_in_memory(tmpdir):
+    # no output filenames are needed in memory mode
+    filename = write_parameter_file(tmpdir, **{'Filename for temperature change': '',
+                                               'Filename for sea level change': ''})
+    scm = SimpleClimateModel(filename)
+
+    results = scm.run_model(in_memory=True)
+
+    assert tmpdir.listdir() == [tmpdir.join('SimpleClimateModelParameterFile.txt')]
+    assert results.start_year == 1750
+    for name in ('co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr'):
+        assert getattr(results, name).shape == (351,)
+    assert results.delta_temperature is scm.delta_temperature
+
+
+def test_run_model_writes_output(tmpdir):
+    scm = SimpleClimateModel(write_parameter_file(tmpdir))
+
+    rf = scm.run_model(rf_flag=True)
+
+    np.testing.assert_array_equal(rf, scm.rf)
+    temperature = np.loadtxt(str(tmpdir.join('TempChange.dat')), skiprows=1)
+    np.testing.assert_allclose(temperature[:, 1], scm.delta_temperature)
+    assert tmpdir.join('SeaLevelChange.dat').check()
+
+
+def test_run_model_incremental(tmpdir):
+    scm = SimpleClimateModel(write_parameter_file(tmpdir))
+    first = scm.run_model(in_memory=True)
+    # the results can be modified without affecting the stages kept by the graph
+    scm.delta_temperature -= 1.0
+    first.co2_concs[:] = 0.0
+
+    # changing the SOx emissions of some years does not re-evaluate the concentrations
+    scm.emissions[200].SOx += 10.0
+    results = scm.run_model(in_memory=True)
+
+    assert scm.graph.evaluated == ['rf', 'delta_temperature', 'slr']
+    expected = SimpleClimateModel.from_parameters({'Start year': 1750, 'End year': 2100}, scm.emissions)
+    expected = expected.run_model(in_memory=True)
+    np.testing.assert_array_equal(results.slr, expected.slr)
+    np.testing.assert_array_equal(results.co2_concs, expected.co2_concs)
+
+
+def test_from_parameters(tmpdir):
+    reference = SimpleClimateModel(write_parameter_file(tmpdir)).run_model(in_memory=True)
+    emissions = read_emissions(os.path.join(CONFIG_DIR, 'EmissionsForSCM.dat'), 1750, 2100)
+
+    data = np.array([emissions.CO2, emissions.CH4, emissions.N2O, emissions.SOx])
+    scm = SimpleClimateModel.from_parameters({'Start year': 1750, 'End year': 2100}, memoryview(data))
+    # the emissions are not copied
+    assert np.shares_memory(scm.emissions.CO2, data)
+    np.testing.assert_array_equal(scm.run_model(in_memory=True).delta_temperature, reference.delta_temperature)
+
+    arrays = {name: getattr(emissions, name) for name in emissions.species}
+    scm = SimpleClimateModel.from_parameters({'Start year': '1750', 'End year': '2100'}, arrays)
+    assert scm.emissions.CH4 is emissions.CH4
+    np.testing.assert_array_equal(scm.run_model(in_memory=True).slr, reference.slr)
+
+
+def test_from_parameters_reads_emissions_file():
+    scm = SimpleClimateModel.from_parameters({'Start year': 1750, 'End year': 2100,
+                                              'File of emissions data': os.path.join(CONFIG_DIR, 'EmissionsForSCM.dat')})
+    assert len(scm.emissions) == 351
+
+
+def test_from_parameters_invalid_emissions():
+    with pytest.raises(SCMError):
+        SimpleClimateModel.from_parameters({'Start year': 2000, 'End year': 2010}, np.zeros((4, 5)))
+    with pytest.raises(SCMError):
+        SimpleClimateModel.from_parameters({'Start year': 2000, 'End year': 2004}, np.zeros((3, 5)))
+
+
+def test_plot(tmpdir):
+    scm = SimpleClimateModel(write_parameter_file(tmpdir))
+    scm.run_model(in_memory=True)
+
+    scm.plot('CO2', str(tmpdir.join('CO2Concs.png')))
+
+    assert tmpdir.join('CO2Concs.png').check()
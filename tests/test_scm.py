@@ -0,0 +1,623 @@
+import math
+
+import numpy as np
+import pytest
+
+from pySCM import scm
+from pySCM.scm import (EmissionRec, EmissionSeries, PgCperppm, SCMError, SCMGraph, SCMStepper, calc_delta_surf_temp,
+                       calculate_rf, calculate_slr, ch4_emis_to_concs, ch4_n2o_overlap, co2_emis_to_concs,
+                       co2_emis_to_concs_modes, convolve_response, delta_co2_from_ocean, diagnose_emissions,
+                       exponential_mode_filter, generate_biosphere_response, generate_ocean_response,
+                       generate_slr_response, generate_temp_response_function, impulse_response,
+                       linear_decay_emis_to_concs, n2o_emis_to_concs, perturb_emissions, register_decay_species,
+                       response_function_cache, run_concentrations, run_from_state, run_scenario_tree, run_scenarios,
+                       set_kernel_backend, slr_response_modes, species_emis_to_concs, spin_up, superpose_impulses,
+                       temp_response_modes)
+
+
+def reference_convolution(signal, response):
+    # the double loop originally used by calc_delta_surf_temp and calculate_slr
+    result = np.zeros(len(signal))
+    for i in range(len(signal)):
+        for j in range(i, len(signal)):
+            result[j] = result[j] + signal[i] * response[j - i]
+    return result
+
+
+@pytest.mark.parametrize('method', ['auto', 'direct', 'fft'])
+@pytest.mark.parametrize('num_years', [1, 10, 351, 700])
+def test_convolve_response_matches_loop(method, num_years):
+    rng = np.random.RandomState(0)
+    signal = rng.normal(size=num_years)
+    response = rng.uniform(size=num_years + 5)
+
+    np.testing.assert_allclose(convolve_response(signal, response, method),
+                               reference_convolution(signal, response), rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('method', ['direct', 'fft'])
+def test_convolve_response_batch(method):
+    rng = np.random.RandomState(1)
+    signal = rng.normal(size=(3, 50))
+    response = rng.uniform(size=50)
+
+    result = convolve_response(signal, response, method)
+    assert result.shape == (3, 50)
+    for row in range(3):
+        np.testing.assert_allclose(result[row], reference_convolution(signal[row], response), atol=1e-12)
+
+
+def test_convolve_response_short_kernel():
+    signal = np.ones(10)
+    response = np.array([1.0, 0.5])
+
+    np.testing.assert_allclose(convolve_response(signal, response), [1.0] + [1.5] * 9)
+
+
+def test_convolve_response_invalid_method():
+    with pytest.raises(SCMError):
+        convolve_response(np.ones(3), np.ones(3), 'bogus')
+
+
+def test_temperature_and_sea_level_methods_agree():
+    forcing = np.linspace(0.0, 4.0, 600)
+
+    temp_direct = calc_delta_surf_temp(800, forcing, method='direct')
+    temp_fft = calc_delta_surf_temp(800, forcing, method='fft')
+    np.testing.assert_allclose(temp_fft, temp_direct, rtol=1e-10, atol=1e-12)
+
+    np.testing.assert_allclose(calculate_slr(800, temp_fft, method='fft'),
+                               calculate_slr(800, temp_direct, method='direct'), rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('num_years', [800, 100])
+def test_exponential_modes_match_convolution(num_years):
+    rng = np.random.RandomState(2)
+    forcing = np.cumsum(rng.normal(scale=0.05, size=351))
+
+    temp = calc_delta_surf_temp(num_years, forcing, method='direct')
+    np.testing.assert_allclose(calc_delta_surf_temp(num_years, forcing, method='modes'), temp, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(calculate_slr(num_years, temp, method='modes'),
+                               calculate_slr(num_years, temp, method='direct'), rtol=1e-10, atol=1e-12)
+
+
+def test_exponential_mode_filter_batch():
+    rng = np.random.RandomState(3)
+    signal = rng.normal(size=(4, 120))
+
+    result = exponential_mode_filter(signal, temp_response_modes, 50)
+    for row in range(4):
+        np.testing.assert_allclose(result[row], exponential_mode_filter(signal[row], temp_response_modes, 50))
+    kernel = [sum(a * np.exp(-k / tau) for a, tau in slr_response_modes) for k in range(120)]
+    np.testing.assert_allclose(exponential_mode_filter(signal, slr_response_modes), convolve_response(signal, kernel),
+                               atol=1e-12)
+
+
+def reference_co2_concs(co2_emis, num_years, ocean_ml_depth):
+    # the loop of co2_emis_to_concs with the response functions truncated after num_years years
+    ocean_response = generate_ocean_response(num_years, ocean_ml_depth)
+    bio_response = generate_biosphere_response(num_years)
+    n = len(co2_emis)
+    x_atmos_bio = 0.0
+    atmos_co2 = np.zeros(n)
+    atmos_bio_flux = np.zeros(n)
+    surface_ocean_dic = np.zeros(n)
+    for yr_ind in range(n - 1):
+        sea_water_pco2 = delta_co2_from_ocean(surface_ocean_dic[yr_ind])
+        atmos_sea_flux = 0.1042 * (atmos_co2[yr_ind] - sea_water_pco2)
+        x_atmos_bio = 60.0 * 0.287 * np.log(1.0 + atmos_co2[yr_ind] / 278.305) / PgCperppm
+        atmos_bio_flux[yr_ind] += x_atmos_bio
+        for j in range(yr_ind + 1, min(n, yr_ind + num_years)):
+            surface_ocean_dic[j] += atmos_sea_flux * ocean_response[j - yr_ind]
+            atmos_bio_flux[j] -= x_atmos_bio * bio_response[j - yr_ind]
+        atmos_co2[yr_ind + 1] = atmos_co2[yr_ind] + co2_emis[yr_ind] / PgCperppm - atmos_sea_flux - atmos_bio_flux[yr_ind]
+    return atmos_co2
+
+
+def test_co2_modes_match_convolution():
+    emissions = []
+    for co2 in np.linspace(0.0, 20.0, 351):
+        rec = EmissionRec()
+        rec.CO2 = co2
+        emissions.append(rec)
+
+    np.testing.assert_allclose(co2_emis_to_concs(emissions, 800, 75.0, method='modes'),
+                               co2_emis_to_concs(emissions, 800, 75.0), rtol=1e-10)
+
+
+@pytest.mark.parametrize('num_years', [2, 3, 60, 400])
+def test_co2_modes_truncated_response(num_years):
+    co2_emis = np.linspace(0.0, 10.0, 300)
+
+    reference = reference_co2_concs(co2_emis, num_years, 75.0)
+    np.testing.assert_allclose(co2_emis_to_concs_modes(co2_emis, num_years, 75.0, 0.1042, 60.0, 0.287, 278.305),
+                               reference, rtol=1e-10)
+    np.testing.assert_allclose(co2_emis_to_concs(co2_emis, num_years, 75.0), reference, rtol=1e-10)
+
+
+def test_co2_invalid_method():
+    with pytest.raises(SCMError):
+        co2_emis_to_concs([], 800, 75.0, method='bogus')
+
+
+def make_scenarios(num_scenarios, num_years):
+    rng = np.random.RandomState(4)
+    ramp = np.linspace(0.0, 1.0, num_years)
+    scale = rng.uniform(0.5, 1.5, size=(num_scenarios, 1))
+    return 10.0 * ramp * scale, 300.0 * ramp * scale, 10.0 * ramp * scale, 60.0 * ramp * scale
+
+
+def test_run_scenarios_matches_single_runs():
+    co2, ch4, n2o, sox = make_scenarios(3, 200)
+
+    results = run_scenarios(co2, ch4, n2o, sox, 800, 75.0)
+    assert results.delta_temperature.shape == (3, 200)
+    for row in range(3):
+        emissions = []
+        for year in range(200):
+            rec = EmissionRec()
+            rec.CO2, rec.CH4, rec.N2O, rec.SOx = co2[row, year], ch4[row, year], n2o[row, year], sox[row, year]
+            emissions.append(rec)
+        co2_concs = co2_emis_to_concs(emissions, 800, 75.0)
+        ch4_concs = ch4_emis_to_concs(emissions)
+        n2o_concs = n2o_emis_to_concs(emissions)
+        rf = calculate_rf(emissions, co2_concs, ch4_concs, n2o_concs)
+        temp = calc_delta_surf_temp(800, rf)
+
+        np.testing.assert_allclose(results.co2_concs[row], co2_concs, rtol=1e-10)
+        np.testing.assert_allclose(results.ch4_concs[row], ch4_concs, rtol=1e-12)
+        np.testing.assert_allclose(results.n2o_concs[row], n2o_concs, rtol=1e-12)
+        np.testing.assert_allclose(results.rf[row], rf, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(results.delta_temperature[row], temp, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(results.slr[row], calculate_slr(800, temp), rtol=1e-10, atol=1e-12)
+
+
+def test_run_concentrations_matches_emission_driven_run():
+    co2, ch4, n2o, sox = make_scenarios(3, 200)
+    climate_sensitivity = np.array([[1.1], [0.8]])
+    results = run_scenarios(co2, ch4, n2o, sox, 800, 75.0, climate_sensitivity=climate_sensitivity)
+
+    concs_results = run_concentrations(results.co2_concs, results.ch4_concs, results.n2o_concs, sox, 800,
+                                       climate_sensitivity=climate_sensitivity)
+
+    for name in ('co2_concs', 'rf', 'delta_temperature', 'slr'):
+        np.testing.assert_array_equal(getattr(concs_results, name), getattr(results, name))
+    assert concs_results.delta_temperature.shape == (2, 3, 200)
+
+
+@pytest.mark.parametrize('num_years', [2, 30, 800])
+def test_diagnose_emissions_inverts_concentrations(num_years):
+    co2, ch4, n2o, sox = make_scenarios(3, 200)
+    depth = np.array([[60.0], [90.0]])
+    results = run_scenarios(co2, ch4, n2o, sox, num_years, depth)
+
+    emissions = diagnose_emissions(results.co2_concs, results.ch4_concs, results.n2o_concs, num_years, depth, sox)
+
+    assert emissions.CO2.shape == emissions.SOx.shape == (2, 3, 200)
+    # the emissions of the last year do not affect the concentrations
+    for diagnosed, original in ((emissions.CO2, co2), (emissions.CH4, ch4), (emissions.N2O, n2o)):
+        np.testing.assert_allclose(diagnosed[..., :-1], np.broadcast_to(original, (2, 3, 200))[..., :-1], rtol=1e-9,
+                                   atol=1e-9)
+    rerun = run_scenarios(emissions.CO2, emissions.CH4, emissions.N2O, emissions.SOx, num_years, depth)
+    np.testing.assert_allclose(rerun.co2_concs, results.co2_concs, rtol=1e-12)
+    np.testing.assert_allclose(rerun.delta_temperature, results.delta_temperature, rtol=1e-12, atol=1e-14)
+
+    with pytest.raises(SCMError):
+        diagnose_emissions(results.co2_concs[..., :1], results.ch4_concs[..., :1], results.n2o_concs[..., :1],
+                           num_years, depth)
+
+
+def test_co2_convolution_batch():
+    co2 = make_scenarios(2, 120)[0]
+
+    result = co2_emis_to_concs(co2, 800, 75.0)
+    for row in range(2):
+        np.testing.assert_array_equal(result[row], co2_emis_to_concs(co2[row], 800, 75.0))
+
+
+@pytest.mark.parametrize('method', ['convolution', 'modes'])
+def test_co2_parameter_ensemble(method):
+    co2 = make_scenarios(1, 150)[0][0]
+    depth = np.array([50.0, 75.0, 100.0])
+    fert = np.array([0.287, 0.38, 0.2])
+
+    result = co2_emis_to_concs(co2, 800, depth, method, co2_fert_factor=fert)
+    assert result.shape == (3, 150)
+    for member in range(3):
+        np.testing.assert_allclose(result[member],
+                                   co2_emis_to_concs(co2, 800, depth[member], method, co2_fert_factor=fert[member]),
+                                   rtol=1e-12)
+
+
+def test_run_scenarios_parameter_ensemble():
+    co2, ch4, n2o, sox = make_scenarios(2, 100)
+    sensitivity = np.array([[0.8], [1.1], [1.5]])
+
+    results = run_scenarios(co2, ch4, n2o, sox, 800, 75.0, climate_sensitivity=sensitivity,
+                            biosphere_npp_0=np.array([[50.0], [60.0], [70.0]]))
+    assert results.delta_temperature.shape == (3, 2, 100)
+    single = run_scenarios(co2, ch4, n2o, sox, 800, 75.0, climate_sensitivity=0.8, biosphere_npp_0=50.0)
+    np.testing.assert_allclose(results.delta_temperature[0], single.delta_temperature, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(results.slr[0], single.slr, rtol=1e-10, atol=1e-12)
+
+
+def test_emission_series_records():
+    records = []
+    for year in range(5):
+        rec = EmissionRec()
+        rec.CO2, rec.CH4, rec.N2O, rec.SOx = year, 10.0 * year, 0.1 * year, 2.0 * year
+        records.append(rec)
+
+    series = EmissionSeries.from_records(records, start_year=2000)
+    assert len(series) == 5
+    assert series.CO2.flags['C_CONTIGUOUS']
+    assert series[3].CH4 == 30.0
+    assert series[-1].SOx == 8.0
+    assert [rec.N2O for rec in series] == [rec.N2O for rec in records]
+    assert series[2:].start_year == 2002
+
+    series[1].CO2 = 7.0
+    assert series.CO2[1] == 7.0
+    with pytest.raises(IndexError):
+        series[5]
+
+
+def test_emission_series_accepted_by_model_functions():
+    co2, ch4, n2o, sox = make_scenarios(1, 100)
+    series = EmissionSeries(co2[0], ch4[0], n2o[0], sox[0])
+    records = list(series)
+
+    co2_concs = co2_emis_to_concs(series, 800, 75.0)
+    np.testing.assert_array_equal(co2_concs, co2_emis_to_concs(records, 800, 75.0))
+    np.testing.assert_array_equal(ch4_emis_to_concs(series), ch4_emis_to_concs(records))
+    np.testing.assert_array_equal(n2o_emis_to_concs(series), n2o_emis_to_concs(records))
+    np.testing.assert_array_equal(calculate_rf(series, co2_concs, ch4_emis_to_concs(series), n2o_emis_to_concs(series)),
+                                  calculate_rf(records, co2_concs, ch4_emis_to_concs(records), n2o_emis_to_concs(records)))
+
+
+def test_emission_series_shape_mismatch():
+    with pytest.raises(SCMError):
+        EmissionSeries(np.zeros(3), np.zeros(3), np.zeros(4), np.zeros(3))
+
+
+def reference_rf(sox, co2_concs, ch4_concs, n2o_concs):
+    # the per-year loops originally used by calculate_rf
+    def overlap(ch4, n2o):
+        return 0.47 * np.log(1 + 2.01e-5 * ((ch4 * n2o) ** 0.75) + 5.31e-15 * ch4 * ((ch4 * n2o) ** 1.52))
+
+    result = np.zeros(len(sox))
+    for i in range(len(sox)):
+        ch4 = 0.036 * (math.sqrt(700.0 + ch4_concs[i]) - math.sqrt(700.0)) - (
+                overlap(700.0 + ch4_concs[i], 270.0) - overlap(700.0, 270.0))
+        n2o = 0.12 * (math.sqrt(270.0 + n2o_concs[i]) - math.sqrt(270.0)) - (
+                overlap(700.0, 270.0 + n2o_concs[i]) - overlap(700.0, 270.0))
+        result[i] = 5.35 * np.log(1 + co2_concs[i] / 278.305) + ch4 + n2o + (-0.002265226 - 0.013558119) * sox[i]
+    return result
+
+
+def test_calculate_rf_components():
+    co2, ch4, n2o, sox = make_scenarios(2, 50)
+    co2_concs, ch4_concs, n2o_concs = 5.0 * co2, ch4, n2o
+
+    total, components = calculate_rf(sox, co2_concs, ch4_concs, n2o_concs, return_components=True)
+    assert sorted(components) == ['CH4', 'CO2', 'N2O', 'SOx']
+    np.testing.assert_allclose(sum(components.values()), total, rtol=1e-12, atol=1e-12)
+    np.testing.assert_array_equal(calculate_rf(sox, co2_concs, ch4_concs, n2o_concs), total)
+    for row in range(2):
+        np.testing.assert_allclose(total[row], reference_rf(sox[row], co2_concs[row], ch4_concs[row], n2o_concs[row]),
+                                   rtol=1e-12, atol=1e-12)
+
+
+def test_ch4_n2o_overlap():
+    assert ch4_n2o_overlap(np.array([700.0, 1800.0]), 270.0).shape == (2,)
+    assert ch4_n2o_overlap(1800.0, 320.0) > ch4_n2o_overlap(700.0, 270.0)
+
+
+def test_response_functions():
+    years = range(30)
+    np.testing.assert_allclose(generate_temp_response_function(30),
+                               [(0.59557 / 8.4007) * np.exp(-i / 8.4007) + (0.40443 / 409.54) * np.exp(-i / 409.54)
+                                for i in years], rtol=1e-14)
+    np.testing.assert_allclose(generate_slr_response(30),
+                               [(0.96677 / 1700.2) * np.exp(-i / 1700.2) + (0.03323 / 33.788) * np.exp(-i / 33.788)
+                                for i in years], rtol=1e-14)
+    np.testing.assert_allclose(generate_biosphere_response(30),
+                               [0.7021 * np.exp(-0.35 * i) + 0.01341 * np.exp(-i / 20.0) - 0.7185 * np.exp(-0.4583 * i) +
+                                0.002932 * np.exp(-0.01 * i) for i in years], rtol=1e-12, atol=1e-15)
+    early = [0.12935 + 0.21898 * np.exp(-i / 0.034569) + 0.17003 * np.exp(-i / 0.26936) +
+             0.24071 * np.exp(-i / 0.96083) + 0.24093 * np.exp(-i / 4.9792) for i in range(2)]
+    late = [0.022936 + 0.24278 * np.exp(-i / 1.2679) + 0.13963 * np.exp(-i / 5.2528) + 0.089318 * np.exp(-i / 18.601) +
+            0.037820 * np.exp(-i / 68.736) + 0.035549 * np.exp(-i / 232.30) for i in range(2, 30)]
+    scale = (1E21 * PgCperppm / 12.0113) / (1.0265E3 * 75.0 * 3.62E14)
+    np.testing.assert_allclose(generate_ocean_response(30, 75.0), np.array(early + late) * scale, rtol=1e-14)
+
+
+def test_response_functions_are_cached():
+    response_function_cache.clear()
+
+    longer = generate_ocean_response(100, 60.0)
+    shorter = generate_ocean_response(40, 60.0)
+    assert not longer.flags.writeable
+    assert np.shares_memory(longer, shorter)
+    np.testing.assert_array_equal(shorter, longer[:40])
+    assert np.shares_memory(generate_temp_response_function(20), generate_temp_response_function(10))
+
+    # an ensemble of depths reuses the cached unscaled response function
+    misses = response_function_cache.misses
+    ensemble = generate_ocean_response(40, np.array([60.0, 80.0]))
+    assert response_function_cache.misses == misses
+    np.testing.assert_allclose(ensemble[0], shorter, rtol=1e-14)
+    np.testing.assert_allclose(ensemble[1], generate_ocean_response(40, 80.0), rtol=1e-14)
+    with pytest.raises(ValueError):
+        ensemble[0, 0] = 1.0
+
+
+def reference_decay_concs(emissions, lifetime, scale):
+    # the loop originally used by ch4_emis_to_concs and n2o_emis_to_concs
+    lam = 1.0 / lifetime
+    result = np.zeros(len(emissions))
+    for i in range(1, len(emissions)):
+        result[i] = result[i - 1] * np.exp(-lam) + emissions[i - 1] * (1.0 - np.exp(-lam)) / (lam * scale)
+    return result
+
+
+@pytest.mark.parametrize('num_years', [0, 1, 100])
+def test_ch4_and_n2o_concs(num_years):
+    emissions = np.random.RandomState(6).uniform(0.0, 300.0, size=num_years)
+
+    np.testing.assert_allclose(ch4_emis_to_concs(emissions), reference_decay_concs(emissions, 10.0, 2.78), rtol=1e-14)
+    np.testing.assert_allclose(n2o_emis_to_concs(emissions), reference_decay_concs(emissions, 114.0, 4.8), rtol=1e-14)
+    assert linear_decay_emis_to_concs(np.zeros((3, num_years)), 10.0, 2.78).shape == (3, num_years)
+
+
+def test_linear_decay_batch():
+    emissions = np.random.RandomState(7).uniform(0.0, 10.0, size=(2, 3, 40))
+    lifetime = np.array([[5.0], [50.0]])
+    scale = np.array([[1.5], [20.0]])
+
+    result = linear_decay_emis_to_concs(emissions, lifetime, scale)
+    assert result.shape == (2, 3, 40)
+    for g in range(2):
+        for s in range(3):
+            np.testing.assert_allclose(result[g, s], reference_decay_concs(emissions[g, s], lifetime[g, 0], scale[g, 0]),
+                                       rtol=1e-13)
+
+
+def test_species_emis_to_concs(monkeypatch):
+    monkeypatch.setattr(scm, 'decay_species', dict(scm.decay_species))
+    register_decay_species('HFC-134a', 14.0, 17.8)
+    ch4, n2o, hfc = make_scenarios(3, 30)[1:]
+
+    concs = species_emis_to_concs({'CH4': ch4, 'N2O': n2o, 'HFC-134a': hfc})
+    np.testing.assert_allclose(concs['CH4'], ch4_emis_to_concs(ch4), rtol=1e-14)
+    np.testing.assert_allclose(concs['N2O'], n2o_emis_to_concs(n2o), rtol=1e-14)
+    np.testing.assert_allclose(concs['HFC-134a'], [reference_decay_concs(e, 14.0, 17.8) for e in hfc], rtol=1e-13)
+
+    series = EmissionSeries(ch4[0], ch4[0], n2o[0], hfc[0])
+    np.testing.assert_array_equal(species_emis_to_concs(series, ['CH4', 'N2O'])['N2O'], n2o_emis_to_concs(n2o[0]))
+    # by default the registered gases of an EmissionSeries are solved
+    concs = species_emis_to_concs(series)
+    assert sorted(concs) == ['CH4', 'N2O']
+    np.testing.assert_array_equal(concs['CH4'], ch4_emis_to_concs(ch4[0]))
+    with pytest.raises(SCMError):
+        species_emis_to_concs({'CFC-11': hfc})
+    with pytest.raises(SCMError):
+        register_decay_species('CFC-11', 0.0, 1.0)
+
+
+@pytest.fixture
+def restore_kernel_backend():
+    pytest.importorskip('numba')
+    yield
+    set_kernel_backend('auto')
+
+
+def test_numba_kernel_matches_numpy(restore_kernel_backend):
+    co2 = make_scenarios(3, 120)[0]
+    depths = np.array([[50.0], [75.0]])
+    fert = np.array([0.287, 0.38, 0.2])
+
+    results = {}
+    for backend in ['numpy', 'numba']:
+        set_kernel_backend(backend)
+        results[backend] = [co2_emis_to_concs_modes(co2, num_years, depths, 0.1042, 60.0, fert, 278.305)
+                            for num_years in [1, 2, 50, 800]]
+    for numpy_concs, numba_concs in zip(results['numpy'], results['numba']):
+        assert numba_concs.shape == (2, 3, 120)
+        np.testing.assert_allclose(numba_concs, numpy_concs, rtol=1e-12, atol=1e-12)
+
+
+def test_kernel_backend_selection():
+    with pytest.raises(SCMError):
+        set_kernel_backend('fortran')
+    assert scm.kernel_backend == 'auto'
+
+    set_kernel_backend('numpy')
+    try:
+        assert scm._kernels(10 ** 6) is None
+    finally:
+        set_kernel_backend('auto')
+
+
+def test_auto_kernel_backend_threshold(monkeypatch):
+    pytest.importorskip('numba')
+    monkeypatch.setattr(scm, '_loaded_kernels', None)
+
+    # small batches are not worth loading the kernels for
+    assert scm._kernels(1) is None
+    assert scm._kernels(scm.numba_member_threshold) is not None
+    # once loaded, they are used for all batches
+    assert scm._kernels(1) is not None
+
+
+@pytest.mark.parametrize('method', ['auto', 'modes'])
+@pytest.mark.parametrize('branch_year', [1, 2, 60])
+def test_run_from_state_matches_full_run(method, branch_year):
+    co2, ch4, n2o, sox = [series[0] for series in make_scenarios(1, 100)]
+    scale = np.random.RandomState(8).uniform(0.5, 1.5, size=(4, 1))
+    scenarios = [np.concatenate([np.broadcast_to(series[:branch_year], (4, branch_year)), series[branch_year:] * scale],
+                                axis=-1) for series in (co2, ch4, n2o, sox)]
+    climate_sensitivity = np.array([[1.1], [0.8]])
+
+    full = run_scenarios(*scenarios, 40, 75.0, method=method, climate_sensitivity=climate_sensitivity)
+    state = spin_up(co2[:branch_year], ch4[:branch_year], n2o[:branch_year], sox[:branch_year], 40, 75.0, method=method,
+                    climate_sensitivity=climate_sensitivity)
+    branched = run_from_state(state, *[scenario[:, branch_year:] for scenario in scenarios])
+
+    assert state.year == branch_year
+    for name in ['co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr']:
+        np.testing.assert_allclose(getattr(branched, name), getattr(full, name)[..., branch_year:], rtol=1e-12,
+                                   atol=1e-12)
+        history = getattr(full, name)[..., :branch_year]
+        np.testing.assert_allclose(np.broadcast_to(getattr(state.results, name), history.shape), history, rtol=1e-12,
+                                   atol=1e-12)
+
+
+def test_co2_modes_state():
+    co2 = make_scenarios(2, 80)[0]
+    full = co2_emis_to_concs_modes(co2, 30, 75.0, 0.1042, 60.0, 0.287, 278.305)
+
+    first, state = co2_emis_to_concs_modes(co2[:, :50], 30, 75.0, 0.1042, 60.0, 0.287, 278.305, return_state=True)
+    second = co2_emis_to_concs_modes(co2[:, 50:], 30, 75.0, 0.1042, 60.0, 0.287, 278.305, state=state)
+    assert state.year == 50
+    assert state.atmos_sea_flux.shape == (2, 30)
+    np.testing.assert_array_equal(np.concatenate([first, second], axis=-1), full)
+
+
+def make_policy_variants(num_years):
+    # a baseline and mitigation variants that start in different years, some of them sharing the start year
+    co2, ch4, n2o, sox = [series[0] for series in make_scenarios(1, num_years)]
+    scenarios = [np.tile(series, (6, 1)) for series in (co2, ch4, n2o, sox)]
+    for row, (start, reduction) in enumerate([(30, 0.5), (30, 0.8), (45, 0.5), (45, 0.5), (59, 0.2)], start=1):
+        for species in (0, 1, 3):
+            scenarios[species][row, start:] *= 1.0 - reduction * np.linspace(0.0, 1.0, num_years - start)
+    return scenarios
+
+
+@pytest.mark.parametrize('num_years', [40, 800])
+def test_run_scenario_tree_matches_run_scenarios(num_years):
+    scenarios = make_policy_variants(60)
+    climate_sensitivity = np.array([[1.1], [0.8]])
+    depth = np.array([[60.0], [75.0]])
+
+    tree = run_scenario_tree(*scenarios, num_years, 75.0, climate_sensitivity=climate_sensitivity)
+    full = run_scenarios(*scenarios, num_years, 75.0, climate_sensitivity=climate_sensitivity)
+    for name in ['co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr']:
+        assert getattr(tree, name).shape == getattr(full, name).shape
+        np.testing.assert_allclose(getattr(tree, name), getattr(full, name), rtol=1e-13, atol=1e-13)
+
+    ensemble = run_scenario_tree(*scenarios, num_years, depth)
+    np.testing.assert_allclose(ensemble.co2_concs, run_scenarios(*scenarios, num_years, depth).co2_concs, rtol=1e-13)
+
+
+def test_run_scenario_tree_invalid_parameters():
+    scenarios = make_policy_variants(60)
+    with pytest.raises(SCMError):
+        run_scenario_tree(*scenarios, 40, np.full(6, 75.0))
+
+
+def test_impulse_response():
+    impulse = np.zeros(50)
+    impulse[0] = 1.0
+
+    np.testing.assert_array_equal(impulse_response('CH4', 50), ch4_emis_to_concs(impulse))
+    np.testing.assert_allclose(impulse_response('temperature', 50, 30), calc_delta_surf_temp(30, impulse, 'direct', 1.0),
+                               rtol=1e-12, atol=1e-15)
+    # shorter Green's functions are the beginning of longer ones
+    np.testing.assert_array_equal(impulse_response('sea level', 20, 30, 'modes'),
+                                  impulse_response('sea level', 50, 30, 'modes')[:20])
+    assert not impulse_response('N2O', 50).flags.writeable
+
+    with pytest.raises(SCMError):
+        impulse_response('CO2', 50)
+
+
+def test_superpose_impulses():
+    base = np.arange(12.0).reshape(2, 6)
+    kernel = np.array([1.0, 0.5])
+
+    result = superpose_impulses(base, kernel, [0, 4, 5], [1.0, 2.0, 3.0])
+
+    assert result.shape == (3, 2, 6)
+    np.testing.assert_array_equal(result[1] - base, [[0, 0, 0, 0, 2, 1]] * 2)
+    np.testing.assert_array_equal(result[2] - base, [[0, 0, 0, 0, 0, 3]] * 2)
+
+
+@pytest.mark.parametrize('species', ['CH4', 'N2O', 'SOx'])
+def test_perturb_emissions_matches_runs(species):
+    scenarios = make_scenarios(2, 120)
+    climate_sensitivity = np.array([[1.1], [0.8]])
+    results = run_scenarios(*scenarios, 800, 75.0, climate_sensitivity=climate_sensitivity)
+    years, amounts = np.array([0, 30, 119]), np.array([5.0, 1.0, 2.0])
+
+    perturbed = perturb_emissions(results, species, years, amounts, 800, climate_sensitivity=climate_sensitivity)
+
+    index = ('CO2', 'CH4', 'N2O', 'SOx').index(species)
+    for member, (year, amount) in enumerate(zip(years, amounts)):
+        emissions = [emis.copy() for emis in scenarios]
+        emissions[index][:, year] += amount
+        expected = run_scenarios(*emissions, 800, 75.0, climate_sensitivity=climate_sensitivity)
+        for name in ('co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr'):
+            np.testing.assert_allclose(getattr(perturbed, name)[member], getattr(expected, name), rtol=1e-10,
+                                       atol=1e-12)
+
+    with pytest.raises(SCMError):
+        perturb_emissions(results, 'CO2', years, amounts, 800)
+
+
+def test_graph_evaluates_changed_stages():
+    co2, ch4, n2o, sox = make_scenarios(3, 200)
+    graph = SCMGraph(800, 75.0)
+
+    results = graph.run(co2, ch4, n2o, sox)
+    assert graph.evaluated == ['co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr']
+    expected = run_scenarios(co2, ch4, n2o, sox, 800, 75.0)
+    for name in ('co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr'):
+        np.testing.assert_array_equal(getattr(results, name), getattr(expected, name))
+
+    graph.run(co2, ch4, n2o, sox)
+    assert graph.evaluated == []
+
+    # arrays may be modified in place between runs
+    sox[:, 100:] *= 1.1
+    results = graph.run(co2, ch4, n2o, sox)
+    assert graph.evaluated == ['rf', 'delta_temperature', 'slr']
+    np.testing.assert_array_equal(results.delta_temperature,
+                                  run_scenarios(co2, ch4, n2o, sox, 800, 75.0).delta_temperature)
+
+    graph.run(co2, ch4, 1.1 * n2o, sox)
+    assert graph.evaluated == ['n2o_concs', 'rf', 'delta_temperature', 'slr']
+
+    results = graph.run(co2, ch4, 1.1 * n2o, sox, climate_sensitivity=1.2)
+    assert graph.evaluated == ['delta_temperature', 'slr']
+    np.testing.assert_array_equal(
+        results.slr, run_scenarios(co2, ch4, 1.1 * n2o, sox, 800, 75.0, climate_sensitivity=1.2).slr)
+    assert not results.slr.flags.writeable
+
+    with pytest.raises(SCMError):
+        graph.run(co2, ch4, n2o, sox, sensitivity=1.2)
+
+
+@pytest.mark.parametrize('num_years', [30, 800])
+def test_stepper_matches_run_scenarios(num_years):
+    scenarios = make_scenarios(3, 100)
+    climate_sensitivity = np.array([[1.1], [0.8]])
+    full = run_scenarios(*scenarios, num_years, 75.0, method='modes', climate_sensitivity=climate_sensitivity)
+
+    stepper = SCMStepper(num_years, 75.0, climate_sensitivity=climate_sensitivity)
+    steps = [stepper.step(*[series[:, year] for series in scenarios]) for year in range(100)]
+    assert stepper.year == 100
+    for name in ['co2_concs', 'ch4_concs', 'n2o_concs', 'rf', 'delta_temperature', 'slr']:
+        stepped = np.stack([getattr(results, name) for results in steps], axis=-1)
+        np.testing.assert_allclose(stepped, np.broadcast_to(getattr(full, name), stepped.shape), rtol=1e-12, atol=1e-12)
+
+
+def test_stepper_from_state():
+    co2, ch4, n2o, sox = [series[0] for series in make_scenarios(1, 100)]
+    full = run_scenarios(co2, ch4, n2o, sox, 40, 75.0)
+
+    stepper = SCMStepper.from_state(spin_up(co2[:60], ch4[:60], n2o[:60], sox[:60], 40, 75.0))
+    steps = [stepper.step(co2[year], ch4[year], n2o[year], sox[year]) for year in range(60, 100)]
+    for name in ['co2_concs', 'rf', 'delta_temperature', 'slr']:
+        np.testing.assert_allclose([getattr(results, name) for results in steps], getattr(full, name)[60:], rtol=1e-12,
+                                   atol=1e-12)